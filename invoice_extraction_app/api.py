@@ -3,27 +3,43 @@ import frappe
 import json
 import os
 from frappe import _
-from frappe.utils import now
-import google.generativeai as genai
+from frappe.utils import flt, now
+import hashlib
+import time
 import traceback
-from PIL import Image
 import io
+from invoice_extraction_app import sdk
+from invoice_extraction_app.bulk_items import set_extracted_items
+from invoice_extraction_app.chunking import (
+    extract_complete,
+    extract_in_chunks,
+    is_truncated,
+    output_budget,
+    split_for_budget,
+)
+from invoice_extraction_app.gemini_cache import cached_model, forget as forget_cached_prompt
+from invoice_extraction_app.utils import is_retryable_error
+from invoice_extraction_app.instrumentation import count, note, record_stage, stage, traced
+from invoice_extraction_app.pdf_text import usable_text_layer
+from invoice_extraction_app.raw_archive import archive, record, record_answer, recorded
+from invoice_extraction_app.settings_cache import get_settings
+from invoice_extraction_app.supplier_templates import extract_with_template
 
 @frappe.whitelist()
-def extract_invoice_data_only(file_url: str) -> dict:
+@traced("Gemini")
+def extract_invoice_data_only(file_url: str, model_name: str = None, timeout: float = None) -> dict:
     """
     ط§ط³طھط®ط±ط§ط¬ ط§ظ„ط¨ظٹط§ظ†ط§طھ ظ…ظ† ط§ظ„ظ…ظ„ظپ ظˆط¥ط±ط¬ط§ط¹ظ‡ط§ ظپظ‚ط· (ط¨ط¯ظˆظ† ط¥ظ†ط´ط§ط، ط³ط¬ظ„)
     """
     try:
         # ط§ظ„طھط­ظ‚ظ‚ ظ…ظ† ظˆط¬ظˆط¯ Gemini Settings
-        if not frappe.db.exists("Gemini Settings", "Gemini Settings"):
+        settings = get_settings("Gemini Settings")
+        if not settings:
             return {
                 "success": False,
                 "error": "Gemini Settings not found. Please create it first."
             }
         
-        settings = frappe.get_single("Gemini Settings")
-        
         if not settings.gemini_api_key:
             return {
                 "success": False,
@@ -31,30 +47,56 @@ def extract_invoice_data_only(file_url: str) -> dict:
             }
         
         # طھظƒظˆظٹظ† Gemini
-        genai.configure(api_key=settings.gemini_api_key)
+        sdk.genai().configure(api_key=settings.gemini_api_key)
         
         # ظ‚ط±ط§ط،ط© ط§ظ„ظ…ظ„ظپ
-        file_doc = frappe.get_doc("File", {"file_url": file_url})
-        file_path = file_doc.get_full_path()
-        
-        with open(file_path, 'rb') as f:
-            file_bytes = f.read()
+        with stage("file_read"):
+            file_doc = frappe.get_doc("File", {"file_url": file_url})
+            file_path = file_doc.get_full_path()
+            
+            with open(file_path, 'rb') as f:
+                file_bytes = f.read()
+        note(payload_bytes=len(file_bytes))
         
         file_ext = os.path.splitext(file_path)[1].lower()
         
+        # Born-digital PDFs: send the text layer instead of the document
+        text_layer = None
+        if file_ext == '.pdf':
+            with stage("preprocess"):
+                text_layer = usable_text_layer(file_bytes)
+        if text_layer:
+            note(text_source="Text Layer", page_count=text_layer.pages)
+        else:
+            note(text_source="Vision")
+        record(text=text_layer.text if text_layer else None)
+        
+        # Known supplier layout: read the text deterministically, no model call
+        template_data = extract_with_template(text_layer.text) if text_layer else None
+        if template_data:
+            return {
+                "success": True,
+                "data": template_data,
+                "model_used": f"Template: {template_data['extraction_template']}",
+                "extraction_time": now()
+            }
+        
         # ط§ط³طھط®ط±ط§ط¬ ط§ظ„ط¨ظٹط§ظ†ط§طھ
         result = extract_with_gemini_frappe(
             file_bytes=file_bytes,
             file_ext=file_ext,
-            model_name=settings.selected_model,
+            model_name=model_name or settings.selected_model,
             temperature=settings.temperature,
-            settings=settings
+            settings=settings,
+            timeout=timeout,
+            text_layer=text_layer.text if text_layer else None
         )
         
         if not result.get("success"):
             return {
                 "success": False,
-                "error": result.get("error", "Extraction failed")
+                "error": result.get("error", "Extraction failed"),
+                "retryable": result.get("retryable", False)
             }
         
         extracted_data = result.get("data", {})
@@ -63,7 +105,7 @@ def extract_invoice_data_only(file_url: str) -> dict:
         return {
             "success": True,
             "data": extracted_data,
-            "model_used": settings.selected_model,
+            "model_used": model_name or settings.selected_model,
             "extraction_time": now()
         }
         
@@ -71,14 +113,78 @@ def extract_invoice_data_only(file_url: str) -> dict:
         frappe.log_error(f"Extraction error: {str(e)}", "Invoice Extraction")
         return {
             "success": False,
-            "error": str(e)
+            "error": str(e),
+            "retryable": is_retryable_error(e)
         }
 
+
+GEMINI_FILE_CACHE_KEY = "invoice_extraction:gemini:file:{}"
+GEMINI_FILE_API_THRESHOLD_MB = 5
+# Gemini deletes uploaded files after 48 hours
+GEMINI_FILE_TTL = 47 * 3600
+GEMINI_FILE_EXPIRY_MARGIN = 3600
+GEMINI_FILE_PROCESSING_WAIT = 60
+
+
+def _gemini_file_key(file_bytes: bytes, settings) -> str:
+    # Uploaded files belong to the API key's project
+    digest = hashlib.sha256((settings.gemini_api_key or "").encode() + b"\0" + file_bytes).hexdigest()
+    return GEMINI_FILE_CACHE_KEY.format(digest)
+
+
+def _gemini_file_part(file_bytes: bytes, mime_type: str, settings):
+    """
+    A `file_data` part for PDFs above the File API threshold, uploaded once per content hash.
+
+    Retries, re-extractions and continuation passes reuse the uploaded file
+    for its lifetime instead of re-sending the bytes. None: send inline.
+    """
+    threshold = settings.get("file_api_threshold_mb")
+    threshold = GEMINI_FILE_API_THRESHOLD_MB if threshold is None else flt(threshold)
+    if mime_type != "application/pdf" or not threshold or len(file_bytes) < threshold * 1024 * 1024:
+        return None
+
+    key = _gemini_file_key(file_bytes, settings)
+    part = frappe.cache().get_value(key)
+    if part:
+        return {"file_data": part}
+
+    try:
+        with stage("upload"):
+            uploaded = sdk.genai().upload_file(io.BytesIO(file_bytes), mime_type=mime_type, resumable=True)
+            deadline = time.time() + GEMINI_FILE_PROCESSING_WAIT
+            while getattr(uploaded.state, "name", "") == "PROCESSING" and time.time() < deadline:
+                time.sleep(1)
+                uploaded = sdk.genai().get_file(uploaded.name)
+        if getattr(uploaded.state, "name", "ACTIVE") != "ACTIVE":
+            raise Exception(f"Gemini file {uploaded.name} is {uploaded.state.name}")
+    except Exception as e:
+        # The inline request still works for anything under the request size limit
+        frappe.log_error(f"Gemini file upload failed: {str(e)}", "Gemini Extraction")
+        return None
+
+    ttl = GEMINI_FILE_TTL
+    expires = getattr(uploaded, "expiration_time", None)
+    if expires:
+        ttl = min(ttl, int(expires.timestamp() - time.time()) - GEMINI_FILE_EXPIRY_MARGIN)
+    part = {"mime_type": mime_type, "file_uri": uploaded.uri}
+    if ttl > 0:
+        frappe.cache().set_value(key, part, expires_in_sec=ttl)
+    return {"file_data": part}
+
+
+def _forget_gemini_file(file_bytes: bytes, settings) -> None:
+    frappe.cache().delete_value(_gemini_file_key(file_bytes, settings))
+
+
 def extract_with_gemini_frappe(file_bytes: bytes, file_ext: str, model_name: str, 
-                               temperature: float, settings) -> dict:
+                               temperature: float, settings, timeout: float = None,
+                               text_layer: str = None) -> dict:
     """
     ط§ط³طھط®ط±ط§ط¬ ط§ظ„ط¨ظٹط§ظ†ط§طھ ط¨ط§ط³طھط®ط¯ط§ظ… Gemini ظ…ط¹ ط¥ط¹ط¯ط§ط¯ط§طھ ظ‚ط§ط¨ظ„ط© ظ„ظ„طھط®طµظٹطµ
     """
+    t0 = time.perf_counter()
+    responses = []
     try:
         # طھط­ط¯ظٹط¯ ظ†ظˆط¹ MIME
         if file_ext == '.pdf':
@@ -94,7 +200,7 @@ def extract_with_gemini_frappe(file_bytes: bytes, file_ext: str, model_name: str
             }
         
         # ط§ط®طھظٹط§ط± ط§ظ„ظ†ظ…ظˆط°ط¬
-        model = genai.GenerativeModel(model_name)
+        model = sdk.genai().GenerativeModel(model_name)
         
         # ط§ط³طھط®ط¯ط§ظ… ط§ظ„طھط¹ظ„ظٹظ…ط§طھ ظ…ظ† Gemini Settings
         system_instruction = getattr(settings, 'system_instruction', 
@@ -175,150 +281,287 @@ def extract_with_gemini_frappe(file_bytes: bytes, file_ext: str, model_name: str
 
 {prompt_instructions}"""
         
+        budget = output_budget()
         generation_config = {
             "temperature": temperature,
             "top_p": 0.95,
             "top_k": 40,
-            "max_output_tokens": 4000,
+            "max_output_tokens": budget,
         }
         
         # طھط³ط¬ظٹظ„ ط§ظ„ظ€ Prompt ط§ظ„ظ…ط³طھط®ط¯ظ… ظ„ظ„طھطµط­ظٹط­
         frappe.logger().info(f"Using prompt for extraction: {prompt[:500]}...")
         
         # ط¥ط±ط³ط§ظ„ ط§ظ„ط·ظ„ط¨
-        response = model.generate_content(
-            contents=[
-                {"mime_type": mime_type, "data": file_bytes},
-                prompt
-            ],
-            generation_config=generation_config
-        )
-        
-        response_text = response.text.strip()
-        
-        # طھط³ط¬ظٹظ„ ط§ظ„ط§ط³طھط¬ط§ط¨ط© ظ„ظ„طھطµط­ظٹط­
-        frappe.logger().info(f"Gemini response: {response_text[:500]}...")
-        
-        # ط§ط³طھط®ط±ط§ط¬ JSON
-        json_str = response_text
-        if '```json' in json_str:
-            json_str = json_str.split('```json')[1].split('```')[0].strip()
-        elif '```' in json_str:
-            json_str = json_str.split('```')[1].split('```')[0].strip()
-        
-        # ط¥ظٹط¬ط§ط¯ ظƒط§ط¦ظ† JSON
-        start_idx = json_str.find('{')
-        end_idx = json_str.rfind('}') + 1
-        if start_idx != -1 and end_idx > start_idx:
-            json_str = json_str[start_idx:end_idx]
-        
-        # ط¥طµظ„ط§ط­ ط§ظ„ظ…ط´ط§ظƒظ„ ط§ظ„ط´ط§ط¦ط¹ط©
-        json_str = json_str.replace("'", '"')
-        json_str = json_str.replace("None", "null")
-        json_str = json_str.replace("True", "true")
-        json_str = json_str.replace("False", "false")
-        
-        data = json.loads(json_str)
-        
-        # 1. ظ…ط¹ط§ظ„ط¬ط© ط§ظ„ط£طµظ†ط§ظپ
-        items = data.get("items", [])
-        
-        # 1.1. ط§ظ„طھط£ظƒط¯ ظ…ظ† ط£ظ† ظƒظ„ طµظ†ظپ ظ„ط¯ظٹظ‡ ط§ظ„ط­ظ‚ظˆظ„ ط§ظ„ظ…ط·ظ„ظˆط¨ط©
-        for item in items:
-            # طھط­ظˆظٹظ„ ط§ظ„ظ‚ظٹظ… ط¥ظ„ظ‰ ط£ط±ظ‚ط§ظ…
-            quantity = float(item.get("quantity", 0))
-            unit_price = float(item.get("unit_price", 0))
-            
-            # ط­ط³ط§ط¨ item_total ط¥ط°ط§ ظƒط§ظ† ظ†ط§ظ‚طµط§ظ‹
-            if not item.get("item_total") or float(item.get("item_total", 0)) == 0:
-                item["item_total"] = round(quantity * unit_price, 2)
-            else:
-                item["item_total"] = round(float(item.get("item_total", 0)), 2)
-            
-            # ظ…ط¹ط§ظ„ط¬ط© tax_amount ظ„ظ„طµظ†ظپ
-            if not item.get("tax_amount"):
-                item["tax_amount"] = 0
+        request_kwargs = {"request_options": {"timeout": timeout}} if timeout else {}
+        # The static prompt from Gemini's context cache when possible (gemini_cache.py)
+        cached = cached_model(model_name, prompt)
+        record_stage("preprocess", t0)
+        note(model=model_name)
+        record(budget=budget)
+
+        # Vision path: the document itself, uploaded through the File API when large (read on first use)
+        document = None
+
+        def contents_for(source_text, instruction):
+            # A cached model already carries the prompt as its system instruction
+            head = instruction.strip() if cached is not None else prompt + instruction
+            if source_text:
+                contents = [head, f"Invoice text (from the PDF text layer):\n\n{source_text}"]
             else:
-                item["tax_amount"] = round(float(item.get("tax_amount", 0)), 2)
+                contents = [document, head]
+            return [c for c in contents if c]
+
+        def call(source_text, instruction):
+            return (cached or model).generate_content(
+                contents=contents_for(source_text, instruction),
+                generation_config=generation_config,
+                **request_kwargs
+            )
+
+        def generate(source_text, instruction):
+            nonlocal cached, document
+            if not source_text and document is None:
+                document = _gemini_file_part(file_bytes, mime_type, settings) or {"mime_type": mime_type, "data": file_bytes}
+            with stage("generation"):
+                try:
+                    response = call(source_text, instruction)
+                except Exception as e:
+                    message = str(e).lower()
+                    if cached is not None and "cache" in message:
+                        # The prompt cache is gone (expired or deleted early): drop it and send the prompt inline
+                        forget_cached_prompt(model_name, prompt)
+                        cached = None
+                    elif document and "file_data" in document and "file" in message:
+                        # Same for an uploaded document: send the bytes inline this time
+                        _forget_gemini_file(file_bytes, settings)
+                        document = {"mime_type": mime_type, "data": file_bytes}
+                    else:
+                        raise
+                    response = call(source_text, instruction)
+            usage = getattr(response, "usage_metadata", None)
+            count(
+                tokens_in=getattr(usage, "prompt_token_count", 0) or 0,
+                tokens_out=getattr(usage, "candidates_token_count", 0) or 0,
+                tokens_cached=getattr(usage, "cached_content_token_count", 0) or 0,
+            )
+            candidates = getattr(response, "candidates", None) or []
+            truncated = bool(candidates) and is_truncated(getattr(candidates[0], "finish_reason", None))
+            try:
+                text = response.text.strip()
+            except ValueError:
+                # Cut off before the first text part
+                text = ""
+            responses.append(text)
+            record_answer(text, truncated)
             
-            # ط­ط³ط§ط¨ total_with_tax ظ„ظ„طµظ†ظپ
-            item_total = float(item["item_total"])
-            item_tax = float(item["tax_amount"])
-            item["total_with_tax"] = round(item_total + item_tax, 2)
-        
-        # 2. ط­ط³ط§ط¨ ط§ظ„ط¥ط¬ظ…ط§ظ„ظٹط§طھ
-        # 2.1. ط­ط³ط§ط¨ subtotal ظ…ظ† ط§ظ„ط£طµظ†ط§ظپ
-        calculated_subtotal = sum(float(item.get("item_total", 0)) for item in items)
-        calculated_subtotal = round(calculated_subtotal, 2)
-        
-        # طھط­ط¯ظٹط« subtotal ط¥ط°ط§ ظƒط§ظ† ظ†ط§ظ‚طµط§ظ‹ ط£ظˆ ظ…ط®طھظ„ظپط§ظ‹
-        subtotal = float(data.get("subtotal", 0))
-        if subtotal == 0 or abs(subtotal - calculated_subtotal) > 0.01:
-            data["subtotal"] = calculated_subtotal
-        else:
-            data["subtotal"] = round(subtotal, 2)
-        
-        subtotal = data["subtotal"]
-        
-        # 2.2. ط­ط³ط§ط¨ ط¥ط¬ظ…ط§ظ„ظٹ ط§ظ„ط¶ط±ظٹط¨ط© ظ…ظ† ط§ظ„ط£طµظ†ط§ظپ
-        calculated_tax = sum(float(item.get("tax_amount", 0)) for item in items)
-        calculated_tax = round(calculated_tax, 2)
-        
-        # طھط­ط¯ظٹط« tax_amount ط¥ط°ط§ ظƒط§ظ† ظ†ط§ظ‚طµط§ظ‹ ط£ظˆ ظ…ط®طھظ„ظپط§ظ‹
-        tax_amount = float(data.get("tax_amount", 0))
-        if abs(tax_amount - calculated_tax) > 0.01 and calculated_tax > 0:
-            data["tax_amount"] = calculated_tax
-        else:
-            data["tax_amount"] = round(tax_amount, 2)
-        
-        tax_amount = data["tax_amount"]
-        
-        # 2.3. ط­ط³ط§ط¨ total_amount
-        total_amount = float(data.get("total_amount", 0))
-        calculated_total = round(subtotal + tax_amount, 2)
-        
-        if total_amount == 0 or abs(total_amount - calculated_total) > 0.01:
-            data["total_amount"] = calculated_total
-        else:
-            data["total_amount"] = round(total_amount, 2)
-        
-        # 3. ط§ظ„طھط­ظ‚ظ‚ ط§ظ„ظ†ظ‡ط§ط¦ظٹ ظ…ظ† ط§ظ„ط­ط³ط§ط¨ط§طھ
-        data["validation"] = {
-            "subtotal_calculated": calculated_subtotal,
-            "subtotal_extracted": round(subtotal, 2),
-            "tax_calculated": calculated_tax,
-            "tax_extracted": round(tax_amount, 2),
-            "total_calculated": calculated_total,
-            "total_extracted": round(data["total_amount"], 2),
-            "subtotal_match": abs(calculated_subtotal - subtotal) < 0.01,
-            "tax_match": abs(calculated_tax - tax_amount) < 0.01,
-            "total_match": abs(calculated_total - data["total_amount"]) < 0.01
-        }
-        
-        # 4. ط¥ط¶ط§ظپط© طھظپط§طµظٹظ„ ط§ظ„ط¹ظ…ظ„ط© ط¥ط°ط§ ظƒط§ظ†طھ ظ†ط§ظ‚طµط©
-        if not data.get("currency"):
-            data["currency"] = "SAR"  # ظ‚ظٹظ…ط© ط§ظپطھط±ط§ط¶ظٹط©
-        
+            # طھط³ط¬ظٹظ„ ط§ظ„ط§ط³طھط¬ط§ط¨ط© ظ„ظ„طھطµط­ظٹط­
+            frappe.logger().info(f"Gemini response: {text[:500]}...")
+            return text, truncated
+
+        data = _structure(generate, text_layer, budget)
+        data = _post_process(data)
+
         return {
             "success": True,
             "data": data
         }
         
     except json.JSONDecodeError as e:
+        response_text = responses[-1] if responses else ""
         frappe.log_error(f"JSON decode error: {str(e)}\nResponse text: {response_text}", "Gemini Extraction")
         return {
             "success": False,
             "error": f"Failed to parse JSON: {str(e)}",
-            "raw_response": response_text[:500] if 'response_text' in locals() else "No response"
+            "raw_response": response_text[:500] if responses else "No response"
         }
     except Exception as e:
         frappe.log_error(f"Gemini API error: {str(e)}", "Gemini Extraction")
         return {
             "success": False,
             "error": str(e),
+            "retryable": is_retryable_error(e),
             "traceback": traceback.format_exc()
         }
 
+
+def _parse_response(response_text: str) -> dict:
+    """A Gemini answer as JSON (fenced or with stray text around it); JSONDecodeError when it does not parse."""
+    t0 = time.perf_counter()
+    # ط§ط³طھط®ط±ط§ط¬ JSON
+    json_str = response_text
+    if '```json' in json_str:
+        json_str = json_str.split('```json')[1].split('```')[0].strip()
+    elif '```' in json_str:
+        json_str = json_str.split('```')[1].split('```')[0].strip()
+
+    # ط¥ظٹط¬ط§ط¯ ظƒط§ط¦ظ† JSON
+    start_idx = json_str.find('{')
+    end_idx = json_str.rfind('}') + 1
+    if start_idx != -1 and end_idx > start_idx:
+        json_str = json_str[start_idx:end_idx]
+
+    # ط¥طµظ„ط§ط­ ط§ظ„ظ…ط´ط§ظƒظ„ ط§ظ„ط´ط§ط¦ط¹ط©
+    json_str = json_str.replace("'", '"')
+    json_str = json_str.replace("None", "null")
+    json_str = json_str.replace("True", "true")
+    json_str = json_str.replace("False", "false")
+    try:
+        return json.loads(json_str)
+    finally:
+        record_stage("parse", t0)
+
+
+def _structure(generate, text_layer: str, budget: int) -> dict:
+    """
+    The answers `generate` gives (a live Gemini call, or the archive on
+    replay) parsed into one invoice: continued after a cut-off answer, or the
+    text layer read in fragments. JSONDecodeError when nothing parses.
+    """
+    answers = []
+
+    def keep(source_text, instruction):
+        text, truncated = generate(source_text, instruction)
+        answers.append(text)
+        return text, truncated
+
+    # Long item tables: continue after a cut-off answer, or read the text layer in fragments
+    chunks = split_for_budget(text_layer, budget) if text_layer else []
+    if len(chunks) > 1:
+        data = extract_in_chunks(keep, text_layer, chunks, _parse_response)
+    else:
+        data = extract_complete(keep, text_layer, _parse_response)
+    if data is None:
+        # Raises the JSONDecodeError the caller reports
+        data = _parse_response(answers[-1] if answers else "")
+    return data
+
+
+def _post_process(data: dict) -> dict:
+    """Item and invoice totals recomputed and checked against what the document states."""
+    t0 = time.perf_counter()
+
+    # 1. ظ…ط¹ط§ظ„ط¬ط© ط§ظ„ط£طµظ†ط§ظپ
+    items = data.get("items", [])
+    # What the document itself says, before the totals are replaced by the item sums
+    stated = {k: round(_safe_float(data.get(k)), 2) for k in ("subtotal", "tax_amount", "total_amount")}
+    
+    # 1.1. ط§ظ„طھط£ظƒط¯ ظ…ظ† ط£ظ† ظƒظ„ طµظ†ظپ ظ„ط¯ظٹظ‡ ط§ظ„ط­ظ‚ظˆظ„ ط§ظ„ظ…ط·ظ„ظˆط¨ط©
+    for item in items:
+        # طھط­ظˆظٹظ„ ط§ظ„ظ‚ظٹظ… ط¥ظ„ظ‰ ط£ط±ظ‚ط§ظ…
+        quantity = float(item.get("quantity", 0))
+        unit_price = float(item.get("unit_price", 0))
+        
+        # ط­ط³ط§ط¨ item_total ط¥ط°ط§ ظƒط§ظ† ظ†ط§ظ‚طµط§ظ‹
+        if not item.get("item_total") or float(item.get("item_total", 0)) == 0:
+            item["item_total"] = round(quantity * unit_price, 2)
+        else:
+            item["item_total"] = round(float(item.get("item_total", 0)), 2)
+        
+        # ظ…ط¹ط§ظ„ط¬ط© tax_amount ظ„ظ„طµظ†ظپ
+        if not item.get("tax_amount"):
+            item["tax_amount"] = 0
+        else:
+            item["tax_amount"] = round(float(item.get("tax_amount", 0)), 2)
+        
+        # ط­ط³ط§ط¨ total_with_tax ظ„ظ„طµظ†ظپ
+        item_total = float(item["item_total"])
+        item_tax = float(item["tax_amount"])
+        item["total_with_tax"] = round(item_total + item_tax, 2)
+
+    row_mismatches = [
+        i for i, item in enumerate(items)
+        if abs(float(item["item_total"]) - float(item.get("quantity", 0)) * float(item.get("unit_price", 0))) > 0.01
+    ]
+    
+    # 2. ط­ط³ط§ط¨ ط§ظ„ط¥ط¬ظ…ط§ظ„ظٹط§طھ
+    # 2.1. ط­ط³ط§ط¨ subtotal ظ…ظ† ط§ظ„ط£طµظ†ط§ظپ
+    calculated_subtotal = sum(float(item.get("item_total", 0)) for item in items)
+    calculated_subtotal = round(calculated_subtotal, 2)
+    
+    # طھط­ط¯ظٹط« subtotal ط¥ط°ط§ ظƒط§ظ† ظ†ط§ظ‚طµط§ظ‹ ط£ظˆ ظ…ط®طھظ„ظپط§ظ‹
+    subtotal = float(data.get("subtotal", 0))
+    if subtotal == 0 or abs(subtotal - calculated_subtotal) > 0.01:
+        data["subtotal"] = calculated_subtotal
+    else:
+        data["subtotal"] = round(subtotal, 2)
+    
+    subtotal = data["subtotal"]
+    
+    # 2.2. ط­ط³ط§ط¨ ط¥ط¬ظ…ط§ظ„ظٹ ط§ظ„ط¶ط±ظٹط¨ط© ظ…ظ† ط§ظ„ط£طµظ†ط§ظپ
+    calculated_tax = sum(float(item.get("tax_amount", 0)) for item in items)
+    calculated_tax = round(calculated_tax, 2)
+    
+    # طھط­ط¯ظٹط« tax_amount ط¥ط°ط§ ظƒط§ظ† ظ†ط§ظ‚طµط§ظ‹ ط£ظˆ ظ…ط®طھظ„ظپط§ظ‹
+    tax_amount = float(data.get("tax_amount", 0))
+    if abs(tax_amount - calculated_tax) > 0.01 and calculated_tax > 0:
+        data["tax_amount"] = calculated_tax
+    else:
+        data["tax_amount"] = round(tax_amount, 2)
+    
+    tax_amount = data["tax_amount"]
+    
+    # 2.3. ط­ط³ط§ط¨ total_amount
+    total_amount = float(data.get("total_amount", 0))
+    calculated_total = round(subtotal + tax_amount, 2)
+    
+    if total_amount == 0 or abs(total_amount - calculated_total) > 0.01:
+        data["total_amount"] = calculated_total
+    else:
+        data["total_amount"] = round(total_amount, 2)
+    
+    # 3. ط§ظ„طھط­ظ‚ظ‚ ط§ظ„ظ†ظ‡ط§ط¦ظٹ ظ…ظ† ط§ظ„ط­ط³ط§ط¨ط§طھ
+    data["validation"] = {
+        "subtotal_calculated": calculated_subtotal,
+        "subtotal_extracted": round(subtotal, 2),
+        "tax_calculated": calculated_tax,
+        "tax_extracted": round(tax_amount, 2),
+        "total_calculated": calculated_total,
+        "total_extracted": round(data["total_amount"], 2),
+        "subtotal_match": abs(calculated_subtotal - subtotal) < 0.01,
+        "tax_match": abs(calculated_tax - tax_amount) < 0.01,
+        "total_match": abs(calculated_total - data["total_amount"]) < 0.01,
+        "stated": stated,
+        "row_mismatches": row_mismatches
+    }
+    
+    # 4. ط¥ط¶ط§ظپط© طھظپط§طµظٹظ„ ط§ظ„ط¹ظ…ظ„ط© ط¥ط°ط§ ظƒط§ظ†طھ ظ†ط§ظ‚طµط©
+    if not data.get("currency"):
+        data["currency"] = "SAR"  # ظ‚ظٹظ…ط© ط§ظپطھط±ط§ط¶ظٹط©
+    
+    record_stage("parse", t0)
+    note(item_count=len(items))
+    return data
+
+
+def answer_json(prompt: str, max_tokens: int):
+    """One short text-only Gemini call (targeted corrections); the parsed JSON answer or None."""
+    settings = get_settings("Gemini Settings")
+    sdk.genai().configure(api_key=settings.gemini_api_key)
+    model_name = settings.selected_model or "gemini-2.5-flash"
+    note(model=model_name)
+
+    model = sdk.genai().GenerativeModel(model_name)
+    with stage("generation"):
+        response = model.generate_content(
+            prompt,
+            generation_config={
+                "temperature": settings.temperature,
+                "max_output_tokens": max_tokens,
+                "response_mime_type": "application/json",
+            },
+        )
+    usage = getattr(response, "usage_metadata", None)
+    count(
+        tokens_in=getattr(usage, "prompt_token_count", 0) or 0,
+        tokens_out=getattr(usage, "candidates_token_count", 0) or 0,
+    )
+    try:
+        return json.loads(response.text)
+    except ValueError:
+        return None
+
+
 # ط¨ط§ظ‚ظٹ ط§ظ„ط¯ظˆط§ظ„ طھط¨ظ‚ظ‰ ظƒظ…ط§ ظ‡ظٹ ط¨ط¯ظˆظ† طھط؛ظٹظٹط±
 @frappe.whitelist()
 def create_purchase_invoice_draft(invoice_name: str) -> dict:
@@ -671,7 +914,8 @@ def _apply_extracted_data_to_invoice(inv, data: dict) -> None:
     supplier_name = (data.get("supplier_ar") or data.get("supplier") or "").strip()
 
     inv.supplier_name = supplier_name
-    inv.supplier_link = _match_supplier_link(supplier_name)
+    with stage("matching"):
+        inv.supplier_link = _match_supplier_link(supplier_name)
     inv.invoice_number = (data.get("invoice_number") or "").strip()
 
     inv.invoice_date = data.get("date") or None
@@ -688,10 +932,11 @@ def _apply_extracted_data_to_invoice(inv, data: dict) -> None:
     else:
         inv.currency = ""
 
-    inv.extracted_data = json.dumps(data, ensure_ascii=False, indent=2)
+    # Virtual field: stored compressed by the controller (payloads.py)
+    inv.extracted_data = json.dumps(data, ensure_ascii=False)
 
-    # Items
-    inv.set("items", [])
+    # Items: existing rows are reused so unchanged lines are not rewritten (bulk_items.py)
+    rows, links = [], {}
     for it in (data.get("items") or []):
         desc = (it.get("description_ar") or it.get("description") or "").strip()
         if not desc:
@@ -703,23 +948,29 @@ def _apply_extracted_data_to_invoice(inv, data: dict) -> None:
         tax_amount = _safe_float(it.get("tax_amount"), 0.0)
         total_with_tax = _safe_float(it.get("total_with_tax"), amount + tax_amount)
 
-        item_link = _match_item_link(desc)
-
-        row = inv.append("items", {})
-        row.extracted_text = desc
-        row.item_link = item_link
-        row.quantity = qty
-        row.rate = rate
-        row.amount = amount
-        row.tax_amount = tax_amount
-        row.total_with_tax = total_with_tax
-        row.language = "ar" if it.get("description_ar") else "en"
-        row.taxable = 1 if tax_amount > 0 else 0
+        if desc not in links:
+            with stage("matching"):
+                links[desc] = _match_item_link(desc)
+
+        rows.append({
+            "extracted_text": desc,
+            "item_link": links[desc],
+            "quantity": qty,
+            "rate": rate,
+            "amount": amount,
+            "tax_amount": tax_amount,
+            "total_with_tax": total_with_tax,
+            "language": "ar" if it.get("description_ar") else "en",
+            "taxable": 1 if tax_amount > 0 else 0,
+        })
+    set_extracted_items(inv, rows)
 
     inv.status = "Ready"
 
 
 @frappe.whitelist()
+@traced("Gemini")
+@recorded
 def extract_and_update_extracted_invoice(invoice_name: str) -> dict:
     """Server-side extraction + write results into Extracted Invoice."""
     try:
@@ -738,8 +989,10 @@ def extract_and_update_extracted_invoice(invoice_name: str) -> dict:
         inv.extraction_model = res.get("model_used") or ""
         _apply_extracted_data_to_invoice(inv, data)
 
-        inv.save(ignore_permissions=True, ignore_version=True)
-        frappe.db.commit()
+        with stage("save"):
+            inv.save(ignore_permissions=True, ignore_version=True)
+            archive(inv.name, "Gemini", inv.extraction_model)
+            frappe.db.commit()
 
         return {"success": True, "invoice": inv.name, "updated": True, "extraction_time": res.get("extraction_time")}
 
@@ -0,0 +1,161 @@
+# invoice_extraction_app/auto_extract.py
+"""
+Opt-in extraction on upload ("Auto Extract on Upload" in Extraction Settings).
+
+`after_insert` of Extracted Invoice (and of a File attached to one) adds the
+invoice to a pending set in Redis. A single collector job per site waits
+until uploads have been quiet for the debounce window, then splits the set
+into batch jobs of `auto_extract_batch_size` invoices. A hundred uploads
+become four or five batch jobs that each keep one warm worker and provider
+client, instead of a hundred cold jobs.
+
+Invoices created by Telegram or `ingest-invoices` set
+`flags.skip_auto_extract`; those paths queue their own extraction.
+"""
+from __future__ import annotations
+
+import os
+import time
+from typing import List
+
+import frappe
+from frappe.utils import cint
+
+from invoice_extraction_app.costing import extraction_queue
+from invoice_extraction_app.settings_cache import get_settings
+
+PENDING_KEY = "invoice_extraction:auto_extract:pending"
+LAST_UPLOAD_KEY = "invoice_extraction:auto_extract:last_upload"
+COLLECTOR_JOB_ID = "auto_extract_collect"
+SUPPORTED = (".pdf", ".jpg", ".jpeg", ".png")
+DEFAULT_DEBOUNCE = 10
+DEFAULT_BATCH_SIZE = 25
+# Keep collecting at most this long during a steady stream of uploads
+MAX_COLLECT_SECONDS = 120
+
+
+def _settings():
+    s = get_settings("Extraction Settings")
+    if not s or not cint(s.get("auto_extract_on_upload")):
+        return None
+    return s
+
+
+def _supported(file_url: str) -> bool:
+    return bool(file_url) and os.path.splitext(file_url)[1].lower() in SUPPORTED
+
+
+# ---------------- Hooks ----------------
+def on_invoice_insert(doc, method=None) -> None:
+    if doc.flags.skip_auto_extract or doc.status not in (None, "", "Draft"):
+        return
+    if _supported(doc.original_file) and _settings():
+        request_extraction(doc.name)
+
+
+def on_file_insert(doc, method=None) -> None:
+    """A file attached to an existing Draft invoice as its original file."""
+    if doc.attached_to_doctype != "Extracted Invoice" or not doc.attached_to_name:
+        return
+    if not _supported(doc.file_url) or not _settings():
+        return
+
+    inv = frappe.db.get_value(
+        "Extracted Invoice", doc.attached_to_name, ["status", "original_file"], as_dict=True
+    )
+    # Not inserted yet: the invoice's own after_insert takes over
+    if inv and inv.status == "Draft" and inv.original_file == doc.file_url:
+        request_extraction(doc.attached_to_name)
+
+
+# ---------------- Collecting ----------------
+def request_extraction(invoice_name: str) -> None:
+    def push():
+        cache = frappe.cache()
+        cache.sadd(PENDING_KEY, invoice_name)
+        # Raw key: the collector polls it and must not see a request-cached value
+        cache.set(cache.make_key(LAST_UPLOAD_KEY), time.time(), ex=MAX_COLLECT_SECONDS * 2)
+        frappe.enqueue(
+            "invoice_extraction_app.auto_extract.collect",
+            queue="short",
+            job_id=COLLECTOR_JOB_ID,
+            deduplicate=True,
+        )
+
+    # The batch job must be able to read the invoice
+    frappe.db.after_commit.add(push)
+
+
+def _pop(limit: int) -> List[str]:
+    cache = frappe.cache()
+    names = []
+    while len(names) < limit:
+        name = cache.spop(PENDING_KEY)
+        if name is None:
+            break
+        names.append(name.decode() if isinstance(name, bytes) else name)
+    return names
+
+
+def collect() -> int:
+    """Wait for the upload burst to settle, then fan the pending set out as batch jobs."""
+    s = get_settings("Extraction Settings")
+    debounce = cint(s.get("auto_extract_debounce")) if s else DEFAULT_DEBOUNCE
+    batch_size = cint(s.get("auto_extract_batch_size")) if s else DEFAULT_BATCH_SIZE
+    batch_size = batch_size or DEFAULT_BATCH_SIZE
+
+    cache = frappe.cache()
+    started = time.time()
+    while time.time() - started < MAX_COLLECT_SECONDS:
+        last = float(cache.get(cache.make_key(LAST_UPLOAD_KEY)) or 0)
+        quiet = time.time() - last
+        if quiet >= debounce:
+            break
+        time.sleep(min(debounce - quiet, 1.0))
+
+    batches = 0
+    while True:
+        names = _pop(batch_size)
+        if not names:
+            break
+        frappe.enqueue(
+            "invoice_extraction_app.auto_extract.run_batch",
+            queue=extraction_queue("default"),
+            timeout=max(300, 120 * len(names)),
+            job_name=f"auto_extract_batch ({len(names)})",
+            invoice_names=names,
+        )
+        batches += 1
+    return batches
+
+
+def run_batch(invoice_names: List[str]) -> dict:
+    from invoice_extraction_app.router import extract_and_update_extracted_invoice
+
+    done, failed = 0, 0
+    for name in invoice_names:
+        try:
+            # Someone may have extracted it by hand while it waited
+            if frappe.db.get_value("Extracted Invoice", name, "status") != "Draft":
+                continue
+            res = extract_and_update_extracted_invoice(name, urgent=0)
+            if res.get("success"):
+                done += 1
+            else:
+                failed += 1
+        except Exception:
+            failed += 1
+            frappe.db.rollback()
+            frappe.log_error(frappe.get_traceback(), f"Auto Extraction Error: {name}"[:140])
+    return {"success": True, "extracted": done, "failed": failed}
+
+
+def flush_pending() -> None:
+    """Scheduler safety net: a collector that finished just as new uploads arrived."""
+    if frappe.cache().smembers(PENDING_KEY):
+        frappe.enqueue(
+            "invoice_extraction_app.auto_extract.collect",
+            queue="short",
+            job_id=COLLECTOR_JOB_ID,
+            deduplicate=True,
+        )
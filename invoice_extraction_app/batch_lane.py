@@ -0,0 +1,439 @@
+# invoice_extraction_app/batch_lane.py
+"""
+Provider batch jobs for non-urgent backlog extraction.
+
+Backfills and overnight re-extractions do not need an answer within
+seconds, yet they used the same synchronous, full-price endpoints as a user
+waiting on the form. Invoices queued here (`ingest-invoices --batch-api`,
+"Queue for Batch" on the form) wait in a Redis set until `submit_pending`
+packs them into one Mistral batch job: each invoice's text (PDF text layer,
+remembered OCR, or OCR done now) becomes one line of a JSONL input file,
+carrying the same chat messages the synchronous pipeline sends.
+`poll_batches` follows the open jobs and, once a job has ended, downloads
+its JSONL output and applies every answer through
+`_apply_extracted_data_to_invoice`, committing in chunks with the batch's
+progress so an interrupted run resumes where it stopped. Invoices leave the
+Redis set only once they are in a job, on the bulk lane or done. Batch
+requests are billed at a discount and are not subject to the per-request
+rate limits, so backlog throughput is bounded by batch capacity instead.
+
+Invoices that cannot go through a job go to the scheduler's bulk lane:
+multi-invoice PDFs (split and extracted per segment), text expected to need
+more than the output budget (continuation / chunking), failed or cut-off
+answers and jobs that end without output. Known supplier layouts are read by
+their template right away. Every job is an Extraction Batch record.
+
+The Gemini SDK the app uses has no batch endpoint, so the lane is Mistral
+only. `mistral_server_url` in site_config points it at the benchmark
+stand-in like the rest of the Mistral pipeline.
+"""
+from __future__ import annotations
+
+import json
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import frappe
+from frappe.utils import cint, now
+
+from invoice_extraction_app.chunking import estimate_output_tokens, is_truncated, output_budget
+from invoice_extraction_app.instrumentation import count, note, stage, traced
+from invoice_extraction_app.raw_archive import archive, record, record_answer, recording
+from invoice_extraction_app.scheduling import submit
+from invoice_extraction_app.settings_cache import get_settings
+from invoice_extraction_app.supplier_templates import extract_with_template
+
+BATCH_DOCTYPE = "Extraction Batch"
+PENDING_KEY = "invoice_extraction:batch:pending"
+LOCK_KEY = "invoice_extraction:batch:lock:{}"
+LOCK_SECONDS = 30 * 60
+ENDPOINT = "/v1/chat/completions"
+DEFAULT_MAX_REQUESTS = 500
+DEFAULT_TIMEOUT_HOURS = 24
+COMMIT_EVERY = 50
+FALLBACK_TENANT = "batch-fallback"
+SUPPORTED = (".pdf", ".jpg", ".jpeg", ".png")
+# Mistral batch job states that may still change
+OPEN_STATES = ("QUEUED", "RUNNING", "CANCELLATION_REQUESTED")
+
+
+def _max_requests() -> int:
+    s = get_settings("Extraction Settings")
+    return cint(s.get("batch_max_requests")) if s and s.get("batch_max_requests") else DEFAULT_MAX_REQUESTS
+
+
+def _timeout_hours() -> int:
+    s = get_settings("Extraction Settings")
+    return cint(s.get("batch_timeout_hours")) if s and s.get("batch_timeout_hours") else DEFAULT_TIMEOUT_HOURS
+
+
+@contextmanager
+def _exclusive(name: str):
+    """True inside the block when this worker holds the lock (cron runs must not overlap)."""
+    cache = frappe.cache()
+    lock = cache.make_key(LOCK_KEY.format(name))
+    acquired = bool(cache.set(lock, 1, nx=True, ex=LOCK_SECONDS))
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            cache.delete(lock)
+
+
+def _fallback(invoice_name: str) -> None:
+    submit(invoice_name, "bulk", tenant=FALLBACK_TENANT, after_commit=False)
+
+
+def _dequeue(*invoice_names: str) -> None:
+    """Leave the pending set; only once the invoice is in a job, on the bulk lane or done."""
+    if invoice_names:
+        frappe.cache().srem(PENDING_KEY, *invoice_names)
+
+
+# ---------------- JSONL ----------------
+def build_request(custom_id: str, messages: List[dict], max_tokens: int, temperature: float) -> dict:
+    """One input line: a chat completion body keyed by the invoice name."""
+    return {
+        "custom_id": custom_id,
+        "body": {
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "response_format": {"type": "json_object"},
+        },
+    }
+
+
+def to_jsonl(lines: Iterable[dict]) -> bytes:
+    return "".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines).encode("utf-8")
+
+
+def parse_output(raw: bytes) -> Dict[str, Dict[str, Any]]:
+    """
+    Output lines by custom_id: {"content", "truncated", "usage", "error"}.
+
+    A request the provider could not serve has an `error` and no content.
+    """
+    results = {}
+    for line in (raw or b"").decode("utf-8").splitlines():
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            continue
+        custom_id = row.get("custom_id")
+        if not custom_id:
+            continue
+
+        response = row.get("response") or {}
+        body = response.get("body") or {}
+        choice = (body.get("choices") or [{}])[0]
+        error = row.get("error")
+        if not error and cint(response.get("status_code") or 200) >= 400:
+            error = body.get("message") or body.get("error") or f"HTTP {response.get('status_code')}"
+        results[custom_id] = {
+            "content": (choice.get("message") or {}).get("content") or "",
+            "truncated": is_truncated(choice.get("finish_reason")),
+            "usage": body.get("usage") or {},
+            "error": error,
+        }
+    return results
+
+
+# ---------------- Queue ----------------
+def request(invoice_names: Iterable[str], after_commit: bool = True) -> None:
+    """Queue invoices for the next batch job."""
+    names = [n for n in invoice_names if n]
+    if not names:
+        return
+
+    def push():
+        frappe.cache().sadd(PENDING_KEY, *names)
+
+    if after_commit:
+        # The packing run must be able to read the invoices
+        frappe.db.after_commit.add(push)
+    else:
+        push()
+
+
+def pending() -> List[str]:
+    raw = frappe.cache().smembers(PENDING_KEY) or []
+    return sorted(r.decode() if isinstance(r, bytes) else str(r) for r in raw)
+
+
+# ---------------- Packing ----------------
+def _pack(invoice_name: str, budget: int) -> Tuple[str, Optional[dict]]:
+    """
+    ("packed", entry), ("done", None) when the invoice needs no chat call,
+    or ("fallback", None) when it has to go through the bulk lane.
+    """
+    from invoice_extraction_app.mistral import _read_file, read_document_text
+    from invoice_extraction_app.segmentation import split_batch_pdf
+
+    inv = frappe.get_doc("Extracted Invoice", invoice_name)
+    if not inv.original_file:
+        return "done", None
+    # Segments of a multi-invoice PDF are queued on the bulk lane by the splitter
+    if split_batch_pdf(inv):
+        return "done", None
+
+    file_bytes, ext, file_name = _read_file(inv.original_file)
+    if ext not in SUPPORTED:
+        return "fallback", None
+    text, info = read_document_text(file_bytes, ext, file_name)
+    if not text:
+        return "fallback", None
+
+    record(text=text)
+    data = extract_with_template(text)
+    if data:
+        _apply_result(invoice_name, data, f"Template: {data['extraction_template']}", info)
+        return "done", None
+
+    # Needs continuation or chunking: the synchronous pipeline handles that
+    if estimate_output_tokens(text) > budget:
+        return "fallback", None
+
+    return "packed", {"invoice": invoice_name, "text": text, **info}
+
+
+def submit_pending() -> Optional[str]:
+    """Pack queued invoices into one batch job (scheduler); returns the Extraction Batch name."""
+    with _exclusive("submit") as acquired:
+        if not acquired:
+            return None
+        return _submit_pending()
+
+
+def _submit_pending() -> Optional[str]:
+    from invoice_extraction_app.mistral import _chat_messages, _get_client, _get_settings, mistral_available
+
+    # Still pending until settled: a worker lost half way packs them again on the next run
+    names = pending()[:_max_requests()]
+    if not names:
+        return None
+
+    s = _get_settings()
+    api_key = s.get_password("mistral_api_key") if (s and mistral_available()) else None
+    if not api_key:
+        # No batch provider: the backlog still gets extracted, at the normal price
+        for name in names:
+            _fallback(name)
+            _dequeue(name)
+        return None
+
+    chat_model = s.selected_model or "mistral-large-latest"
+    ocr_model = getattr(s, "ocr_model", None) or "mistral-ocr-2512"
+    temperature = s.temperature or 0.1
+    budget = output_budget()
+
+    lines, entries, done = [], [], []
+    for name in names:
+        frappe.db.savepoint("batch_lane_pack")
+        try:
+            with recording():
+                outcome, entry = _pack(name, budget)
+        except Exception:
+            frappe.db.rollback(save_point="batch_lane_pack")
+            frappe.log_error(frappe.get_traceback(), f"Batch Lane Error: {name}"[:140])
+            outcome, entry = "fallback", None
+
+        if outcome == "fallback":
+            _fallback(name)
+            _dequeue(name)
+        elif outcome == "packed":
+            lines.append(build_request(name, _chat_messages(s, entry.pop("text")), budget, temperature))
+            entries.append(entry)
+        else:
+            done.append(name)
+    frappe.db.commit()
+    _dequeue(*done)
+
+    if not lines:
+        return None
+
+    client = _get_client(api_key)
+    try:
+        uploaded = client.files.upload(
+            file={"file_name": "invoice_batch.jsonl", "content": to_jsonl(lines)},
+            purpose="batch",
+        )
+        job = client.batch.jobs.create(
+            input_files=[uploaded.id],
+            endpoint=ENDPOINT,
+            model=chat_model,
+            metadata={"site": frappe.local.site, "invoices": str(len(lines))},
+            timeout_hours=_timeout_hours(),
+        )
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), "Batch Lane Submit Error")
+        for entry in entries:
+            _fallback(entry["invoice"])
+            _dequeue(entry["invoice"])
+        return None
+
+    batch = frappe.get_doc({
+        "doctype": BATCH_DOCTYPE,
+        "status": "Submitted",
+        "provider": "Mistral",
+        "model": f"{ocr_model}+{chat_model}",
+        "job_id": job.id,
+        "input_file_id": uploaded.id,
+        "invoice_count": len(entries),
+        "invoices": json.dumps(entries),
+        "submitted_at": now(),
+    })
+    batch.insert(ignore_permissions=True)
+    for entry in entries:
+        frappe.db.set_value("Extracted Invoice", entry["invoice"], "status", "Processing", update_modified=False)
+    frappe.db.commit()
+    _dequeue(*(entry["invoice"] for entry in entries))
+    return batch.name
+
+
+# ---------------- Polling / applying ----------------
+@traced("Mistral")
+def _apply_result(invoice_name: str, data: dict, model: str, info: dict, usage: Optional[dict] = None) -> dict:
+    """Write one answer into its invoice; each invoice gets its own Extraction Log."""
+    from invoice_extraction_app.api import _apply_extracted_data_to_invoice
+    from invoice_extraction_app.mistral import _post_process
+
+    note(priority_class="Batch", model=model, **{k: v for k, v in info.items() if k != "invoice"})
+    count(tokens_in=(usage or {}).get("prompt_tokens"), tokens_out=(usage or {}).get("completion_tokens"))
+
+    with stage("parse"):
+        data = _post_process(data)
+    note(item_count=len(data.get("items") or []))
+
+    inv = frappe.get_doc("Extracted Invoice", invoice_name)
+    inv.extraction_model = f"Mistral: {model}" + ("" if model.startswith("Template:") else " (batch)")
+    # No targeted correction pass: it is a full-price synchronous call, which this lane exists to avoid
+    _apply_extracted_data_to_invoice(inv, data)
+
+    with stage("save"):
+        inv.save(ignore_permissions=True, ignore_version=True)
+        archive(inv.name, "Mistral", model)
+    return {"success": True, "invoice": inv.name}
+
+
+def poll_batches() -> int:
+    """Follow open batch jobs and apply the ones that ended (scheduler); returns jobs applied."""
+    with _exclusive("poll") as acquired:
+        if not acquired:
+            return 0
+
+        applied = 0
+        open_batches = frappe.get_all(
+            BATCH_DOCTYPE,
+            filters={"status": ("in", ("Submitted", "Running", "Completed"))},
+            pluck="name",
+            order_by="creation asc",
+        )
+        for name in open_batches:
+            try:
+                applied += _poll(frappe.get_doc(BATCH_DOCTYPE, name))
+            except Exception:
+                frappe.db.rollback()
+                frappe.log_error(frappe.get_traceback(), f"Batch Lane Poll Error: {name}"[:140])
+        return applied
+
+
+def _poll(batch) -> int:
+    from invoice_extraction_app.mistral import _get_client, _get_settings
+
+    client = _get_client(_get_settings().get_password("mistral_api_key"))
+
+    if batch.status != "Completed":
+        job = client.batch.jobs.get(job_id=batch.job_id)
+        status = str(getattr(job.status, "value", job.status))
+        batch.succeeded = cint(job.succeeded_requests)
+        batch.failed = cint(job.failed_requests)
+        if status in OPEN_STATES:
+            batch.status = "Running"
+            batch.save(ignore_permissions=True)
+            frappe.db.commit()
+            return 0
+
+        # SUCCESS, or FAILED / TIMEOUT_EXCEEDED / CANCELLED with whatever was answered
+        batch.output_file_id = job.output_file or ""
+        batch.completed_at = now()
+        if status != "SUCCESS":
+            batch.error = f"Job ended {status}: {json.dumps(getattr(job, 'errors', None) or [], default=str)}"[:1000]
+        batch.status = "Completed"
+        batch.save(ignore_permissions=True)
+        frappe.db.commit()
+
+    _apply_batch(batch, client)
+    return 1
+
+
+def _checkpoint(batch, applied: int, succeeded: int, failed: int) -> None:
+    """Commit every COMMIT_EVERY entries, together with how far the batch got."""
+    if applied % COMMIT_EVERY:
+        return
+    batch.db_set({"applied_count": applied, "succeeded": succeeded, "failed": failed}, update_modified=False)
+    frappe.db.commit()
+
+
+def _apply_batch(batch, client) -> None:
+    from invoice_extraction_app.mistral import _json_extract
+
+    results = {}
+    if batch.output_file_id:
+        results = parse_output(client.files.download(file_id=batch.output_file_id).read())
+
+    # Resume after the entries an interrupted run already committed
+    start = cint(batch.applied_count)
+    succeeded, failed = (cint(batch.succeeded), cint(batch.failed)) if start else (0, 0)
+    entries = json.loads(batch.invoices or "[]")
+    for i, entry in enumerate(entries[start:], start + 1):
+        name = entry["invoice"]
+        result = results.get(name) or {}
+        data = None
+        if result.get("content") and not result.get("error") and not result.get("truncated"):
+            data = _json_extract(result["content"])
+
+        if not isinstance(data, dict):
+            failed += 1
+            _fallback(name)
+            _checkpoint(batch, i, succeeded, failed)
+            continue
+
+        frappe.db.savepoint("batch_lane_apply")
+        try:
+            with recording():
+                record_answer(result["content"], False)
+                _apply_result(name, data, batch.model, entry, result.get("usage"))
+            succeeded += 1
+        except Exception:
+            # One bad answer must not roll back the rest of the job
+            frappe.db.rollback(save_point="batch_lane_apply")
+            frappe.log_error(frappe.get_traceback(), f"Batch Lane Apply Error: {name}"[:140])
+            failed += 1
+            _fallback(name)
+        _checkpoint(batch, i, succeeded, failed)
+
+    batch.applied_count, batch.succeeded, batch.failed = len(entries), succeeded, failed
+    batch.status = "Applied" if batch.output_file_id else "Failed"
+    batch.save(ignore_permissions=True)
+    frappe.db.commit()
+
+
+# ---------------- API ----------------
+@frappe.whitelist()
+def queue_for_batch(invoice_names) -> dict:
+    """Form / list action: extract these invoices in the next batch job."""
+    try:
+        if isinstance(invoice_names, str):
+            invoice_names = json.loads(invoice_names) if invoice_names.startswith("[") else [invoice_names]
+        for name in invoice_names:
+            frappe.has_permission("Extracted Invoice", "write", name, throw=True)
+
+        request(invoice_names, after_commit=False)
+        return {"success": True, "queued": len(invoice_names), "pending": len(pending())}
+
+    except Exception as e:
+        frappe.log_error(frappe.get_traceback(), "Batch Lane Queue Error")
+        return {"success": False, "error": str(e)}
@@ -0,0 +1,19 @@
+"""
+Offline end-to-end benchmarks for the extraction pipelines.
+
+Everything runs against local HTTP stand-ins for the Gemini, Mistral and
+Telegram APIs (see `stubs.py`), so no API key or network access is needed.
+Run inside a site (ideally a throwaway one, the dataset is written to the DB):
+
+  bench --site <site> execute invoice_extraction_app.benchmarks.run.run
+  bench --site <site> execute invoice_extraction_app.benchmarks.run.run \\
+      --kwargs "{'scenarios': ['mistral_extract'], 'iterations': 100, 'latency_ms': 300, 'error_rate': 0.05}"
+
+Pass `output` to write the results as JSON and `baseline` (a previous output
+file) to flag regressions.
+
+`imports.py` measures the cold import time and RSS of the app's modules in
+fresh interpreters (no stand-ins or site data needed):
+
+  bench --site <site> execute invoice_extraction_app.benchmarks.imports.run
+"""
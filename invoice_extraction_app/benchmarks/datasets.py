@@ -0,0 +1,190 @@
+# invoice_extraction_app/benchmarks/datasets.py
+"""Synthetic suppliers, items, invoices and PDFs for the benchmarks."""
+from __future__ import annotations
+
+import random
+from typing import Any, Dict, List, Optional
+
+import frappe
+from frappe.utils import now
+
+SUPPLIER_PREFIX = "BENCH-SUP-"
+ITEM_PREFIX = "BENCH-ITEM-"
+DEFAULT_SUPPLIERS = 10_000
+DEFAULT_ITEMS = 100_000
+
+
+def supplier_name(i: int) -> str:
+    return f"Bench Supplier {i:05d}"
+
+
+def item_name(i: int) -> str:
+    return f"Bench Item {i:06d}"
+
+
+def item_tag(i: int) -> str:
+    return f"BI{i:06d}"
+
+
+# ---------------- DB dataset ----------------
+def _existing(doctype: str, prefix: str) -> int:
+    return frappe.db.count(doctype, {"name": ["like", f"{prefix}%"]})
+
+
+def seed(suppliers: int = DEFAULT_SUPPLIERS, items: int = DEFAULT_ITEMS) -> Dict[str, int]:
+    """Insert the synthetic master data with multi-row inserts (idempotent)."""
+    ts = now()
+    user = frappe.session.user
+
+    have = _existing("Supplier", SUPPLIER_PREFIX)
+    if have < suppliers:
+        frappe.db.bulk_insert(
+            "Supplier",
+            ["name", "supplier_name", "creation", "modified", "owner", "modified_by", "docstatus"],
+            [
+                (f"{SUPPLIER_PREFIX}{i:05d}", supplier_name(i), ts, ts, user, user, 0)
+                for i in range(have, suppliers)
+            ],
+            ignore_duplicates=True,
+        )
+
+    have = _existing("Item", ITEM_PREFIX)
+    if have < items:
+        frappe.db.bulk_insert(
+            "Item",
+            [
+                "name", "item_code", "item_name", "description", "item_group", "stock_uom",
+                "creation", "modified", "owner", "modified_by", "docstatus",
+            ],
+            [
+                (
+                    f"{ITEM_PREFIX}{i:06d}", f"{ITEM_PREFIX}{i:06d}", item_name(i),
+                    f"{item_name(i)} #{item_tag(i)}#", "All Item Groups", "Nos",
+                    ts, ts, user, user, 0,
+                )
+                for i in range(have, items)
+            ],
+            ignore_duplicates=True,
+        )
+
+    frappe.db.commit()
+    return {
+        "suppliers": _existing("Supplier", SUPPLIER_PREFIX),
+        "items": _existing("Item", ITEM_PREFIX),
+    }
+
+
+def drop() -> None:
+    frappe.db.delete("Supplier", {"name": ["like", f"{SUPPLIER_PREFIX}%"]})
+    frappe.db.delete("Item", {"name": ["like", f"{ITEM_PREFIX}%"]})
+    frappe.db.commit()
+
+
+# ---------------- Synthetic documents ----------------
+def make_invoice(rng: Optional[random.Random] = None, items: int = 10,
+                 suppliers: int = DEFAULT_SUPPLIERS, catalogue: int = DEFAULT_ITEMS,
+                 hit_rate: float = 0.8) -> Dict[str, Any]:
+    """Model-shaped invoice JSON; `hit_rate` of the item lines reference seeded items."""
+    rng = rng or random.Random()
+    rows = []
+    for _ in range(items):
+        i = rng.randrange(catalogue)
+        desc = item_name(i) if rng.random() < hit_rate else f"Unknown Part {rng.randrange(10**6):06d}"
+        qty = rng.randint(1, 20)
+        price = round(rng.uniform(1, 500), 2)
+        tax = round(qty * price * 0.15, 2)
+        rows.append({
+            "description": desc,
+            "description_ar": "",
+            "quantity": qty,
+            "unit_price": price,
+            "item_total": round(qty * price, 2),
+            "tax_amount": tax,
+            "total_with_tax": round(qty * price + tax, 2),
+        })
+
+    subtotal = round(sum(r["item_total"] for r in rows), 2)
+    tax = round(sum(r["tax_amount"] for r in rows), 2)
+    return {
+        "supplier": supplier_name(rng.randrange(suppliers)),
+        "supplier_ar": "",
+        "invoice_number": f"INV-{rng.randrange(10**7):07d}",
+        "date": "2026-01-15",
+        "due_date": "2026-02-14",
+        "subtotal": subtotal,
+        "tax_amount": tax,
+        "total_amount": round(subtotal + tax, 2),
+        "currency": "SAR",
+        "items": rows,
+    }
+
+
+def invoice_to_text(data: Dict[str, Any]) -> str:
+    """Render invoice JSON as the plain text / markdown an OCR engine would return."""
+    lines = [
+        f"# {data['supplier']}",
+        f"Invoice No: {data['invoice_number']}",
+        f"Date: {data['date']}",
+        f"Due Date: {data['due_date']}",
+        "",
+        "| Description | Qty | Unit Price | Amount | VAT |",
+        "|---|---|---|---|---|",
+    ]
+    for r in data["items"]:
+        lines.append(f"| {r['description']} | {r['quantity']} | {r['unit_price']:.2f} | {r['item_total']:.2f} | {r['tax_amount']:.2f} |")
+    lines += [
+        "",
+        f"Subtotal: {data['subtotal']:.2f}",
+        f"VAT: {data['tax_amount']:.2f}",
+        f"Total: {data['total_amount']:.2f} {data['currency']}",
+    ]
+    return "\n".join(lines)
+
+
+def _pdf_escape(s: str) -> str:
+    return s.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(pages: List[List[str]]) -> bytes:
+    """Minimal valid PDF with a real (Helvetica) text layer, one list of lines per page."""
+    objects: List[bytes] = []
+    n_pages = len(pages) or 1
+    font_obj = 3 + 2 * n_pages
+
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(n_pages))
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {n_pages} >>".encode())
+
+    for i in range(n_pages):
+        lines = pages[i] if i < len(pages) else []
+        stream = ["BT", "/F1 9 Tf", "11 TL", "40 800 Td"]
+        for line in lines:
+            stream.append(f"({_pdf_escape(line)}) Tj T*")
+        stream.append("ET")
+        content = "\n".join(stream).encode("latin-1", "replace")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 {font_obj} 0 R >> >> /Contents {4 + 2 * i} 0 R >>".encode()
+        )
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for n, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{n} 0 obj\n".encode() + body + b"\nendobj\n"
+
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for off in offsets:
+        out += f"{off:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+def make_invoice_pdf(data: Dict[str, Any], lines_per_page: int = 60) -> bytes:
+    lines = invoice_to_text(data).splitlines()
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)]
+    return make_pdf(pages)
@@ -0,0 +1,117 @@
+# invoice_extraction_app/benchmarks/imports.py
+"""
+Cold-start cost of the app's modules: import time and peak RSS.
+
+Each module is imported in a fresh interpreter (`iterations` times) that
+already has frappe loaded, so the numbers are what a worker pays on top of
+frappe when it first resolves a method from that module. `sdk.preload` is
+the cost the lazy provider SDK imports (sdk.py) move out of that path.
+
+  bench --site <site> execute invoice_extraction_app.benchmarks.imports.run
+  bench --site <site> execute invoice_extraction_app.benchmarks.imports.run \\
+      --kwargs "{'iterations': 10, 'output': '/tmp/imports.json', 'baseline': '/tmp/imports_before.json'}"
+"""
+from __future__ import annotations
+
+import json
+import subprocess
+import sys
+from typing import Any, Dict, List, Optional
+
+from invoice_extraction_app.benchmarks.run import print_table
+from invoice_extraction_app.instrumentation import percentile
+
+# (scenario, module, function called after the import)
+TARGETS = [
+    ("import:frappe", "frappe", ""),
+    ("import:api", "invoice_extraction_app.api", ""),
+    ("import:mistral", "invoice_extraction_app.mistral", ""),
+    ("import:router", "invoice_extraction_app.router", ""),
+    ("import:telegram", "invoice_extraction_app.telegram", ""),
+    ("import:batch_lane", "invoice_extraction_app.batch_lane", ""),
+    ("sdk.preload", "invoice_extraction_app.sdk", "preload"),
+]
+
+CHILD = """
+import importlib, json, resource, sys, time
+target, call = sys.argv[1], sys.argv[2]
+if target != "frappe":
+    import frappe
+modules = len(sys.modules)
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+t0 = time.perf_counter()
+module = importlib.import_module(target)
+if call:
+    getattr(module, call)()
+ms = (time.perf_counter() - t0) * 1000.0
+print(json.dumps({
+    "ms": ms,
+    "rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "rss_delta_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss,
+    "modules": len(sys.modules) - modules,
+}))
+"""
+
+
+def measure_import(scenario: str, module: str, call: str, iterations: int) -> Dict[str, Any]:
+    samples: List[Dict[str, Any]] = []
+    errors = 0
+    for _ in range(iterations):
+        proc = subprocess.run([sys.executable, "-c", CHILD, module, call], capture_output=True, text=True)
+        if proc.returncode:
+            errors += 1
+            continue
+        samples.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    ms = [s["ms"] for s in samples]
+    return {
+        "scenario": scenario,
+        "iterations": iterations,
+        "errors": errors,
+        "throughput_per_s": round(1000.0 / (sum(ms) / len(ms)), 2) if ms else 0.0,
+        "p50_ms": round(percentile(ms, 50), 2),
+        "p95_ms": round(percentile(ms, 95), 2),
+        "p99_ms": round(percentile(ms, 99), 2),
+        "queries_per_op": 0,
+        "peak_rss_mb": round(max((s["rss_kb"] for s in samples), default=0) / 1024.0, 1),
+        "rss_added_mb": round(percentile([s["rss_delta_kb"] for s in samples], 50) / 1024.0, 1),
+        "modules_loaded": max((s["modules"] for s in samples), default=0),
+    }
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str, tolerance: float = 0.1) -> List[str]:
+    with open(baseline_path) as f:
+        baseline = {r["scenario"]: r for r in json.load(f).get("results", [])}
+
+    regressions = []
+    for r in results:
+        b = baseline.get(r["scenario"])
+        if not b:
+            continue
+        if b["p50_ms"] and r["p50_ms"] > b["p50_ms"] * (1 + tolerance):
+            regressions.append(f"{r['scenario']}: p50 {b['p50_ms']} -> {r['p50_ms']} ms")
+        if r["rss_added_mb"] > b["rss_added_mb"] * (1 + tolerance) + 1:
+            regressions.append(f"{r['scenario']}: RSS added {b['rss_added_mb']} -> {r['rss_added_mb']} MB")
+    return regressions
+
+
+def run(iterations: int = 5, output: Optional[str] = None, baseline: Optional[str] = None,
+        tolerance: float = 0.1) -> Dict[str, Any]:
+    """Import every target in fresh interpreters; see module docstring for usage."""
+    results = [measure_import(scenario, module, call, iterations) for scenario, module, call in TARGETS]
+
+    report = {"config": {"iterations": iterations, "python": sys.version.split()[0]}, "results": results}
+    if baseline:
+        report["regressions"] = compare(results, baseline, tolerance)
+
+    print_table(results)
+    for r in results:
+        print(f"{r['scenario']}: +{r['rss_added_mb']} MB RSS, {r['modules_loaded']} modules")
+    for line in report.get("regressions") or []:
+        print(f"REGRESSION {line}")
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    return report
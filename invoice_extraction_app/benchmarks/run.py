@@ -0,0 +1,442 @@
+# invoice_extraction_app/benchmarks/run.py
+"""
+Benchmark harness: runs each scenario against the local stand-ins and
+reports throughput, p50/p95/p99 latency, DB queries per operation and peak RSS.
+"""
+from __future__ import annotations
+
+import json
+import random
+import resource
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+import frappe
+from frappe.utils.password import get_decrypted_password, remove_encrypted_password, set_encrypted_password
+
+from invoice_extraction_app.benchmarks import datasets
+from invoice_extraction_app.benchmarks.stubs import GeminiRestShim, StandInConfig, StandInServer
+from invoice_extraction_app.instrumentation import percentile
+from invoice_extraction_app.settings_cache import bump_settings_version
+
+ALL_SCENARIOS = [
+    "gemini_extract",
+    "mistral_extract",
+    "telegram_webhook",
+    "supplier_matching",
+    "item_matching",
+    "purchase_invoice_draft",
+    "item_table_1k",
+    "item_table_10k",
+    "batch_lane",
+]
+# Item-table scenarios are heavy; they run at most this many iterations
+ITEM_TABLE_ITERATIONS = {"item_table_1k": 10, "item_table_10k": 3}
+
+BENCH_SETTINGS = {
+    # The REST shim has no cachedContents or upload endpoints: prompts and files go inline
+    "Gemini Settings": {
+        "gemini_api_key": "bench-key",
+        "selected_model": "gemini-2.5-flash",
+        "temperature": 0.1,
+        "use_context_cache": 0,
+        "file_api_threshold_mb": 0,
+    },
+    "Mistral Settings": {
+        "mistral_api_key": "bench-key",
+        "selected_model": "mistral-large-latest",
+        "ocr_model": "mistral-ocr-latest",
+        "temperature": 0.1,
+        "enable_debug_log": 0,
+    },
+    "Telegram Settings": {"t_enabled": 1, "bot_token": "bench-token", "admin_chat_id": ""},
+}
+PASSWORD_FIELDS = {("Mistral Settings", "mistral_api_key")}
+
+
+# ---------------- Measurement ----------------
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+class QueryCounter:
+    """Counts frappe.db.sql calls made while active."""
+
+    def __init__(self):
+        self.count = 0
+        self._orig = None
+
+    def __enter__(self):
+        self._orig = frappe.db.sql
+
+        def counted(*args, **kwargs):
+            self.count += 1
+            return self._orig(*args, **kwargs)
+
+        frappe.db.sql = counted
+        return self
+
+    def __exit__(self, *exc):
+        frappe.db.sql = self._orig
+
+
+def measure(name: str, iterations: int, op: Callable[[int], Any],
+            setup: Optional[Callable[[int], Any]] = None) -> Dict[str, Any]:
+    durations: List[float] = []
+    errors = 0
+    queries = 0
+
+    started = time.perf_counter()
+    for i in range(iterations):
+        arg = setup(i) if setup else i
+        with QueryCounter() as qc:
+            t0 = time.perf_counter()
+            try:
+                res = op(arg)
+                if isinstance(res, dict) and (res.get("success") is False or res.get("ok") is False):
+                    errors += 1
+            except Exception:
+                errors += 1
+            durations.append((time.perf_counter() - t0) * 1000.0)
+        queries += qc.count
+    wall = time.perf_counter() - started
+
+    busy = sum(durations) / 1000.0
+    return {
+        "scenario": name,
+        "iterations": iterations,
+        "errors": errors,
+        "throughput_per_s": round(iterations / busy, 2) if busy else 0.0,
+        "wall_s": round(wall, 3),
+        "p50_ms": round(percentile(durations, 50), 2),
+        "p95_ms": round(percentile(durations, 95), 2),
+        "p99_ms": round(percentile(durations, 99), 2),
+        "queries_per_op": round(queries / iterations, 1) if iterations else 0,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+# ---------------- Environment ----------------
+@contextmanager
+def bench_environment(server: StandInServer):
+    """Point every provider at the stand-in and swap in bench settings; restore on exit."""
+    from invoice_extraction_app import batch_lane, sdk, telegram, telegram_mistral
+
+    conf_keys = {"mistral_server_url": server.url, "telegram_api_base_url": server.url}
+    old_conf = {k: frappe.local.conf.get(k) for k in conf_keys}
+    frappe.local.conf.update(conf_keys)
+
+    sdk.override("genai", GeminiRestShim(server.url))
+
+    enqueued: List[Dict[str, Any]] = []
+    old_enqueue = frappe.enqueue
+    frappe.enqueue = lambda method, **kwargs: enqueued.append({"method": method, **kwargs})
+    # Webhooks hand invoices to the scheduler; keep them out of the real pending lists
+    old_submit = {m: m.submit for m in (telegram, telegram_mistral, batch_lane)}
+    for m in old_submit:
+        m.submit = lambda name, cls, **kwargs: enqueued.append({"invoice": name, "class": cls, **kwargs})
+
+    saved = {}
+    for doctype, values in BENCH_SETTINGS.items():
+        for field, value in values.items():
+            if (doctype, field) in PASSWORD_FIELDS:
+                saved[(doctype, field)] = get_decrypted_password(doctype, doctype, field, raise_exception=False)
+                set_encrypted_password(doctype, doctype, value, field)
+            else:
+                saved[(doctype, field)] = frappe.db.get_single_value(doctype, field)
+            frappe.db.set_single_value(doctype, field, value)
+    frappe.db.commit()
+    # set_single_value skips on_update: refresh the settings snapshots by hand
+    bump_settings_version()
+
+    try:
+        yield enqueued
+    finally:
+        for (doctype, field), value in saved.items():
+            if (doctype, field) in PASSWORD_FIELDS:
+                if value:
+                    set_encrypted_password(doctype, doctype, value, field)
+                else:
+                    remove_encrypted_password(doctype, doctype, field)
+            frappe.db.set_single_value(doctype, field, value)
+        frappe.db.commit()
+        bump_settings_version()
+        frappe.enqueue = old_enqueue
+        for m, fn in old_submit.items():
+            m.submit = fn
+        sdk.override("genai")
+        for k, v in old_conf.items():
+            if v is None:
+                frappe.local.conf.pop(k, None)
+            else:
+                frappe.local.conf[k] = v
+
+
+def _new_invoice_with_file(pdf: bytes, created: List[str]) -> str:
+    file_doc = frappe.get_doc({
+        "doctype": "File",
+        "file_name": "bench_invoice.pdf",
+        "is_private": 1,
+        "content": pdf,
+    }).insert(ignore_permissions=True)
+
+    inv = frappe.new_doc("Extracted Invoice")
+    inv.status = "Draft"
+    inv.file_type = "pdf"
+    inv.original_file = file_doc.file_url
+    inv.insert(ignore_permissions=True)
+
+    file_doc.db_set({"attached_to_doctype": "Extracted Invoice", "attached_to_name": inv.name})
+    frappe.db.commit()
+    created.append(inv.name)
+    return inv.name
+
+
+def _cleanup(created: List[str]) -> None:
+    for name in created:
+        try:
+            frappe.delete_doc("Extracted Invoice", name, force=1, ignore_permissions=True, delete_permanently=True)
+        except Exception:
+            pass
+    frappe.db.commit()
+
+
+# ---------------- Scenarios ----------------
+def _scenario_extract(name: str, module: str, iterations: int, server: StandInServer, created: List[str]) -> Dict[str, Any]:
+    extract = frappe.get_attr(f"invoice_extraction_app.{module}.extract_and_update_extracted_invoice")
+    rng = random.Random(1)
+    pdf = datasets.make_invoice_pdf(datasets.make_invoice(rng, items=server.config.items_per_invoice))
+    return measure(
+        name,
+        iterations,
+        op=extract,
+        setup=lambda i: _new_invoice_with_file(pdf, created),
+    )
+
+
+def _scenario_batch_lane(iterations: int, server: StandInServer, created: List[str]) -> List[Dict[str, Any]]:
+    """`iterations` invoices through one batch job: packing, then the two polls until it is applied."""
+    from invoice_extraction_app import batch_lane
+
+    rng = random.Random(1)
+    pdf = datasets.make_invoice_pdf(datasets.make_invoice(rng, items=server.config.items_per_invoice))
+    names = [_new_invoice_with_file(pdf, created) for _ in range(iterations)]
+    batch_lane.request(names, after_commit=False)
+
+    batches: List[str] = []
+    submit = measure("batch_lane_submit", 1, op=lambda _: batches.append(batch_lane.submit_pending()))
+    # The stand-in reports the job RUNNING on the first poll and SUCCESS on the next
+    apply = measure("batch_lane_apply", 2, op=lambda _: batch_lane.poll_batches())
+
+    for name in filter(None, batches):
+        frappe.delete_doc(batch_lane.BATCH_DOCTYPE, name, force=1, ignore_permissions=True)
+    frappe.db.commit()
+
+    for result in (submit, apply):
+        result["invoices"] = iterations
+        result["invoices_per_s"] = round(iterations / result["wall_s"], 2) if result["wall_s"] else 0.0
+    return [submit, apply]
+
+
+def _scenario_webhook(module: str, iterations: int, created: List[str]) -> Dict[str, Any]:
+    webhook = frappe.get_attr(f"invoice_extraction_app.{module}.webhook")
+    base = int(time.time() * 1000)
+
+    def setup(i):
+        frappe.local.form_dict = frappe._dict({
+            "update_id": base + i,
+            "message": {
+                "message_id": base + i,
+                "chat": {"id": 777},
+                "document": {"file_id": f"bench-{i}", "file_name": f"invoice_{i}.pdf", "mime_type": "application/pdf"},
+            },
+        })
+        return i
+
+    def op(_):
+        res = webhook()
+        name = ((res or {}).get("created") or {}).get("name")
+        if name:
+            created.append(name)
+        return res
+
+    return measure("telegram_webhook", iterations, op=op, setup=setup)
+
+
+def _scenario_matching(kind: str, iterations: int, suppliers: int, items: int, hit_rate: float = 0.8) -> Dict[str, Any]:
+    from invoice_extraction_app import api
+
+    rng = random.Random(7)
+    if kind == "supplier":
+        names = [
+            datasets.supplier_name(rng.randrange(suppliers)) if rng.random() < hit_rate else f"Nobody {i}"
+            for i in range(iterations)
+        ]
+        return measure("supplier_matching", iterations, op=lambda i: api._match_supplier_link(names[i]))
+
+    descs = [
+        datasets.item_name(rng.randrange(items)) if rng.random() < hit_rate else f"Unknown Part {i}"
+        for i in range(iterations)
+    ]
+    return measure("item_matching", iterations, op=lambda i: api._match_item_link(descs[i]))
+
+
+def _scenario_purchase_invoice(iterations: int, server: StandInServer, created: List[str]) -> Dict[str, Any]:
+    from invoice_extraction_app import api
+
+    rng = random.Random(3)
+    pdf = datasets.make_pdf([["bench"]])
+    names = []
+    for _ in range(iterations):
+        name = _new_invoice_with_file(pdf, created)
+        inv = frappe.get_doc("Extracted Invoice", name)
+        api._apply_extracted_data_to_invoice(inv, datasets.make_invoice(rng, items=server.config.items_per_invoice, hit_rate=1.0))
+        inv.save(ignore_permissions=True)
+        names.append(name)
+    frappe.db.commit()
+
+    def op(i):
+        # Roll back every draft so the benchmark never leaves Purchase Invoices behind
+        frappe.db.savepoint("bench_pi")
+        try:
+            return api.create_purchase_invoice_draft(names[i])
+        finally:
+            frappe.db.rollback(save_point="bench_pi")
+
+    return measure("purchase_invoice_draft", iterations, op=op)
+
+
+def _scenario_item_table(name: str, iterations: int, created: List[str]) -> List[Dict[str, Any]]:
+    """Save of an invoice with 1k / 10k item lines: first write, then a re-extraction changing 1% of rows."""
+    from invoice_extraction_app import api
+
+    lines = 1000 if name == "item_table_1k" else 10000
+    iterations = min(iterations, ITEM_TABLE_ITERATIONS[name])
+    rng = random.Random(5)
+    pdf = datasets.make_pdf([["bench"]])
+    extracted = []
+
+    def fresh(i):
+        inv = frappe.get_doc("Extracted Invoice", _new_invoice_with_file(pdf, created))
+        data = datasets.make_invoice(rng, items=lines, catalogue=1000, hit_rate=1.0)
+        api._apply_extracted_data_to_invoice(inv, data)
+        extracted.append((inv.name, data))
+        return inv
+
+    def reextracted(i):
+        invoice_name, data = extracted[i]
+        data = json.loads(json.dumps(data))
+        for row in rng.sample(data["items"], max(lines // 100, 1)):
+            row["quantity"] += 1
+        inv = frappe.get_doc("Extracted Invoice", invoice_name)
+        api._apply_extracted_data_to_invoice(inv, data)
+        return inv
+
+    def save(inv):
+        inv.save(ignore_permissions=True, ignore_version=True)
+        frappe.db.commit()
+
+    return [
+        measure(f"{name}_insert", iterations, op=save, setup=fresh),
+        measure(f"{name}_reextract", iterations, op=save, setup=reextracted),
+    ]
+
+
+# ---------------- Entry point ----------------
+def compare(results: List[Dict[str, Any]], baseline_path: str, tolerance: float = 0.1) -> List[str]:
+    with open(baseline_path) as f:
+        baseline = {r["scenario"]: r for r in json.load(f).get("results", [])}
+
+    regressions = []
+    for r in results:
+        b = baseline.get(r["scenario"])
+        if not b:
+            continue
+        if b["p95_ms"] and r["p95_ms"] > b["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{r['scenario']}: p95 {b['p95_ms']} -> {r['p95_ms']} ms")
+        if b["throughput_per_s"] and r["throughput_per_s"] < b["throughput_per_s"] * (1 - tolerance):
+            regressions.append(f"{r['scenario']}: throughput {b['throughput_per_s']} -> {r['throughput_per_s']}/s")
+        if r["queries_per_op"] > b["queries_per_op"]:
+            regressions.append(f"{r['scenario']}: queries/op {b['queries_per_op']} -> {r['queries_per_op']}")
+    return regressions
+
+
+def print_table(results: List[Dict[str, Any]]) -> None:
+    cols = ["scenario", "iterations", "errors", "throughput_per_s", "p50_ms", "p95_ms", "p99_ms", "queries_per_op", "peak_rss_mb"]
+    widths = [max(len(c), *(len(str(r.get(c, ""))) for r in results)) for c in cols]
+    print("  ".join(c.ljust(w) for c, w in zip(cols, widths)))
+    for r in results:
+        print("  ".join(str(r.get(c, "")).ljust(w) for c, w in zip(cols, widths)))
+
+
+def run(scenarios: Optional[List[str]] = None, iterations: int = 50,
+        latency_ms: float = 0.0, jitter_ms: float = 0.0, error_rate: float = 0.0, error_status: int = 503,
+        items_per_invoice: int = 10, suppliers: int = datasets.DEFAULT_SUPPLIERS, items: int = datasets.DEFAULT_ITEMS,
+        seed_dataset: bool = True, keep_documents: bool = False,
+        output: Optional[str] = None, baseline: Optional[str] = None, tolerance: float = 0.1) -> Dict[str, Any]:
+    """Run the benchmark suite; see module docstring for usage."""
+    if isinstance(scenarios, str):
+        scenarios = [s.strip() for s in scenarios.split(",") if s.strip()]
+    scenarios = scenarios or ALL_SCENARIOS
+
+    dataset = datasets.seed(suppliers, items) if seed_dataset else {}
+
+    config = StandInConfig(
+        latency_ms=latency_ms,
+        jitter_ms=jitter_ms,
+        error_rate=error_rate,
+        error_status=error_status,
+        items_per_invoice=items_per_invoice,
+        telegram_file=datasets.make_invoice_pdf(datasets.make_invoice(random.Random(9), items=items_per_invoice)),
+    )
+
+    results: List[Dict[str, Any]] = []
+    created: List[str] = []
+    with StandInServer(config) as server, bench_environment(server):
+        try:
+            for name in scenarios:
+                if name == "gemini_extract":
+                    results.append(_scenario_extract(name, "api", iterations, server, created))
+                elif name == "mistral_extract":
+                    results.append(_scenario_extract(name, "mistral", iterations, server, created))
+                elif name == "telegram_webhook":
+                    results.append(_scenario_webhook("telegram", iterations, created))
+                elif name == "supplier_matching":
+                    results.append(_scenario_matching("supplier", iterations, suppliers, items))
+                elif name == "item_matching":
+                    results.append(_scenario_matching("item", iterations, suppliers, items))
+                elif name == "purchase_invoice_draft":
+                    results.append(_scenario_purchase_invoice(iterations, server, created))
+                elif name in ITEM_TABLE_ITERATIONS:
+                    results.extend(_scenario_item_table(name, iterations, created))
+                elif name == "batch_lane":
+                    results.extend(_scenario_batch_lane(iterations, server, created))
+                else:
+                    print(f"Unknown scenario: {name}")
+        finally:
+            if not keep_documents:
+                _cleanup(created)
+
+    report = {
+        "dataset": dataset,
+        "config": {
+            "iterations": iterations, "latency_ms": latency_ms, "jitter_ms": jitter_ms,
+            "error_rate": error_rate, "items_per_invoice": items_per_invoice,
+        },
+        "stand_in_calls": dict(config.calls),
+        "results": results,
+    }
+    if baseline:
+        report["regressions"] = compare(results, baseline, tolerance)
+
+    print_table(results)
+    for line in report.get("regressions") or []:
+        print(f"REGRESSION {line}")
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    return report
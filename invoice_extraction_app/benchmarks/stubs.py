@@ -0,0 +1,376 @@
+# invoice_extraction_app/benchmarks/stubs.py
+"""
+Local HTTP stand-ins for the Gemini, Mistral and Telegram APIs.
+
+One threaded server answers all three API surfaces with synthetic but
+well-formed payloads, after an injected latency, and fails a configurable
+share of calls with a 5xx so retry / failover paths get exercised. Mistral
+batch jobs are kept in memory: a job reports RUNNING on its first poll and
+SUCCESS after that, with one output line per input line (the same error
+share fails individual lines).
+"""
+from __future__ import annotations
+
+import base64
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Any, Dict, Optional
+
+import requests
+
+from invoice_extraction_app.benchmarks import datasets
+
+
+@dataclass
+class StandInConfig:
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 503
+    items_per_invoice: int = 10
+    pages_per_document: int = 1
+    telegram_file: bytes = b""
+    seed: int = 42
+    calls: Counter = field(default_factory=Counter)
+
+
+class StandInServer:
+    """Threaded HTTP server; use as a context manager."""
+
+    def __init__(self, config: Optional[StandInConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or StandInConfig()
+        self.rng = random.Random(self.config.seed)
+        self.lock = threading.Lock()
+        self.files: Dict[str, bytes] = {}
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        handler = type("BoundHandler", (_Handler,), {"server_ref": self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    # ---------------- synthetic payloads ----------------
+    def invoice(self) -> Dict[str, Any]:
+        with self.lock:
+            seed = self.rng.randrange(2**31)
+        return datasets.make_invoice(random.Random(seed), items=self.config.items_per_invoice)
+
+    def chat_completion(self, model: Optional[str], prompt_bytes: int) -> Dict[str, Any]:
+        text = json.dumps(self.invoice(), ensure_ascii=False)
+        return {
+            "id": str(uuid.uuid4()),
+            "object": "chat.completion",
+            "model": model or "mistral-large-latest",
+            "created": int(time.time()),
+            "usage": {
+                "prompt_tokens": max(1, prompt_bytes // 4),
+                "completion_tokens": max(1, len(text) // 4),
+                "total_tokens": max(1, (prompt_bytes + len(text)) // 4),
+            },
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text, "tool_calls": None},
+                "finish_reason": "stop",
+            }],
+        }
+
+    def batch_output(self, job: Dict[str, Any]) -> str:
+        """Answer every request of a job's input files; returns the output file id."""
+        lines = []
+        for file_id in job["input_files"]:
+            for raw in self.files.get(file_id, b"").splitlines():
+                try:
+                    req = json.loads(raw)
+                except ValueError:
+                    # Multipart boundaries and headers around the JSONL
+                    continue
+                if not isinstance(req, dict) or "custom_id" not in req:
+                    continue
+                row = {"id": str(uuid.uuid4()), "custom_id": req["custom_id"], "error": None}
+                if self.config.error_rate and random.random() < self.config.error_rate:
+                    row["response"] = {"status_code": self.config.error_status, "body": {"message": "injected failure"}}
+                    job["failed_requests"] += 1
+                else:
+                    body = self.chat_completion(job.get("model"), len(json.dumps(req.get("body"))))
+                    row["response"] = {"status_code": 200, "body": body}
+                    job["succeeded_requests"] += 1
+                lines.append(json.dumps(row, ensure_ascii=False))
+
+        output_id = str(uuid.uuid4())
+        with self.lock:
+            self.files[output_id] = ("\n".join(lines) + "\n").encode("utf-8")
+        job["total_requests"] = job["completed_requests"] = len(lines)
+        return output_id
+
+    def delay_or_fail(self) -> Optional[int]:
+        cfg = self.config
+        wait = cfg.latency_ms + (random.uniform(-cfg.jitter_ms, cfg.jitter_ms) if cfg.jitter_ms else 0)
+        if wait > 0:
+            time.sleep(wait / 1000.0)
+        if cfg.error_rate and random.random() < cfg.error_rate:
+            return cfg.error_status
+        return None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_ref: StandInServer = None
+    protocol_version = "HTTP/1.1"
+
+    routes = [
+        ("POST", re.compile(r"^/v1beta/models/(?P<model>[^/:]+):generateContent"), "gemini_generate"),
+        ("POST", re.compile(r"^/v1/files$"), "mistral_upload"),
+        ("GET", re.compile(r"^/v1/files/(?P<file_id>[^/]+)/url"), "mistral_signed_url"),
+        ("GET", re.compile(r"^/v1/files/(?P<file_id>[^/]+)/content"), "mistral_download"),
+        ("DELETE", re.compile(r"^/v1/files/(?P<file_id>[^/?]+)"), "mistral_delete"),
+        ("POST", re.compile(r"^/v1/ocr$"), "mistral_ocr"),
+        ("POST", re.compile(r"^/v1/chat/completions$"), "mistral_chat"),
+        ("POST", re.compile(r"^/v1/batch/jobs$"), "mistral_batch_create"),
+        ("GET", re.compile(r"^/v1/batch/jobs/(?P<job_id>[^/?]+)"), "mistral_batch_get"),
+        ("GET", re.compile(r"^/bot(?P<token>[^/]+)/getFile"), "telegram_get_file"),
+        ("GET", re.compile(r"^/file/bot(?P<token>[^/]+)/(?P<path>.+)$"), "telegram_download"),
+        ("POST", re.compile(r"^/bot(?P<token>[^/]+)/setWebhook"), "telegram_ok"),
+        ("GET", re.compile(r"^/bot(?P<token>[^/]+)/getWebhookInfo"), "telegram_ok"),
+    ]
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _dispatch(self, method: str):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+
+        for m, pattern, name in self.routes:
+            match = pattern.match(self.path)
+            if m == method and match:
+                srv = self.server_ref
+                srv.config.calls[name] += 1
+                status = srv.delay_or_fail()
+                if status:
+                    return self._json({"error": {"code": status, "message": "injected failure"}}, status)
+                return getattr(self, name)(body, **match.groupdict())
+
+        self._json({"error": "not found", "path": self.path}, 404)
+
+    # ---------------- responses ----------------
+    def _json(self, payload: Any, status: int = 200):
+        raw = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _bytes(self, raw: bytes, content_type: str):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def gemini_generate(self, body: bytes, model: str):
+        text = json.dumps(self.server_ref.invoice(), ensure_ascii=False)
+        self._json({
+            "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP", "index": 0}],
+            "usageMetadata": {
+                "promptTokenCount": max(1, len(body) // 4),
+                "candidatesTokenCount": max(1, len(text) // 4),
+                "totalTokenCount": max(1, (len(body) + len(text)) // 4),
+            },
+            "modelVersion": model,
+        })
+
+    def mistral_upload(self, body: bytes):
+        file_id = str(uuid.uuid4())
+        batch = b'"custom_id"' in body
+        if batch:
+            # Kept for the batch job that reads it
+            with self.server_ref.lock:
+                self.server_ref.files[file_id] = body
+        self._json({
+            "id": file_id,
+            "object": "file",
+            "bytes": len(body),
+            "created_at": int(time.time()),
+            "filename": "batch.jsonl" if batch else "upload.pdf",
+            "purpose": "batch" if batch else "ocr",
+            "sample_type": "batch_request" if batch else "ocr_input",
+            "source": "upload",
+        })
+
+    def mistral_download(self, body: bytes, file_id: str):
+        raw = self.server_ref.files.get(file_id)
+        if raw is None:
+            return self._json({"error": "file not found", "id": file_id}, 404)
+        self._bytes(raw, "application/octet-stream")
+
+    def mistral_signed_url(self, body: bytes, file_id: str):
+        self._json({"url": f"{self.server_ref.url}/signed/{file_id}"})
+
+    def mistral_delete(self, body: bytes, file_id: str):
+        self._json({"id": file_id, "object": "file", "deleted": True})
+
+    def mistral_ocr(self, body: bytes):
+        data = self.server_ref.invoice()
+        lines = datasets.invoice_to_text(data).splitlines()
+        n = max(1, self.server_ref.config.pages_per_document)
+        per_page = max(1, -(-len(lines) // n))
+        pages = [
+            {
+                "index": i,
+                "markdown": "\n".join(lines[i * per_page:(i + 1) * per_page]),
+                "images": [],
+                "dimensions": {"dpi": 200, "height": 2200, "width": 1700},
+            }
+            for i in range(n)
+        ]
+        self._json({
+            "pages": pages,
+            "model": "mistral-ocr-latest",
+            "usage_info": {"pages_processed": n, "doc_size_bytes": len(body)},
+        })
+
+    def mistral_chat(self, body: bytes):
+        try:
+            req = json.loads(body or b"{}")
+        except Exception:
+            req = {}
+        self._json(self.server_ref.chat_completion(req.get("model"), len(body)))
+
+    def mistral_batch_create(self, body: bytes):
+        req = json.loads(body or b"{}")
+        job = {
+            "id": str(uuid.uuid4()),
+            "object": "batch",
+            "input_files": req.get("input_files") or [],
+            "endpoint": req.get("endpoint") or "/v1/chat/completions",
+            "model": req.get("model"),
+            "metadata": req.get("metadata"),
+            "errors": [],
+            "status": "QUEUED",
+            "created_at": int(time.time()),
+            "total_requests": 0,
+            "completed_requests": 0,
+            "succeeded_requests": 0,
+            "failed_requests": 0,
+            "output_file": None,
+            "error_file": None,
+            "started_at": None,
+            "completed_at": None,
+        }
+        with self.server_ref.lock:
+            self.server_ref.jobs[job["id"]] = job
+        self._json(job)
+
+    def mistral_batch_get(self, body: bytes, job_id: str):
+        srv = self.server_ref
+        job = srv.jobs.get(job_id)
+        if job is None:
+            return self._json({"error": "job not found", "id": job_id}, 404)
+        if job["status"] == "QUEUED":
+            job.update(status="RUNNING", started_at=int(time.time()))
+        elif job["status"] == "RUNNING":
+            job.update(output_file=srv.batch_output(job), status="SUCCESS", completed_at=int(time.time()))
+        self._json(job)
+
+    def telegram_get_file(self, body: bytes, token: str):
+        self._json({
+            "ok": True,
+            "result": {
+                "file_id": "bench",
+                "file_unique_id": "bench",
+                "file_size": len(self.server_ref.config.telegram_file),
+                "file_path": "documents/invoice.pdf",
+            },
+        })
+
+    def telegram_download(self, body: bytes, token: str, path: str):
+        self._bytes(self.server_ref.config.telegram_file, "application/pdf")
+
+    def telegram_ok(self, body: bytes, token: str):
+        self._json({"ok": True, "result": True, "description": "stand-in"})
+
+
+# ---------------- Gemini REST shim ----------------
+class GeminiRestShim:
+    """
+    Drop-in for the subset of `google.generativeai` the app uses.
+
+    The SDK only talks gRPC/HTTPS to Google's endpoints, so the benchmark
+    routes Gemini through this plain-HTTP client instead; the request and
+    response bodies follow the public REST `generateContent` format.
+    """
+
+    def __init__(self, base_url: str, session: Optional[requests.Session] = None):
+        self.base_url = base_url.rstrip("/")
+        self.session = session or requests.Session()
+        self.api_key = None
+
+    def configure(self, api_key=None, **kwargs):
+        self.api_key = api_key
+
+    def GenerativeModel(self, model_name: str, **kwargs):
+        return _ShimModel(self, model_name)
+
+
+class _ShimModel:
+    def __init__(self, shim: GeminiRestShim, model_name: str):
+        self.shim = shim
+        self.model_name = model_name
+
+    def generate_content(self, contents, generation_config=None, **kwargs):
+        parts = []
+        for c in contents if isinstance(contents, list) else [contents]:
+            if isinstance(c, dict) and "data" in c:
+                parts.append({"inline_data": {"mime_type": c["mime_type"], "data": base64.b64encode(c["data"]).decode()}})
+            else:
+                parts.append({"text": str(c)})
+
+        resp = self.shim.session.post(
+            f"{self.shim.base_url}/v1beta/models/{self.model_name}:generateContent",
+            params={"key": self.shim.api_key},
+            json={"contents": [{"role": "user", "parts": parts}], "generationConfig": generation_config or {}},
+            timeout=120,
+        )
+        resp.raise_for_status()
+        payload = resp.json()
+
+        cand = payload["candidates"][0]
+        usage = payload.get("usageMetadata") or {}
+        return SimpleNamespace(
+            text="".join(p.get("text", "") for p in cand["content"]["parts"]),
+            candidates=[SimpleNamespace(finish_reason=cand.get("finishReason"))],
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=usage.get("promptTokenCount", 0),
+                candidates_token_count=usage.get("candidatesTokenCount", 0),
+                total_token_count=usage.get("totalTokenCount", 0),
+            ),
+        )
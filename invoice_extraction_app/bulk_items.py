@@ -0,0 +1,114 @@
+# invoice_extraction_app/bulk_items.py
+"""
+Item-table writes for large Extracted Invoices.
+
+Frappe saves a child table row by row: one UPDATE per existing row, one
+INSERT per new row, every save, even when nothing changed. For statements
+with hundreds or thousands of lines that dominates the save.
+
+`set_extracted_items` reuses the invoice's existing rows positionally, so a
+re-extraction only changes rows whose values differ. Once the table has
+`BULK_MIN_ROWS` rows, `ExtractedInvoice.update_child_table` hands it to
+`write_items_bulk`: one SELECT of the stored rows, a diff, one DELETE for
+changed or removed rows and multi-row INSERTs for the rest.
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, List
+
+import frappe
+from frappe.model import default_fields, no_value_fields
+from frappe.utils import cint, cstr, flt
+
+CHILD_DOCTYPE = "Extracted Invoice Item"
+BULK_MIN_ROWS = 100
+DELETE_CHUNK = 1000
+NUMERIC_TYPES = ("Float", "Currency", "Percent")
+INT_TYPES = ("Int", "Check")
+
+
+def set_extracted_items(inv, rows: List[Dict[str, Any]], fieldname: str = "items") -> None:
+    """Replace the item table with `rows`, keeping existing row documents in place."""
+    items = inv.get(fieldname)
+    # Reused rows must not keep values the new row does not set (a fresh row would be blank)
+    blank = dict.fromkeys(_value_fields(frappe.get_meta(CHILD_DOCTYPE)))
+    for i, values in enumerate(rows):
+        if i < len(items):
+            items[i].update({**blank, **values})
+        else:
+            inv.append(fieldname, values)
+    del items[len(rows):]
+
+
+def _value_fields(meta) -> List[str]:
+    return [
+        df.fieldname for df in meta.fields
+        if df.fieldtype not in no_value_fields and df.fieldname not in default_fields
+    ]
+
+
+def _signature(row, meta, fields: List[str]) -> tuple:
+    values = []
+    for fieldname in fields:
+        fieldtype = meta.get_field(fieldname).fieldtype
+        value = row.get(fieldname)
+        if fieldtype in NUMERIC_TYPES:
+            values.append(flt(value, 6))
+        elif fieldtype in INT_TYPES:
+            values.append(cint(value))
+        else:
+            values.append(cstr(value))
+    return tuple(values)
+
+
+def write_items_bulk(inv, fieldname: str = "items") -> Dict[str, int]:
+    """Persist a child table by diffing against the stored rows; returns row counts."""
+    meta = frappe.get_meta(CHILD_DOCTYPE)
+    fields = _value_fields(meta)
+
+    stored = {
+        r.name: r
+        for r in frappe.get_all(
+            CHILD_DOCTYPE,
+            filters={"parent": inv.name, "parenttype": inv.doctype, "parentfield": fieldname},
+            fields=["name", "idx", *fields],
+        )
+    }
+
+    stale, fresh = [], []
+    for idx, row in enumerate(inv.get(fieldname), 1):
+        row.idx = idx
+        old = stored.pop(row.name, None) if row.name else None
+        if old and old.idx == idx and _signature(old, meta, fields) == _signature(row, meta, fields):
+            continue
+
+        if old:
+            # Changed rows are rewritten under the same name
+            stale.append(row.name)
+        else:
+            row.name = frappe.generate_hash(length=10)
+        row.parent, row.parenttype, row.parentfield = inv.name, inv.doctype, fieldname
+        row.owner = row.owner or inv.owner
+        row.creation = row.creation or inv.modified
+        row.modified, row.modified_by = inv.modified, inv.modified_by
+        row.docstatus = inv.docstatus
+        fresh.append(row)
+
+    # Rows the invoice no longer has
+    stale.extend(stored)
+    for i in range(0, len(stale), DELETE_CHUNK):
+        frappe.db.delete(CHILD_DOCTYPE, {"name": ("in", stale[i:i + DELETE_CHUNK])})
+
+    if fresh:
+        columns = ["name", "owner", "creation", "modified", "modified_by", "docstatus",
+                   "idx", "parent", "parenttype", "parentfield", *fields]
+        values = []
+        for row in fresh:
+            # Same None -> 0 / date formatting as Document.db_insert
+            d = row.get_valid_dict(convert_dates_to_str=True, ignore_virtual=True)
+            values.append([d.get(c) for c in columns])
+        frappe.db.bulk_insert(CHILD_DOCTYPE, columns, values)
+        for row in fresh:
+            row.set("__islocal", False)
+
+    return {"unchanged": len(inv.get(fieldname)) - len(fresh), "written": len(fresh), "deleted": len(stale)}
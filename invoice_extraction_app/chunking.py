@@ -0,0 +1,180 @@
+# invoice_extraction_app/chunking.py
+"""
+Long invoices vs. the model's output-token cap.
+
+A statement with a few hundred lines does not fit in one answer: the model
+stops at the cap mid-JSON and the whole call was wasted. Both pipelines run
+their structuring call through this module instead:
+
+  - `extract_complete`: when the provider reports a MAX_TOKENS / "length"
+    finish, the items that did arrive complete are kept and the model is
+    asked for the items after the last one, until the answer ends normally.
+  - `extract_in_chunks`: when the text is expected to need more than the
+    output budget up front (`estimate_output_tokens`), the header and totals
+    are read in one small call and the item rows fragment by fragment, then
+    merged.
+
+`generate(source_text, instruction)` is the provider's call; it returns the
+raw answer and whether it was cut off.
+"""
+from __future__ import annotations
+
+import json
+import re
+from typing import Callable, List, Optional, Tuple
+
+from frappe.utils import cint
+
+from invoice_extraction_app.settings_cache import get_settings
+
+DEFAULT_OUTPUT_BUDGET = 8000
+TOKENS_PER_ITEM = 70
+BASE_OUTPUT_TOKENS = 400
+# Keep each chunk's expected answer well under the cap
+CHUNK_FILL = 0.7
+MAX_CONTINUATIONS = 6
+ROW_NUMBERS_RE = re.compile(r"\d[\d,]*(?:\.\d+)?")
+
+HEADER_ONLY = """
+- هذا الطلب لبيانات رأس الفاتورة والإجماليات فقط: أرجع "items" كقائمة فارغة [].
+"""
+ITEMS_ONLY = """
+- النص التالي جزء من فاتورة طويلة. أرجع JSON بالشكل {"items": [...]} فقط،
+  للأصناف الموجودة في هذا الجزء فقط وبنفس حقول الأصناف أعلاه.
+"""
+CONTINUE = """
+- انقطع الرد السابق بعد {count} صنفاً. آخر صنف تم استخراجه:
+{last}
+  أرجع JSON بالشكل {{"items": [...]}} فقط يحتوي على الأصناف التي تليه بالترتيب، دون تكرار ما سبق.
+"""
+
+Generate = Callable[[str, str], Tuple[str, bool]]
+Parse = Callable[[str], Optional[dict]]
+
+
+def output_budget() -> int:
+    s = get_settings("Extraction Settings")
+    return cint(s.get("max_output_tokens")) if s and s.get("max_output_tokens") else DEFAULT_OUTPUT_BUDGET
+
+
+def is_truncated(finish_reason) -> bool:
+    """Gemini FinishReason.MAX_TOKENS / Mistral and OpenAI-style "length"."""
+    name = getattr(finish_reason, "name", finish_reason)
+    return str(name).upper() in ("MAX_TOKENS", "LENGTH", "2")
+
+
+def _is_item_row(line: str) -> bool:
+    return len(ROW_NUMBERS_RE.findall(line)) >= 2
+
+
+def estimate_output_tokens(text: str) -> int:
+    rows = sum(1 for line in (text or "").splitlines() if _is_item_row(line))
+    return BASE_OUTPUT_TOKENS + rows * TOKENS_PER_ITEM
+
+
+def split_for_budget(text: str, budget: int) -> List[str]:
+    """Line-aligned fragments whose item rows each fit the budget; one fragment when all fit."""
+    if estimate_output_tokens(text) <= budget:
+        return [text]
+
+    per_chunk = max(int((budget * CHUNK_FILL - BASE_OUTPUT_TOKENS) / TOKENS_PER_ITEM), 1)
+    chunks, current, rows = [], [], 0
+    for line in text.splitlines():
+        if _is_item_row(line):
+            if rows >= per_chunk:
+                chunks.append("\n".join(current))
+                current, rows = [], 0
+            rows += 1
+        current.append(line)
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def _complete_objects_end(text: str, start: int) -> Tuple[int, int]:
+    """(end offset of the last complete object in the array opened at `start`, objects seen)."""
+    depth, in_string, escaped = 0, False, False
+    last_end, complete = -1, 0
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            depth += 1
+        elif ch in "}]":
+            depth -= 1
+            if depth == 1 and ch == "}":
+                last_end, complete = i + 1, complete + 1
+            elif depth == 0:
+                break
+    return last_end, complete
+
+
+def salvage(text: str) -> Optional[dict]:
+    """The part of a cut-off answer that parses: header fields plus every complete item."""
+    match = re.search(r'"items"\s*:\s*\[', text or "")
+    if not match:
+        return None
+    array_start = match.end() - 1
+    end, complete = _complete_objects_end(text, array_start)
+    head = text[text.find("{"):array_start + 1]
+    candidate = head + (text[array_start + 1:end] if complete else "") + "]}"
+    try:
+        data = json.loads(candidate)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _parse(parse: Parse, text: str) -> Optional[dict]:
+    try:
+        data = parse(text)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def extract_complete(generate: Generate, source: str, parse: Parse, instruction: str = "") -> Optional[dict]:
+    """One structuring call, continued from the last complete item while the answer is cut off."""
+    text, truncated = generate(source, instruction)
+    if not truncated:
+        return _parse(parse, text)
+
+    data = salvage(text)
+    if data is None:
+        return None
+    data.setdefault("items", [])
+
+    for _ in range(MAX_CONTINUATIONS):
+        last = json.dumps(data["items"][-1], ensure_ascii=False) if data["items"] else "-"
+        text, truncated = generate(
+            source, instruction + CONTINUE.format(count=len(data["items"]), last=last)
+        )
+        more = salvage(text) if truncated else _parse(parse, text)
+        items = (more or {}).get("items") or []
+        data["items"].extend(items)
+        if not truncated or not items:
+            break
+    return data
+
+
+def extract_in_chunks(generate: Generate, text: str, chunks: List[str], parse: Parse) -> Optional[dict]:
+    """Header and totals from the whole text, items fragment by fragment."""
+    data = extract_complete(generate, text, parse, HEADER_ONLY)
+    if data is None:
+        return None
+
+    items = []
+    for chunk in chunks:
+        part = extract_complete(generate, chunk, parse, ITEMS_ONLY)
+        items.extend((part or {}).get("items") or [])
+    data["items"] = items
+    return data
@@ -0,0 +1,42 @@
+# invoice_extraction_app/commands.py
+import click
+from frappe.commands import get_site, pass_context
+
+
+@click.command("ingest-invoices")
+@click.argument("source", type=click.Path(exists=True))
+@click.option("--batch-size", default=50, show_default=True, help="Files committed per transaction")
+@click.option("--max-pending", default=200, show_default=True, help="Pause while this many bulk extractions are pending (0 = no cap)")
+@click.option("--provider", type=click.Choice(["Gemini", "Mistral"]), help="Preferred extraction provider")
+@click.option("--no-extract", is_flag=True, default=False, help="Only create the records; do not enqueue extraction")
+@click.option("--restart", is_flag=True, default=False, help="Ignore the checkpoint and start from the first file")
+@click.option("--batch-api", is_flag=True, default=False, help="Extract through provider batch jobs (cheaper, results within hours)")
+@pass_context
+def ingest_invoices(context, source, batch_size, max_pending, provider, no_extract, restart, batch_api):
+    """Create Extracted Invoices from a folder or ZIP of PDFs / images (resumable)."""
+    import frappe
+
+    from invoice_extraction_app.ingest import ingest
+
+    if batch_size < 1:
+        raise click.BadParameter("must be at least 1", param_hint="--batch-size")
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        ingest(
+            source,
+            batch_size=batch_size,
+            max_pending=max_pending,
+            provider=provider,
+            extract=not no_extract,
+            restart=restart,
+            batch_api=batch_api,
+            log=click.echo,
+        )
+    finally:
+        frappe.destroy()
+
+
+commands = [ingest_invoices]
@@ -0,0 +1,380 @@
+# invoice_extraction_app/corrections.py
+"""
+Targeted re-extraction of the values that fail the arithmetic check.
+
+When a line's quantity x price does not give its printed total, or the item
+sums do not give the printed subtotal / tax / total, a full re-extraction
+re-reads the whole document for what is usually one misread figure. Instead
+`correct_failures`:
+
+  - collects the failing rows (quantity x price against the printed line
+    total, read from the invoice rows themselves) and the totals that
+    disagree with the items (against what the document states, recorded
+    in `validation.stated` by the pipelines' post-processing);
+  - cuts the document text (text layer or the OCR text cached per file) down
+    to the lines of those rows and the totals block;
+  - asks the model only about them, with a small output budget;
+  - merges the corrected values into the rows and the stored payload.
+
+Runs after routed extractions when "Correct Validation Failures" is on in
+Extraction Settings (off by default: each pass is a paid provider call),
+and from the form's "Re-extract Failing Rows" action.
+"""
+from __future__ import annotations
+
+import json
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+import frappe
+from frappe.utils import cint, flt, now
+
+from invoice_extraction_app.chunking import BASE_OUTPUT_TOKENS, TOKENS_PER_ITEM, _is_item_row, output_budget
+from invoice_extraction_app.instrumentation import note, traced
+from invoice_extraction_app.payloads import load_payload
+from invoice_extraction_app.settings_cache import get_settings
+from invoice_extraction_app.supplier_templates import document_text
+
+TOTAL_FIELDS = ("subtotal", "tax_amount", "total_amount")
+TOTALS_RE = re.compile(
+    r"\b(?:sub\s*-?\s*total|total|vat|tax|amount\s+due)\b|الإجمالي|المجموع|الضريبة|المستحق",
+    re.IGNORECASE,
+)
+WORD_RE = re.compile(r"\w{3,}")
+ARABIC_RE = re.compile(r"[\u0600-\u06FF]")
+# Lines around a matched row: wrapped descriptions, the figures on the next line
+CONTEXT_LINES = 1
+# With totals off and no suspect row, the model gets the rows to compare up to this many
+MAX_CONTEXT_ROWS = 60
+
+LABELS = {
+    "subtotal": "المبلغ قبل الضريبة",
+    "tax_amount": "مبلغ الضريبة",
+    "total_amount": "المبلغ الإجمالي",
+}
+
+PROMPT = """
+فشل التحقق من حسابات فاتورة بعد استخراجها:
+{problems}
+
+الأصناف المستخرجة المعنية (row = رقم السطر في الجدول):
+{rows}
+
+- اقرأ القيم الصحيحة من نص الفاتورة أدناه فقط. ممنوع التخمين.
+- أرجع JSON فقط بالشكل:
+{{"items": [{{"row": 1, "quantity": 0, "unit_price": 0, "item_total": 0, "tax_amount": 0}}],
+  "missing_items": [{{"description": "", "quantity": 0, "unit_price": 0, "item_total": 0, "tax_amount": 0}}],
+  "subtotal": 0, "tax_amount": 0, "total_amount": 0}}
+- في "items" الأسطر التي قيمها خاطئة فقط، وفي "missing_items" الأصناف الموجودة في النص ولم تُستخرج.
+- الإجماليات كما هي مطبوعة في الفاتورة؛ احذف أي إجمالي غير موجود في النص.
+
+نص الفاتورة:
+{text}
+"""
+
+
+@dataclass
+class Failures:
+    # 0-based row positions -> reason
+    rows: Dict[int, str] = field(default_factory=dict)
+    # field -> (stated on the document, sum of the items)
+    totals: Dict[str, tuple] = field(default_factory=dict)
+
+    def __bool__(self) -> bool:
+        return bool(self.rows or self.totals)
+
+
+def _enabled() -> bool:
+    s = get_settings("Extraction Settings")
+    return bool(cint(s.get("correct_validation_failures", 0))) if s else False
+
+
+def _tolerance(inv) -> float:
+    # Per-line rounding adds up on long tables
+    return max(0.01, 0.005 * len(inv.items))
+
+
+def item_sums(inv) -> Dict[str, float]:
+    subtotal = round(sum(flt(it.quantity) * flt(it.rate) for it in inv.items), 2)
+    tax = round(sum(flt(it.tax_amount) for it in inv.items), 2)
+    return {"subtotal": subtotal, "tax_amount": tax, "total_amount": round(subtotal + tax, 2)}
+
+
+def find_failures(inv, data: Optional[dict]) -> Failures:
+    validation = (data or {}).get("validation") or {}
+    stated = validation.get("stated") or {}
+    failures = Failures()
+
+    # From the rows, not `validation.row_mismatches`: those index data["items"], which need not
+    # line up with inv.items once rows were dropped, deleted or added
+    for i, it in enumerate(inv.items):
+        if abs(flt(it.amount) - flt(it.quantity) * flt(it.rate)) > 0.01:
+            failures.rows[i] = "الكمية × سعر الوحدة لا يساوي إجمالي السطر المطبوع"
+        elif (flt(it.quantity) <= 0 or flt(it.rate) <= 0) and not (flt(it.quantity) <= 0 and flt(it.rate) <= 0):
+            # Both empty is a note or blank line, not a misread figure
+            failures.rows[i] = "الكمية أو سعر الوحدة صفر أو سالب"
+
+    tol = _tolerance(inv)
+    sums = item_sums(inv)
+    for fieldname in TOTAL_FIELDS:
+        # A header edited by hand wins over what the model read
+        value = flt(inv.get(fieldname))
+        if abs(value - sums[fieldname]) <= tol:
+            value = flt(stated.get(fieldname))
+        if value and abs(value - sums[fieldname]) > tol:
+            failures.totals[fieldname] = (value, sums[fieldname])
+    return failures
+
+
+# ---------------- Question ----------------
+def _words(text: str) -> set:
+    return set(WORD_RE.findall((text or "").lower()))
+
+
+def relevant_text(text: str, inv, failures: Failures) -> str:
+    """The lines of the failing rows and the totals block; the whole text when none can be found."""
+    lines = text.splitlines()
+    keep, unmatched = set(), False
+
+    def around(i):
+        keep.update(range(i - CONTEXT_LINES, i + CONTEXT_LINES + 1))
+
+    for r in failures.rows:
+        words = _words(inv.items[r].extracted_text)
+        need = min(2, len(words))
+        hits = [i for i, line in enumerate(lines) if need and len(words & _words(line)) >= need]
+        for i in hits:
+            around(i)
+        unmatched = unmatched or not hits
+
+    if failures.totals:
+        for i, line in enumerate(lines):
+            if TOTALS_RE.search(line):
+                around(i)
+    if unmatched or (failures.totals and not failures.rows):
+        # Which row is misread (or missing) is not known: every table row
+        for i, line in enumerate(lines):
+            if _is_item_row(line):
+                keep.add(i)
+
+    if not keep:
+        return text
+    return "\n".join(lines[i] for i in sorted(keep) if 0 <= i < len(lines))
+
+
+def _row(inv, i: int) -> dict:
+    it = inv.items[i]
+    return {
+        "row": i + 1,
+        "description": it.extracted_text,
+        "quantity": flt(it.quantity),
+        "unit_price": flt(it.rate),
+        "item_total": flt(it.amount),
+        "tax_amount": flt(it.tax_amount),
+    }
+
+
+def build_question(text: str, inv, failures: Failures) -> tuple:
+    """(prompt, max output tokens)."""
+    problems = [f"- السطر {r + 1}: {reason}" for r, reason in sorted(failures.rows.items())]
+    for fieldname, (value, calculated) in failures.totals.items():
+        problems.append(f"- {LABELS[fieldname]}: مجموع الأصناف {calculated} والفاتورة تذكر {value}")
+
+    rows = sorted(failures.rows)
+    if not rows and len(inv.items) <= MAX_CONTEXT_ROWS:
+        rows = range(len(inv.items))
+    listed = "\n".join(json.dumps(_row(inv, i), ensure_ascii=False) for i in rows) or "-"
+
+    prompt = PROMPT.format(
+        problems="\n".join(problems),
+        rows=listed,
+        text=relevant_text(text, inv, failures),
+    )
+    # Room for the failing rows, a few missing ones and the totals
+    max_tokens = min(BASE_OUTPUT_TOKENS + TOKENS_PER_ITEM * (len(failures.rows) + 5), output_budget())
+    return prompt, max_tokens
+
+
+def _ask(prompt: str, max_tokens: int, preferred: Optional[str]) -> tuple:
+    """(provider name, answer) from the preferred provider, or the first configured one."""
+    from invoice_extraction_app.router import PROVIDERS
+
+    for name in sorted(PROVIDERS, key=lambda n: n != preferred):
+        provider = PROVIDERS[name]
+        if provider.is_configured():
+            return name, provider.ask(prompt, max_tokens)
+    return None, None
+
+
+# ---------------- Merge ----------------
+def _changed(old, new) -> bool:
+    return abs(flt(old) - flt(new)) > 0.001
+
+
+def _item_description(item: dict) -> str:
+    # As _apply_extracted_data_to_invoice names the row
+    return (item.get("description_ar") or item.get("description") or "").strip() or "Item"
+
+
+def data_rows(inv, data_items: list) -> Dict[int, int]:
+    """inv.items position -> data["items"] position, matched by description in order."""
+    mapping, start = {}, 0
+    for i, it in enumerate(inv.items):
+        for k in range(start, len(data_items)):
+            if isinstance(data_items[k], dict) and _item_description(data_items[k]) == (it.extracted_text or ""):
+                mapping[i], start = k, k + 1
+                break
+    return mapping
+
+
+def merge(inv, data: Optional[dict], answer: dict) -> dict:
+    """Apply the corrected values to the rows, the totals and the payload; what changed."""
+    from invoice_extraction_app.api import _match_item_link
+
+    data_items = (data or {}).get("items") or []
+    positions = data_rows(inv, data_items)
+    corrected = []
+    for fix in answer.get("items") or []:
+        r = cint(fix.get("row")) - 1
+        if not 0 <= r < len(inv.items):
+            continue
+        it = inv.items[r]
+        before = (it.quantity, it.rate, it.tax_amount)
+        if fix.get("quantity") not in (None, ""):
+            it.quantity = flt(fix["quantity"])
+        if fix.get("unit_price") not in (None, ""):
+            it.rate = flt(fix["unit_price"])
+        if fix.get("tax_amount") not in (None, ""):
+            it.tax_amount = flt(fix["tax_amount"])
+        if not any(_changed(a, b) for a, b in zip(before, (it.quantity, it.rate, it.tax_amount))):
+            continue
+
+        it.amount = flt(it.quantity) * flt(it.rate)
+        it.total_with_tax = it.amount + flt(it.tax_amount)
+        it.taxable = 1 if flt(it.tax_amount) > 0 else 0
+        corrected.append(r + 1)
+        if r in positions:
+            data_items[positions[r]].update({
+                "quantity": it.quantity,
+                "unit_price": it.rate,
+                "item_total": round(it.amount, 2),
+                "tax_amount": it.tax_amount,
+                "total_with_tax": round(it.total_with_tax, 2),
+            })
+
+    added = 0
+    for new in answer.get("missing_items") or []:
+        desc = (new.get("description") or "").strip()
+        qty, rate = flt(new.get("quantity")) or 1.0, flt(new.get("unit_price"))
+        if not desc or rate <= 0:
+            continue
+        tax = flt(new.get("tax_amount"))
+        inv.append("items", {
+            "extracted_text": desc,
+            "item_link": _match_item_link(desc),
+            "quantity": qty,
+            "rate": rate,
+            "amount": qty * rate,
+            "tax_amount": tax,
+            "total_with_tax": qty * rate + tax,
+            "language": "ar" if ARABIC_RE.search(desc) else "en",
+            "taxable": 1 if tax > 0 else 0,
+        })
+        data_items.append({"description": desc, "quantity": qty, "unit_price": rate,
+                           "item_total": round(qty * rate, 2), "tax_amount": tax})
+        added += 1
+
+    # Header from the items, as after an extraction; the printed totals are kept for the check
+    sums = item_sums(inv)
+    inv.update(sums)
+
+    if data is not None:
+        validation = data.setdefault("validation", {})
+        stated = validation.setdefault("stated", {})
+        for fieldname in TOTAL_FIELDS:
+            if flt(answer.get(fieldname)):
+                stated[fieldname] = flt(answer[fieldname])
+        validation["row_mismatches"] = []
+        data.update(sums)
+        data.setdefault("corrections", []).append({"rows": corrected, "added": added, "at": now()})
+        # Virtual field: stored compressed by the controller (payloads.py)
+        inv.extracted_data = json.dumps(data, ensure_ascii=False)
+
+    return {"corrected_rows": corrected, "added_rows": added}
+
+
+def correct_failures(inv, data: Optional[dict] = None, provider: Optional[str] = None) -> Optional[dict]:
+    """
+    Re-read only what fails the check and merge the answer into `inv` (not saved).
+
+    Returns None when nothing fails or there is no document text to ask about.
+    """
+    failures = find_failures(inv, data)
+    if not failures:
+        return None
+
+    text = document_text(inv.original_file) if inv.original_file else None
+    if not text:
+        return None
+
+    prompt, max_tokens = build_question(text, inv, failures)
+    name, answer = _ask(prompt, max_tokens, provider)
+    if not isinstance(answer, dict):
+        return None
+
+    result = merge(inv, data, answer)
+    result["provider"] = name
+    remaining = find_failures(inv, data)
+    result["remaining"] = {
+        "rows": [r + 1 for r in remaining.rows],
+        "totals": {k: {"stated": v[0], "from_items": v[1]} for k, v in remaining.totals.items()},
+    }
+    return result
+
+
+def correct_after_extraction(inv, data: dict, provider: Optional[str] = None) -> Optional[dict]:
+    """Routed extractions: one targeted pass when enabled; a failure leaves the extraction as it was."""
+    if not _enabled():
+        return None
+    try:
+        return correct_failures(inv, data, provider)
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), "Targeted Correction Error")
+        return None
+
+
+@frappe.whitelist()
+@traced()
+def reextract_failing(invoice_name: str) -> dict:
+    """Form action: re-read the failing rows and totals of an invoice and save the corrections."""
+    try:
+        inv = frappe.get_doc("Extracted Invoice", invoice_name)
+        inv.check_permission("write")
+
+        raw = load_payload(inv.name)
+        try:
+            data = json.loads(raw) if raw else None
+        except ValueError:
+            data = None
+
+        failures = find_failures(inv, data)
+        if not failures:
+            return {"success": True, "invoice": inv.name, "message": "Rows and totals already agree"}
+
+        preferred = (inv.extraction_model or "").split(":")[0].strip() or None
+        result = correct_failures(inv, data, preferred)
+        if result is None:
+            return {
+                "success": False,
+                "error": "No stored text for this document; run a full extraction instead",
+            }
+
+        note(provider=result["provider"])
+        inv.save(ignore_version=True)
+        frappe.db.commit()
+        return {"success": True, "invoice": inv.name, **result}
+
+    except Exception as e:
+        frappe.log_error(frappe.get_traceback(), "Targeted Correction Error")
+        return {"success": False, "error": str(e)}
@@ -0,0 +1,123 @@
+# invoice_extraction_app/costing.py
+"""
+Estimated spend per extraction and the daily budget.
+
+Prices live on the "Extraction Backend" rows (per 1M prompt / completion
+tokens and per OCR page). Costs are computed when the Extraction Log is
+written, off the request path, and today's total is cached briefly so the
+budget check stays a Redis read.
+
+Once the daily budget is reached, non-urgent jobs (Telegram, bulk) either go
+to the cheapest backend, wait in the slow `long` queue, or both, depending
+on "Extraction Settings". Manual extractions are never throttled.
+"""
+from __future__ import annotations
+
+from typing import Optional
+
+import frappe
+from frappe.utils import flt, getdate, nowdate
+
+from invoice_extraction_app.settings_cache import get_settings
+
+SPEND_CACHE_KEY = "invoice_extraction:spend:{}"
+SPEND_CACHE_TTL = 60
+SLOW_LANE_QUEUE = "long"
+# Share of the input price charged for cached prompt tokens
+CACHED_INPUT_RATE = 0.25
+# Share of the token prices charged for requests served through a provider batch job
+BATCH_PRICE_RATE = 0.5
+
+
+def _settings():
+    return get_settings("Extraction Settings")
+
+
+def _price_row(provider: str, model: str):
+    """Backend row priced for this provider/model; Mistral logs carry "ocr_model+chat_model"."""
+    s = _settings()
+    if not s:
+        return None
+
+    fallback = None
+    for row in s.backends or []:
+        if row.provider != provider:
+            continue
+        row_model = (row.model or "").strip()
+        if row_model and model and (row_model == model or model.split("+")[-1] == row_model):
+            return row
+        if not row_model:
+            fallback = row
+    return fallback
+
+
+def estimate_cost(provider: str, model: str, tokens_in: int = 0, tokens_out: int = 0, pages: int = 0,
+                  flat_fallback: bool = True, tokens_cached: int = 0, batch: bool = False) -> float:
+    row = _price_row(provider, model)
+    if not row:
+        return 0.0
+
+    # Prompt tokens served from a context cache are part of tokens_in, billed at a discount
+    cached = min(flt(tokens_cached), flt(tokens_in))
+    tokens = (
+        (flt(tokens_in) - cached + cached * CACHED_INPUT_RATE) * flt(row.input_price) / 1_000_000
+        + flt(tokens_out) * flt(row.output_price) / 1_000_000
+    )
+    cost = tokens * (BATCH_PRICE_RATE if batch else 1) + flt(pages) * flt(row.page_price)
+    # No token prices configured: fall back to the flat per-extraction estimate
+    if not cost and flat_fallback and flt(row.cost_per_extraction):
+        cost = flt(row.cost_per_extraction) * (BATCH_PRICE_RATE if batch else 1)
+    return round(cost, 6)
+
+
+# ---------------- Budget ----------------
+def spent_on(day=None) -> float:
+    day = getdate(day or nowdate())
+    key = SPEND_CACHE_KEY.format(day)
+    cached = frappe.cache().get_value(key)
+    if cached is not None:
+        return flt(cached)
+
+    total = frappe.db.sql(
+        """
+        SELECT COALESCE(SUM(estimated_cost), 0)
+        FROM `tabExtraction Log`
+        WHERE started_at >= %(day)s AND started_at < %(day)s + INTERVAL 1 DAY
+        """,
+        {"day": day},
+    )[0][0]
+    frappe.cache().set_value(key, flt(total), expires_in_sec=SPEND_CACHE_TTL)
+    return flt(total)
+
+
+def add_spend(amount: float, day=None) -> None:
+    """Keep the cached total current between refreshes."""
+    key = SPEND_CACHE_KEY.format(getdate(day or nowdate()))
+    cached = frappe.cache().get_value(key)
+    if cached is not None and amount:
+        frappe.cache().set_value(key, flt(cached) + flt(amount), expires_in_sec=SPEND_CACHE_TTL)
+
+
+def over_budget_action() -> Optional[str]:
+    """The configured action when today's spend has reached the budget, else None."""
+    s = _settings()
+    budget = flt(getattr(s, "daily_budget", 0)) if s else 0
+    if not budget:
+        return None
+    try:
+        if spent_on() < budget:
+            return None
+    except Exception:
+        return None
+    return s.over_budget_action or "Cheaper Model"
+
+
+def prefer_cheaper(urgent: bool = True) -> bool:
+    action = None if urgent else over_budget_action()
+    return bool(action and "Cheaper Model" in action)
+
+
+def extraction_queue(default: str = "default", urgent: bool = False) -> str:
+    """Queue for an extraction job; non-urgent work moves to the slow lane when over budget."""
+    action = None if urgent else over_budget_action()
+    return SLOW_LANE_QUEUE if action and "Slow Lane" in action else default
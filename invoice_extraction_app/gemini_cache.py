@@ -0,0 +1,137 @@
+# invoice_extraction_app/gemini_cache.py
+"""
+Gemini context caching for the static part of the extraction prompt.
+
+The system instruction, JSON format and prompt instructions are the same
+for every invoice and make up most of the input of a text-layer request.
+`cached_model` registers that prefix once as a Gemini CachedContent per
+(API key, model, prompt text), so a settings change gets a new cache, and
+hands out a model bound to it. The handle is shared through Redis by all
+workers and extended while it is in use; cached input tokens are billed at
+a fraction of the normal price.
+
+When caching is off ("Cache Static Prompt" in Gemini Settings), the SDK is
+missing or has no caching support, or Gemini refuses the prefix (too short for the model's
+minimum, model without caching), `cached_model` returns None and the caller
+sends the prompt inline as before.
+"""
+from __future__ import annotations
+
+import datetime
+import hashlib
+import time
+from typing import Any, Dict
+
+import frappe
+from frappe.utils import cint
+
+from invoice_extraction_app import sdk
+from invoice_extraction_app.settings_cache import get_settings
+
+HANDLE_KEY = "invoice_extraction:gemini_cache:{}"
+UNCACHEABLE_KEY = "invoice_extraction:gemini_cache:uncacheable:{}"
+LOCK_KEY = "invoice_extraction:gemini_cache:lock:{}"
+DEFAULT_TTL_MINUTES = 60
+# Extend the cache when less than this is left, so no request hits an expired handle
+REFRESH_MARGIN = 300
+# Do not ask again for a prefix Gemini refused before this long
+UNCACHEABLE_RETRY = 6 * 3600
+LOCK_SECONDS = 30
+
+# CachedContent objects per cache name: getting one by name is an API call
+_handles: Dict[str, Any] = {}
+
+
+def _enabled(settings) -> bool:
+    return bool(settings) and bool(cint(settings.get("use_context_cache", 1))) and sdk.available("caching")
+
+
+def _ttl(settings) -> int:
+    return (cint(settings.get("context_cache_ttl")) or DEFAULT_TTL_MINUTES) * 60
+
+
+def cache_id(api_key: str, model_name: str, prefix: str) -> str:
+    return hashlib.sha256(f"{api_key}\0{model_name}\0{prefix}".encode("utf-8")).hexdigest()[:24]
+
+
+def _handle(name: str):
+    if name not in _handles:
+        _handles[name] = sdk.caching().CachedContent.get(name)
+    return _handles[name]
+
+
+def _create(key: str, model_name: str, prefix: str, ttl: int):
+    handle = sdk.caching().CachedContent.create(
+        model=f"models/{model_name}",
+        display_name=f"invoice-extraction-{key}",
+        system_instruction=prefix,
+        ttl=datetime.timedelta(seconds=ttl),
+    )
+    _handles[handle.name] = handle
+    return handle
+
+
+def _current_handle(key: str, model_name: str, prefix: str, ttl: int):
+    """The shared handle for `key`: reused, extended near expiry, or created; None while another worker creates it."""
+    cache = frappe.cache()
+    stored = cache.get_value(HANDLE_KEY.format(key))
+    now = time.time()
+
+    if stored and stored["expires"] - now > REFRESH_MARGIN:
+        return _handle(stored["name"])
+
+    # One worker extends or creates; the others send this request inline
+    lock = cache.make_key(LOCK_KEY.format(key))
+    if not cache.set(lock, 1, nx=True, ex=LOCK_SECONDS):
+        return _handle(stored["name"]) if stored and stored["expires"] > now else None
+
+    try:
+        if stored and stored["expires"] > now:
+            handle = _handle(stored["name"])
+            handle.update(ttl=datetime.timedelta(seconds=ttl))
+        else:
+            handle = _create(key, model_name, prefix, ttl)
+        cache.set_value(
+            HANDLE_KEY.format(key),
+            {"name": handle.name, "expires": now + ttl},
+            expires_in_sec=ttl,
+        )
+        return handle
+    finally:
+        cache.delete(lock)
+
+
+def cached_model(model_name: str, prefix: str):
+    """A GenerativeModel whose system instruction is the cached `prefix`, or None to send it inline."""
+    settings = get_settings("Gemini Settings")
+    if not _enabled(settings):
+        return None
+
+    key = cache_id(settings.gemini_api_key or "", model_name, prefix)
+    cache = frappe.cache()
+    if cache.get_value(UNCACHEABLE_KEY.format(key)):
+        return None
+
+    try:
+        handle = _current_handle(key, model_name, prefix, _ttl(settings))
+    except Exception as e:
+        # Below the model's minimum cacheable size, model without caching, quota, ...
+        cache.set_value(UNCACHEABLE_KEY.format(key), str(e)[:500], expires_in_sec=UNCACHEABLE_RETRY)
+        frappe.log_error(f"{model_name}: {e}", "Gemini Context Cache")
+        return None
+
+    if handle is None:
+        return None
+    return sdk.genai().GenerativeModel.from_cached_content(cached_content=handle)
+
+
+def forget(model_name: str, prefix: str) -> None:
+    """Drop a handle Gemini no longer knows (deleted or expired early); the next call creates a new one."""
+    settings = get_settings("Gemini Settings")
+    if not settings:
+        return
+    key = cache_id(settings.gemini_api_key or "", model_name, prefix)
+    stored = frappe.cache().get_value(HANDLE_KEY.format(key))
+    if stored:
+        _handles.pop(stored["name"], None)
+    frappe.cache().delete_value(HANDLE_KEY.format(key))
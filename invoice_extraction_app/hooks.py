@@ -130,26 +130,47 @@ app_license = "mit"
 # 	}
 # }
 
+doc_events = {
+	"Gemini Settings": {
+		"on_update": "invoice_extraction_app.settings_cache.bump_settings_version"
+	},
+	"Mistral Settings": {
+		"on_update": "invoice_extraction_app.settings_cache.bump_settings_version"
+	},
+	"Telegram Settings": {
+		"on_update": "invoice_extraction_app.settings_cache.bump_settings_version"
+	},
+	"Extraction Settings": {
+		"on_update": "invoice_extraction_app.settings_cache.bump_settings_version"
+	},
+	"Extracted Invoice": {
+		"after_insert": "invoice_extraction_app.auto_extract.on_invoice_insert"
+	},
+	"File": {
+		"after_insert": "invoice_extraction_app.auto_extract.on_file_insert"
+	}
+}
+
 # Scheduled Tasks
 # ---------------
 
-# scheduler_events = {
-# 	"all": [
-# 		"invoice_extraction_app.tasks.all"
-# 	],
-# 	"daily": [
-# 		"invoice_extraction_app.tasks.daily"
-# 	],
-# 	"hourly": [
-# 		"invoice_extraction_app.tasks.hourly"
-# 	],
-# 	"weekly": [
-# 		"invoice_extraction_app.tasks.weekly"
-# 	],
-# 	"monthly": [
-# 		"invoice_extraction_app.tasks.monthly"
-# 	],
-# }
+scheduler_events = {
+	"cron": {
+		"* * * * *": [
+			"invoice_extraction_app.scheduling.dispatch",
+			"invoice_extraction_app.auto_extract.flush_pending"
+		],
+		"*/5 * * * *": [
+			"invoice_extraction_app.batch_lane.poll_batches"
+		],
+		"*/10 * * * *": [
+			"invoice_extraction_app.batch_lane.submit_pending"
+		]
+	},
+	"hourly": [
+		"invoice_extraction_app.mistral.delete_expired_uploads"
+	],
+}
 
 # Testing
 # -------
@@ -186,7 +207,7 @@ app_license = "mit"
 
 # Job Events
 # ----------
-# before_job = ["invoice_extraction_app.utils.before_job"]
+before_job = ["invoice_extraction_app.sdk.preload_for_job"]
 # after_job = ["invoice_extraction_app.utils.after_job"]
 
 # User Data Protection
@@ -223,7 +244,7 @@ app_license = "mit"
 # Automatically update python controller files with type annotations for this app.
 # export_python_type_annotations = True
 
-# default_log_clearing_doctypes = {
-# 	"Logging DocType Name": 30  # days to retain logs
-# }
+default_log_clearing_doctypes = {
+	"Extraction Log": 90
+}
 
@@ -0,0 +1,223 @@
+# invoice_extraction_app/ingest.py
+"""
+Bulk ingest of invoice backlogs (folders or ZIP archives).
+
+Files are streamed one at a time in a stable order (sorted paths / archive
+order); a ZIP member is read only when it is reached, never the whole
+archive. Every `batch_size` files the File + Extracted Invoice records are
+committed together and a checkpoint is written, so an interrupted run picks
+up after the last committed batch. After each commit the invoices go to the
+scheduler's bulk class, and ingest pauses while `max_pending` of them wait.
+With `--batch-api` they are queued for provider batch jobs instead
+(batch_lane.py): cheaper, results within hours, no waiting.
+
+Run through bench:
+
+    bench --site mysite ingest-invoices /data/invoices.zip --batch-size 100
+    bench --site mysite ingest-invoices /data/backfill/ --batch-api
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import time
+import zipfile
+from typing import Callable, Iterator, Optional, Tuple
+
+import frappe
+from frappe.model.naming import make_autoname
+
+from invoice_extraction_app import batch_lane
+from invoice_extraction_app.scheduling import pending_count, submit
+
+SUPPORTED = {".pdf": "pdf", ".jpg": "image", ".jpeg": "image", ".png": "image"}
+NAMING_SERIES = "BULK-EXT-INV-.#####"
+QUEUE_POLL_SECONDS = 5
+
+
+# ---------------- Sources ----------------
+def _kind(path: str) -> Optional[str]:
+    return SUPPORTED.get(os.path.splitext(path)[1].lower())
+
+
+def iter_directory(root: str) -> Iterator[Tuple[str, Callable[[], bytes]]]:
+    """(relative path, reader) for every supported file, in sorted order."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            if _kind(name):
+                yield os.path.relpath(path, root), _file_reader(path)
+
+
+def _file_reader(path: str) -> Callable[[], bytes]:
+    def read() -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+    return read
+
+
+def iter_zip(zf: zipfile.ZipFile) -> Iterator[Tuple[str, Callable[[], bytes]]]:
+    """Archive members in stored order; each member is decompressed on its own."""
+    for info in zf.infolist():
+        if info.is_dir() or not _kind(info.filename):
+            continue
+        if os.path.basename(info.filename).startswith("._"):
+            # macOS resource forks
+            continue
+        yield info.filename, (lambda info=info: zf.read(info))
+
+
+def count_entries(source: str) -> Optional[int]:
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as zf:
+            return sum(1 for _ in iter_zip(zf))
+    return None
+
+
+# ---------------- Checkpoint ----------------
+def checkpoint_path(source: str) -> str:
+    digest = hashlib.sha1(os.path.abspath(source).encode()).hexdigest()[:16]
+    return frappe.get_site_path("private", "ingest", f"{digest}.json")
+
+
+def load_checkpoint(path: str) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_checkpoint(path: str, state: dict) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+# ---------------- Records ----------------
+def create_invoice(entry: str, content: bytes) -> str:
+    inv_name = make_autoname(NAMING_SERIES)
+
+    file_doc = frappe.get_doc({
+        "doctype": "File",
+        "file_name": os.path.basename(entry),
+        "attached_to_doctype": "Extracted Invoice",
+        "attached_to_name": inv_name,
+        "is_private": 1,
+        "content": content,
+    })
+    file_doc.insert(ignore_permissions=True)
+
+    inv = frappe.new_doc("Extracted Invoice")
+    inv.name = inv_name
+    inv.flags.name_set = True
+    inv.flags.skip_auto_extract = True
+    inv.status = "Draft"
+    inv.file_type = _kind(entry)
+    inv.original_file = file_doc.file_url
+    inv.insert(ignore_permissions=True)
+    return inv.name
+
+
+def _submit_extractions(names, tenant: str, provider: Optional[str], batch_api: bool = False) -> None:
+    # Records are already committed: hand them to the scheduler right away
+    if batch_api:
+        batch_lane.request(names, after_commit=False)
+        return
+    for name in names:
+        submit(name, "bulk", tenant=tenant, provider=provider, after_commit=False)
+
+
+def _wait_for_capacity(max_pending: int, log: Callable[[str], None]) -> None:
+    if not max_pending:
+        return
+    waited = False
+    while pending_count("bulk") >= max_pending:
+        if not waited:
+            log(f"{max_pending}+ bulk extractions pending, waiting...")
+            waited = True
+        time.sleep(QUEUE_POLL_SECONDS)
+
+
+# ---------------- Run ----------------
+def ingest(
+    source: str,
+    batch_size: int = 50,
+    max_pending: int = 200,
+    provider: Optional[str] = None,
+    extract: bool = True,
+    restart: bool = False,
+    batch_api: bool = False,
+    log: Callable[[str], None] = print,
+) -> dict:
+    """Ingest every supported file under `source` (directory or .zip); resumable."""
+    source = os.path.abspath(source)
+    ckpt = checkpoint_path(source)
+    state = {} if restart else load_checkpoint(ckpt)
+    done = state.get("done", 0)
+    if done:
+        log(f"Resuming after {done} files (last: {state.get('last')})")
+
+    total = count_entries(source)
+    tenant = f"ingest:{os.path.basename(source.rstrip(os.sep))}"
+    stats = {"done": done, "created": state.get("created", 0), "failed": state.get("failed", 0)}
+    started, bytes_read = time.perf_counter(), 0
+    batch, failures = [], state.get("failures", [])
+
+    def flush(last_entry: str) -> None:
+        nonlocal batch
+        frappe.db.commit()
+        if extract and batch:
+            _submit_extractions(batch, tenant, provider, batch_api)
+        stats["created"] += len(batch)
+        save_checkpoint(ckpt, {**stats, "source": source, "last": last_entry, "failures": failures[-100:]})
+        batch = []
+
+        elapsed = time.perf_counter() - started
+        processed = stats["done"] - done
+        rate = processed / elapsed if elapsed else 0.0
+        eta = f", ETA {(total - stats['done']) / rate / 60:.1f} min" if total and rate else ""
+        log(
+            f"{stats['done']}{f'/{total}' if total else ''} files | {stats['created']} invoices | "
+            f"{stats['failed']} failed | {rate:.1f} files/s | {bytes_read / elapsed / 1e6 if elapsed else 0:.2f} MB/s{eta}"
+        )
+        if extract and not batch_api:
+            _wait_for_capacity(max_pending, log)
+
+    zf = zipfile.ZipFile(source) if zipfile.is_zipfile(source) else None
+    try:
+        entries = iter_zip(zf) if zf else iter_directory(source)
+        position, entry = 0, None
+        for entry, read in entries:
+            position += 1
+            if position <= done:
+                continue
+
+            frappe.db.savepoint("bulk_ingest_entry")
+            try:
+                content = read()
+                bytes_read += len(content)
+                batch.append(create_invoice(entry, content))
+            except Exception as e:
+                # One bad file must not roll back the rest of the batch
+                frappe.db.rollback(save_point="bulk_ingest_entry")
+                stats["failed"] += 1
+                failures.append({"entry": entry, "error": str(e)[:300]})
+                frappe.log_error(frappe.get_traceback(), f"Bulk Ingest Error: {entry}"[:140])
+            stats["done"] = position
+
+            if (position - done) % batch_size == 0:
+                flush(entry)
+
+        if position > done and (position - done) % batch_size:
+            flush(entry)
+    finally:
+        if zf:
+            zf.close()
+
+    log(f"Finished: {stats['created']} invoices from {stats['done']} files, {stats['failed']} failed")
+    return stats
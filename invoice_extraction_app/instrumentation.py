@@ -0,0 +1,216 @@
+# invoice_extraction_app/instrumentation.py
+"""
+Per-stage timing for extractions.
+
+The outermost extraction entry point opens a trace on `frappe.local`; the
+pipelines then time their stages with `stage(...)` / `record_stage(...)`
+and attach counters with `note(...)` / `count(...)`. When the entry point
+returns, the trace is written to "Extraction Log" from a background job, so
+the request never waits on the insert. Outside a trace every helper is a
+no-op.
+"""
+from __future__ import annotations
+
+import functools
+import inspect
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Optional
+
+import frappe
+from frappe.utils import now
+
+STAGES = (
+    "file_read",
+    "preprocess",
+    "upload",
+    "signed_url",
+    "ocr",
+    "generation",
+    "parse",
+    "matching",
+    "save",
+)
+COUNTERS = (
+    "payload_bytes",
+    "page_count",
+    "split_ocr_pages",
+    "item_count",
+    "tokens_in",
+    "tokens_out",
+    "tokens_cached",
+    "retry_count",
+)
+
+
+class ExtractionTrace:
+    def __init__(self, entry_point: str = "", provider: str = "", invoice: Optional[str] = None):
+        self.started = time.perf_counter()
+        self.started_at = now()
+        self.stages: Dict[str, float] = {}
+        self.fields: Dict[str, Any] = {
+            "entry_point": entry_point,
+            "provider": provider,
+            "invoice": invoice,
+        }
+
+    def add_stage(self, name: str, ms: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + ms
+
+    def as_log(self, outcome: str, error: Optional[str] = None) -> Dict[str, Any]:
+        log = {k: v for k, v in self.fields.items() if v not in (None, "")}
+        log.update({f"{name}_ms": round(ms, 2) for name, ms in self.stages.items() if name in STAGES})
+        log.update({
+            "outcome": outcome,
+            "error": (error or "")[:1000] or None,
+            "started_at": self.started_at,
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 2),
+            "user": frappe.session.user if getattr(frappe.local, "session", None) else None,
+        })
+        return log
+
+
+# ---------------- Access helpers ----------------
+def current_trace() -> Optional[ExtractionTrace]:
+    return getattr(frappe.local, "extraction_trace", None)
+
+
+@contextmanager
+def stage(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, t0)
+
+
+def record_stage(name: str, started: float) -> None:
+    """Add the time since `started` (a perf_counter value) to `name`."""
+    trace = current_trace()
+    if trace:
+        trace.add_stage(name, (time.perf_counter() - started) * 1000)
+
+
+def note(**fields) -> None:
+    """Set fields on the active trace (last write wins)."""
+    trace = current_trace()
+    if trace:
+        trace.fields.update({k: v for k, v in fields.items() if v is not None})
+
+
+def count(**counters) -> None:
+    """Increment numeric fields on the active trace."""
+    trace = current_trace()
+    if trace:
+        for k, v in counters.items():
+            trace.fields[k] = (trace.fields.get(k) or 0) + (v or 0)
+
+
+# ---------------- Entry points ----------------
+def traced(provider: str = ""):
+    """
+    Open a trace around an extraction entry point unless one is already active.
+
+    The wrapped function's result dict decides the outcome (`success` / `ok`).
+    """
+
+    def decorator(fn):
+        sig = inspect.signature(fn)
+        entry_point = f"{fn.__module__}.{fn.__name__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if current_trace():
+                if provider:
+                    note(provider=provider)
+                return fn(*args, **kwargs)
+
+            try:
+                invoice = sig.bind_partial(*args, **kwargs).arguments.get("invoice_name")
+            except TypeError:
+                invoice = None
+
+            trace = frappe.local.extraction_trace = ExtractionTrace(entry_point, provider, invoice)
+            try:
+                with _interactive_slot(trace):
+                    res = fn(*args, **kwargs)
+            except Exception as e:
+                _finish(trace, "Failed", str(e))
+                raise
+
+            ok = not isinstance(res, dict) or bool(res.get("success", res.get("ok", True)))
+            _finish(trace, "Success" if ok else "Failed", None if ok else str(res.get("error") or ""))
+            return res
+
+        return wrapper
+
+    return decorator
+
+
+def _interactive_slot(trace: ExtractionTrace):
+    """Extractions started from a web request are interactive: someone is waiting on them."""
+    if not getattr(frappe.local, "request", None):
+        return nullcontext()
+
+    from invoice_extraction_app.scheduling import interactive
+
+    trace.fields["priority_class"] = "Interactive"
+    return interactive()
+
+
+def _finish(trace: ExtractionTrace, outcome: str, error: Optional[str]) -> None:
+    frappe.local.extraction_trace = None
+    try:
+        frappe.enqueue(
+            "invoice_extraction_app.instrumentation.insert_extraction_log",
+            queue="short",
+            log=trace.as_log(outcome, error),
+        )
+    except Exception:
+        # Instrumentation must never fail an extraction
+        pass
+
+
+def insert_extraction_log(log: Dict[str, Any]) -> None:
+    from invoice_extraction_app.costing import add_spend, estimate_cost
+
+    if log.get("invoice"):
+        inv = frappe.db.get_value(
+            "Extracted Invoice", log["invoice"], ["supplier_link", "telegram_chat_id"], as_dict=True
+        ) or {}
+        log.setdefault("supplier", inv.get("supplier_link"))
+        log.setdefault("telegram_chat_id", inv.get("telegram_chat_id"))
+
+    # Text-layer and cached pages were never OCR'd (again); template reads never called a model
+    cost = estimate_cost(
+        log.get("provider"), log.get("model"),
+        log.get("tokens_in"), log.get("tokens_out"),
+        0 if log.get("text_source") in ("Text Layer", "OCR Cache") else log.get("page_count"),
+        flat_fallback=not (log.get("model") or "").startswith("Template:"),
+        tokens_cached=log.get("tokens_cached"),
+        batch=log.get("priority_class") == "Batch",
+    )
+    # Pages OCR'd to look for invoice boundaries (segmentation), priced at the Mistral OCR rate
+    if log.get("split_ocr_pages"):
+        cost = round(cost + estimate_cost(
+            "Mistral", log.get("model") if log.get("provider") == "Mistral" else "",
+            pages=log["split_ocr_pages"], flat_fallback=False,
+        ), 6)
+    log["estimated_cost"] = cost
+    log["cost_per_page"] = round(cost / log["page_count"], 6) if log.get("page_count") else 0
+
+    doc = frappe.get_doc({"doctype": "Extraction Log", **log})
+    doc.flags.ignore_links = True
+    doc.insert(ignore_permissions=True)
+    frappe.db.commit()
+    add_spend(cost, log.get("started_at"))
+
+
+# ---------------- Reporting ----------------
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
@@ -15,6 +15,16 @@ frappe.ui.form.on('Extracted Invoice', {
             window.extractedInvoiceButtons = [];
         }
 
+        if (frm.doc.original_file && frm.doc.status !== 'Converted') {
+            console.log("✅ Adding Auto Extract button");
+
+            const autoExtractBtn = frm.add_custom_button(__('⚡ Extract (Auto)'), function () {
+                extract_invoice_data_routed(frm);
+            }, __('Extraction'));
+
+            window.extractedInvoiceButtons.push(autoExtractBtn);
+        }
+
         if (frm.doc.original_file && frm.doc.status !== 'Converted') {
             console.log("✅ Adding Gemini Extract button");
 
@@ -34,8 +44,30 @@ frappe.ui.form.on('Extracted Invoice', {
 
             window.extractedInvoiceButtons.push(mistralExtractBtn);
 
-            frm.page.set_primary_action(__('Extract via Mistral'), function () {
-                extract_invoice_data_mistral(frm);
+            if (!frm.doc.source_invoice && (frm.doc.original_file || '').toLowerCase().endsWith('.pdf')) {
+                const splitBtn = frm.add_custom_button(__('✂️ Split Multi-Invoice PDF'), function () {
+                    split_batch_pdf(frm);
+                }, __('Extraction'));
+
+                window.extractedInvoiceButtons.push(splitBtn);
+            }
+
+            const batchBtn = frm.add_custom_button(__('🕒 Queue for Batch'), function () {
+                queue_for_batch(frm);
+            }, __('Extraction'));
+
+            window.extractedInvoiceButtons.push(batchBtn);
+
+            if (['Processing', 'Ready'].includes(frm.doc.status)) {
+                const replayBtn = frm.add_custom_button(__('↻ Replay from Archive'), function () {
+                    replay_from_archive(frm);
+                }, __('Extraction'));
+
+                window.extractedInvoiceButtons.push(replayBtn);
+            }
+
+            frm.page.set_primary_action(__('Extract'), function () {
+                extract_invoice_data_routed(frm);
             }, 'fa fa-magic');
         }
 
@@ -84,6 +116,14 @@ frappe.ui.form.on('Extracted Invoice', {
             window.extractedInvoiceButtons.push(fixBtn);
         }
 
+        if (hasItems && frm.doc.original_file && !frm.is_new()) {
+            const reextractBtn = frm.add_custom_button(__('🎯 Re-extract Failing Rows'), function () {
+                reextract_failing_rows(frm);
+            }, __('Tools'));
+
+            window.extractedInvoiceButtons.push(reextractBtn);
+        }
+
         // تنسيق حالة الاستخراج
         if (frm.doc.status && frm.fields_dict.status) {
             const status_class = {
@@ -97,6 +137,8 @@ frappe.ui.form.on('Extracted Invoice', {
             );
         }
 
+        setup_lazy_extracted_data(frm);
+
         console.log("✅ Form refresh completed");
     },
 
@@ -121,6 +163,143 @@ frappe.ui.form.on('Extracted Invoice', {
     }
 });
 
+// extracted_data is virtual: the payload is fetched the first time its section is opened
+function setup_lazy_extracted_data(frm) {
+    const section = frm.fields_dict.section_break_jbzj;
+    if (frm.is_new() || !section || !section.head) {
+        return;
+    }
+
+    const load = function () {
+        if (frm.doc.extracted_data != null || frm.__loading_extracted_data) {
+            return;
+        }
+        frm.__loading_extracted_data = true;
+        frappe.call({
+            method: 'invoice_extraction_app.payloads.get_extracted_data',
+            args: {
+                invoice_name: frm.doc.name
+            },
+            callback: function (r) {
+                // Not through set_value: loading must not mark the form dirty
+                frm.doc.extracted_data = r.message || '';
+                frm.refresh_field('extracted_data');
+            },
+            always: function () {
+                frm.__loading_extracted_data = false;
+            }
+        });
+    };
+
+    section.head.off('click.extracted_data').on('click.extracted_data', function () {
+        if (!section.is_collapsed()) {
+            load();
+        }
+    });
+    if (!section.is_collapsed()) {
+        load();
+    }
+}
+
+function split_batch_pdf(frm) {
+    frappe.call({
+        method: 'invoice_extraction_app.segmentation.split_invoice',
+        args: { invoice_name: frm.doc.name },
+        freeze: true,
+        freeze_message: __('Looking for separate invoices...'),
+        callback: function (r) {
+            if (r.message && r.message.success) {
+                frm.reload_doc();
+                frappe.show_alert({
+                    message: __('Split into {0} invoices; they are being extracted in the background', [r.message.split_into.length]),
+                    indicator: 'green'
+                }, 7);
+            } else if (r.message) {
+                frappe.msgprint({
+                    title: __('Not Split'),
+                    message: r.message.error,
+                    indicator: 'orange'
+                });
+            }
+        }
+    });
+}
+
+function queue_for_batch(frm) {
+    frappe.call({
+        method: 'invoice_extraction_app.batch_lane.queue_for_batch',
+        args: { invoice_names: [frm.doc.name] },
+        callback: function (r) {
+            if (r.message && r.message.success) {
+                frappe.show_alert({
+                    message: __('Queued for the next batch job ({0} waiting); results arrive within hours', [r.message.pending]),
+                    indicator: 'blue'
+                }, 7);
+            } else if (r.message) {
+                frappe.msgprint({
+                    title: __('Not Queued'),
+                    message: r.message.error,
+                    indicator: 'orange'
+                });
+            }
+        }
+    });
+}
+
+function replay_from_archive(frm) {
+    frappe.call({
+        method: 'invoice_extraction_app.raw_archive.replay_invoices',
+        args: { invoice_names: [frm.doc.name] },
+        callback: function (r) {
+            if (r.message && r.message.success && r.message.queued) {
+                frappe.show_alert({
+                    message: __('Re-applying the archived responses in the background; reload in a moment'),
+                    indicator: 'blue'
+                }, 7);
+            } else if (r.message) {
+                frappe.msgprint({
+                    title: __('Not Replayed'),
+                    message: r.message.error || __('No archived responses for this invoice'),
+                    indicator: 'orange'
+                });
+            }
+        }
+    });
+}
+
+function extract_invoice_data_routed(frm) {
+    if (!frm.doc.original_file) {
+        frappe.msgprint(__('Please upload an invoice file first'));
+        return;
+    }
+
+    frappe.call({
+        method: 'invoice_extraction_app.router.extract_invoice_data_only',
+        args: { file_url: frm.doc.original_file, invoice_name: frm.is_new() ? null : frm.doc.name },
+        freeze: true,
+        freeze_message: __('Extracting invoice data...'),
+        callback: function (r) {
+            if (r.message.success) {
+                populate_form_with_data(frm, r.message.data);
+                frm.set_value('extraction_model', `${r.message.provider}: ${r.message.model_used || ''}`);
+                frm.save();
+
+                frappe.show_alert({
+                    message: __('✅ Invoice data extracted successfully using {0}!', [r.message.provider]),
+                    indicator: 'green'
+                }, 5);
+            } else {
+                const tried = (r.message.attempts || []).map(a => a.backend).join(', ');
+                frappe.msgprint({
+                    title: __('Extraction Failed'),
+                    message: __('Extraction failed: ') + r.message.error + (tried ? '<br>' + __('Tried: ') + tried : ''),
+                    indicator: 'red'
+                });
+            }
+        }
+    });
+}
+
 function extract_invoice_data_gemini(frm) {
     if (!frm.doc.original_file) {
         frappe.msgprint(__('Please upload an invoice file first'));
@@ -634,6 +813,41 @@ function fix_tax_calculation(frm) {
     });
 }
 
+function reextract_failing_rows(frm) {
+    frappe.call({
+        method: 'invoice_extraction_app.corrections.reextract_failing',
+        args: { invoice_name: frm.doc.name },
+        freeze: true,
+        freeze_message: __('Re-reading the failing rows and totals...'),
+        callback: function (r) {
+            if (!r.message) return;
+            if (!r.message.success) {
+                frappe.msgprint({
+                    title: __('Not Corrected'),
+                    message: r.message.error,
+                    indicator: 'orange'
+                });
+                return;
+            }
+            if (r.message.message) {
+                frappe.show_alert({ message: __(r.message.message), indicator: 'green' });
+                return;
+            }
+
+            const remaining = r.message.remaining || {};
+            const clean = !(remaining.rows || []).length && !Object.keys(remaining.totals || {}).length;
+            frappe.show_alert({
+                message: __('Corrected rows: {0}, added rows: {1}', [
+                    (r.message.corrected_rows || []).join(', ') || '-',
+                    r.message.added_rows || 0
+                ]) + (clean ? '' : ' — ' + __('totals still differ, please review')),
+                indicator: clean ? 'green' : 'orange'
+            }, 7);
+            frm.reload_doc();
+        }
+    });
+}
+
 function fix_tax_calculation_global(invoice_name) {
     frappe.call({
         method: 'invoice_extraction_app.api.fix_tax_calculation',
@@ -2,13 +2,38 @@ import frappe
 from frappe.model.document import Document
 
 class ExtractedInvoice(Document):
+    @property
+    def extracted_data(self):
+        """Virtual: only set when an extraction or the form supplies it (see payloads.py)"""
+        return self.__dict__.get("extracted_data")
+
+    @extracted_data.setter
+    def extracted_data(self, value):
+        self.__dict__["extracted_data"] = value
+
     def validate(self):
+        self.check_items()
         self.validate_completion()
-        self.calculate_item_amounts()
+
+    def check_items(self):
+        """One pass over the items: amounts, row problems and mapping state"""
+        self._item_problems = []
+        all_items_mapped = True
+        for item in self.items:
+            item.amount = item.quantity * item.rate
+            if not item.item_link:
+                all_items_mapped = False
+            if not item.extracted_text:
+                self._item_problems.append(f"Item name in row {item.idx}")
+            if item.quantity <= 0:
+                self._item_problems.append(f"Quantity in row {item.idx}")
+            if item.rate <= 0:
+                self._item_problems.append(f"Rate in row {item.idx}")
+        self.flags.all_items_mapped = all_items_mapped
     
     def validate_completion(self):
         """Validate that all required data is complete"""
-        if self.status == "Converted":
+        if self.status in ("Converted", "Split"):
             return
             
         missing_fields = []
@@ -29,27 +54,45 @@ class ExtractedInvoice(Document):
         if not self.items:
             missing_fields.append("Items")
         else:
-            for item in self.items:
-                if not item.extracted_text:
-                    missing_fields.append(f"Item name in row {item.idx}")
-                if item.quantity <= 0:
-                    missing_fields.append(f"Quantity in row {item.idx}")
-                if item.rate <= 0:
-                    missing_fields.append(f"Rate in row {item.idx}")
+            missing_fields.extend(self._item_problems)
         
         if missing_fields and self.status == "Ready":
             frappe.throw(f"Please complete the following fields: {', '.join(set(missing_fields))}")
     
-    def calculate_item_amounts(self):
-        """Calculate amount for each item"""
-        for item in self.items:
-            item.amount = item.quantity * item.rate
-    
     def before_save(self):
         """Update status based on mapping"""
-        if self.status != "Converted":
+        if self.status not in ("Converted", "Split"):
             if self.supplier_link:
-                all_items_mapped = all(item.item_link for item in self.items)
+                all_items_mapped = self.flags.all_items_mapped
+                if all_items_mapped is None:
+                    all_items_mapped = all(item.item_link for item in self.items)
                 self.status = "Mapped" if all_items_mapped else "Ready"
             else:
                 self.status = "Ready"
+
+    def update_child_table(self, fieldname, df=None):
+        """Large item tables are written in bulk (see bulk_items.py)"""
+        from invoice_extraction_app.bulk_items import BULK_MIN_ROWS, write_items_bulk
+
+        if fieldname == "items" and len(self.items) >= BULK_MIN_ROWS:
+            write_items_bulk(self, fieldname)
+        else:
+            super().update_child_table(fieldname, df)
+
+    def on_update(self):
+        """Store the raw payload; confirmed invoices teach the supplier's layout template"""
+        from invoice_extraction_app.payloads import save_payload
+        from invoice_extraction_app.supplier_templates import LEARN_STATUSES, enqueue_learning
+
+        if self.extracted_data is not None:
+            save_payload(self.name, self.extracted_data)
+
+        if self.supplier_link and self.status in LEARN_STATUSES and self.has_value_changed("status"):
+            enqueue_learning(self.supplier_link)
+
+    def on_trash(self):
+        from invoice_extraction_app.payloads import delete_payload
+        from invoice_extraction_app.raw_archive import delete_archive
+
+        delete_payload(self.name)
+        delete_archive(self.name)
@@ -0,0 +1,32 @@
+// invoice_extraction_app/doctype/extracted_invoice/extracted_invoice_list.js
+
+frappe.listview_settings['Extracted Invoice'] = {
+    onload: function (listview) {
+        listview.page.add_actions_menu_item(__('Replay from Archive'), function () {
+            const names = listview.get_checked_items(true);
+            if (!names.length) {
+                frappe.msgprint(__('Select the invoices to replay'));
+                return;
+            }
+            frappe.call({
+                method: 'invoice_extraction_app.raw_archive.replay_invoices',
+                args: { invoice_names: names },
+                callback: function (r) {
+                    if (r.message && r.message.success) {
+                        frappe.show_alert({
+                            message: __('{0} invoices queued for replay in {1} jobs ({2} without an archive or already mapped)',
+                                [r.message.queued, r.message.jobs, r.message.skipped]),
+                            indicator: 'blue'
+                        }, 7);
+                    } else if (r.message) {
+                        frappe.msgprint({
+                            title: __('Not Replayed'),
+                            message: r.message.error,
+                            indicator: 'orange'
+                        });
+                    }
+                }
+            });
+        });
+    }
+};
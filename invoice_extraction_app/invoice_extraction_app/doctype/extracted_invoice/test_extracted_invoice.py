@@ -0,0 +1,39 @@
+# Copyright (c) 2026, waddah and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from invoice_extraction_app.corrections import find_failures, merge
+
+
+def row(text, quantity, rate, amount):
+	return {"extracted_text": text, "quantity": quantity, "rate": rate, "amount": amount, "tax_amount": 0}
+
+
+class TestExtractedInvoice(FrappeTestCase):
+	def setUp(self):
+		# The payload still has the blank line that is no longer among the invoice rows
+		self.data = {
+			"items": [
+				{"description": "", "quantity": 0, "unit_price": 0, "item_total": 0},
+				{"description": "Paper A4", "quantity": 2, "unit_price": 10, "item_total": 20},
+				{"description": "Toner", "quantity": 3, "unit_price": 50, "item_total": 120},
+			],
+			"validation": {"row_mismatches": [2], "stated": {}},
+		}
+		self.inv = frappe.get_doc(
+			{"doctype": "Extracted Invoice", "items": [row("Paper A4", 2, 10, 20), row("Toner", 3, 50, 120)]}
+		)
+
+	def test_failing_rows_come_from_the_invoice_rows(self):
+		self.assertEqual(list(find_failures(self.inv, self.data).rows), [1])
+
+	def test_correction_updates_the_matching_row_and_payload_item(self):
+		result = merge(self.inv, self.data, {"items": [{"row": 2, "quantity": 3, "unit_price": 40}]})
+
+		self.assertEqual(result["corrected_rows"], [2])
+		self.assertEqual(self.inv.items[1].rate, 40)
+		self.assertEqual(self.data["items"][2]["unit_price"], 40)
+		self.assertEqual(self.data["items"][2]["item_total"], 120)
+		self.assertEqual(self.data["items"][1]["unit_price"], 10)
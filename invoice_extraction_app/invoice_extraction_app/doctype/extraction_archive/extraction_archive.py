@@ -0,0 +1,8 @@
+# Copyright (c) 2026, waddah and Contributors
+# See license.txt
+
+from frappe.model.document import Document
+
+
+class ExtractionArchive(Document):
+    pass
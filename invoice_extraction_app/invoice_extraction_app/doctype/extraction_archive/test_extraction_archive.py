@@ -0,0 +1,50 @@
+# Copyright (c) 2026, waddah and Contributors
+# See license.txt
+
+import json
+
+from frappe.tests.utils import FrappeTestCase
+
+from invoice_extraction_app.raw_archive import ReplayError, rebuild
+
+ITEMS = [{"description": f"Item {i}", "quantity": 2, "unit_price": 5, "tax_amount": 1.5} for i in range(4)]
+HEADER = {"supplier": "Acme", "invoice_number": "INV-7", "subtotal": 40, "tax_amount": 6, "total_amount": 46}
+
+
+def cut_off(items):
+	"""An answer stopped at the token cap in the middle of the next item."""
+	return json.dumps({**HEADER, "items": items}, ensure_ascii=False)[:-2] + ', {"description": "Ite'
+
+
+class TestExtractionArchive(FrappeTestCase):
+	def test_replay_continues_a_cut_off_answer_from_the_archive(self):
+		archived = {
+			"provider": "Mistral",
+			"text": "Acme INV-7",
+			"budget": 8000,
+			"answers": [
+				[cut_off(ITEMS[:2]), True],
+				[json.dumps({"items": ITEMS[2:]}), False],
+			],
+		}
+
+		data = rebuild(archived)
+
+		self.assertEqual([i["description"] for i in data["items"]], [i["description"] for i in ITEMS])
+		self.assertEqual(data["subtotal"], 40)
+		self.assertEqual(data["items"][0]["total_with_tax"], 11.5)
+
+	def test_replay_never_asks_the_provider_for_a_missing_answer(self):
+		archived = {"provider": "Mistral", "text": "Acme INV-7", "budget": 8000, "answers": [[cut_off(ITEMS[:2]), True]]}
+
+		with self.assertRaises(ReplayError):
+			rebuild(archived)
+
+	def test_gemini_answer_is_parsed_with_the_gemini_parser(self):
+		answer = "```json\n" + json.dumps({**HEADER, "items": ITEMS}).replace('"', "'") + "\n```"
+		archived = {"provider": "Gemini", "text": None, "answers": [[answer, False]]}
+
+		data = rebuild(archived)
+
+		self.assertEqual(data["invoice_number"], "INV-7")
+		self.assertTrue(data["validation"]["total_match"])
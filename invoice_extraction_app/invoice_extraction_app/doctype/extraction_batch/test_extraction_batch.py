@@ -0,0 +1,40 @@
+# Copyright (c) 2026, waddah and Contributors
+# See license.txt
+
+import json
+
+from frappe.tests.utils import FrappeTestCase
+
+from invoice_extraction_app.batch_lane import build_request, parse_output, to_jsonl
+
+
+class TestExtractionBatch(FrappeTestCase):
+	def test_input_lines_are_keyed_by_invoice(self):
+		lines = [build_request(f"EXT-INV-{i}", [{"role": "user", "content": "نص"}], 8000, 0.1) for i in range(3)]
+
+		rows = [json.loads(line) for line in to_jsonl(lines).decode("utf-8").splitlines()]
+
+		self.assertEqual([r["custom_id"] for r in rows], ["EXT-INV-0", "EXT-INV-1", "EXT-INV-2"])
+		self.assertEqual(rows[0]["body"]["max_tokens"], 8000)
+		self.assertEqual(rows[0]["body"]["response_format"], {"type": "json_object"})
+
+	def test_output_separates_answers_failures_and_cut_offs(self):
+		def line(custom_id, status, content="", finish="stop"):
+			body = {"choices": [{"message": {"content": content}, "finish_reason": finish}], "usage": {"prompt_tokens": 10}}
+			if status >= 400:
+				body = {"message": "overloaded"}
+			return json.dumps({"custom_id": custom_id, "response": {"status_code": status, "body": body}, "error": None})
+
+		raw = "\n".join([
+			line("EXT-INV-1", 200, '{"invoice_number": "1"}'),
+			line("EXT-INV-2", 503),
+			line("EXT-INV-3", 200, '{"items": [', finish="length"),
+		]).encode("utf-8")
+
+		results = parse_output(raw)
+
+		self.assertEqual(results["EXT-INV-1"]["content"], '{"invoice_number": "1"}')
+		self.assertEqual(results["EXT-INV-1"]["usage"], {"prompt_tokens": 10})
+		self.assertIsNone(results["EXT-INV-1"]["error"])
+		self.assertEqual(results["EXT-INV-2"]["error"], "overloaded")
+		self.assertTrue(results["EXT-INV-3"]["truncated"])
@@ -0,0 +1,24 @@
+# Copyright (c) 2026, waddah and Contributors
+# See license.txt
+
+import json
+
+from frappe.tests.utils import FrappeTestCase
+
+from invoice_extraction_app.payloads import pack, unpack
+
+
+class TestExtractionPayload(FrappeTestCase):
+	def test_round_trip_is_compact_and_lossless(self):
+		data = {"supplier_ar": "شركة أكمي", "items": [{"description": f"Item {i}", "quantity": i} for i in range(50)]}
+		pretty = json.dumps(data, ensure_ascii=False, indent=2)
+
+		encoding, payload, original_size, _ = pack(pretty)
+
+		self.assertLess(len(payload), len(pretty.encode("utf-8")) / 2)
+		self.assertLess(original_size, len(pretty.encode("utf-8")))
+		self.assertEqual(json.loads(unpack(encoding, payload)), data)
+
+	def test_same_content_same_hash(self):
+		data = {"invoice_number": "INV-1", "total_amount": 115.0}
+		self.assertEqual(pack(data)[3], pack(json.dumps(data, indent=2))[3])
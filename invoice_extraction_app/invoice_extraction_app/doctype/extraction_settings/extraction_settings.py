@@ -0,0 +1,36 @@
+# Copyright (c) 2026, waddah and Contributors
+# See license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class ExtractionSettings(Document):
+    def validate(self):
+        if (self.max_cost_per_extraction or 0) < 0:
+            frappe.throw("Max Cost per Extraction cannot be negative")
+
+        if (self.daily_budget or 0) < 0:
+            frappe.throw("Daily Budget cannot be negative")
+
+        if (self.telegram_concurrency or 0) < 0 or (self.bulk_concurrency or 0) < 0:
+            frappe.throw("Concurrency cannot be negative")
+
+        if (self.auto_extract_debounce or 0) < 0 or (self.auto_extract_batch_size or 0) < 0:
+            frappe.throw("Auto extraction debounce and batch size cannot be negative")
+
+        if (self.max_output_tokens or 0) < 0:
+            frappe.throw("Max Output Tokens cannot be negative")
+
+        if self.min_text_quality is not None and not (0 <= self.min_text_quality <= 100):
+            frappe.throw("Min Text Quality must be between 0 and 100")
+
+        if self.max_error_rate is not None and not (0 <= self.max_error_rate <= 100):
+            frappe.throw("Max Error Rate must be between 0 and 100")
+
+        seen = set()
+        for row in self.backends:
+            key = (row.provider, (row.model or "").strip())
+            if key in seen:
+                frappe.throw(f"Duplicate backend in row {row.idx}: {row.provider} {row.model or ''}")
+            seen.add(key)
@@ -0,0 +1,67 @@
+# Copyright (c) 2026, waddah and Contributors
+# See license.txt
+
+from collections import defaultdict
+from unittest.mock import MagicMock, patch
+
+from frappe.tests.utils import FrappeTestCase
+
+from invoice_extraction_app import scheduling
+
+
+class RedisCache:
+	"""The hash and list calls the scheduler makes; like Redis, `hgetall` returns bytes keys."""
+
+	def __init__(self):
+		self.hashes = defaultdict(dict)
+		self.lists = defaultdict(list)
+
+	def make_key(self, key):
+		return key
+
+	def lock(self, *args, **kwargs):
+		return MagicMock()
+
+	def hset(self, name, key, value):
+		self.hashes[name][key.decode() if isinstance(key, bytes) else key] = value
+
+	def hget(self, name, key):
+		return self.hashes[name].get(key)
+
+	def hgetall(self, name):
+		return {k.encode(): v for k, v in self.hashes[name].items()}
+
+	def hdel(self, name, key):
+		self.hashes[name].pop(key.decode() if isinstance(key, bytes) else key, None)
+
+	def rpush(self, name, value):
+		self.lists[name].append(value.encode())
+
+	def lpop(self, name):
+		return self.lists[name].pop(0) if self.lists[name] else None
+
+	def llen(self, name):
+		return len(self.lists[name])
+
+
+class TestExtractionSettings(FrappeTestCase):
+	def setUp(self):
+		self.cache = RedisCache()
+		for target, value in (
+			("frappe.cache", lambda: self.cache),
+			("frappe.enqueue", MagicMock()),
+			("invoice_extraction_app.scheduling.get_settings", lambda doctype: None),
+		):
+			patcher = patch(target, value)
+			patcher.start()
+			self.addCleanup(patcher.stop)
+
+	def test_submitted_jobs_are_dispatched_per_tenant(self):
+		with patch.object(scheduling, "_enqueue") as enqueue:
+			for i in range(3):
+				scheduling.submit(f"EXT-INV-{i}", "bulk", "chat-1", after_commit=False)
+
+		# Two bulk slots by default: two dispatched, the third still pending for its tenant
+		self.assertEqual([c.args[1]["invoice"] for c in enqueue.call_args_list], ["EXT-INV-0", "EXT-INV-1"])
+		self.assertEqual(scheduling.pending_count("bulk"), 1)
+		self.assertEqual(scheduling._pending("bulk"), {"chat-1": 1})
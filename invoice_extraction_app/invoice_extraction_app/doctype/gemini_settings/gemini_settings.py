@@ -1,6 +1,5 @@
 import frappe
 from frappe.model.document import Document
-import google.generativeai as genai
 import os
 
 class GeminiSettings(Document):
@@ -10,6 +9,9 @@ class GeminiSettings(Document):
             
     def test_api_key(self):
         try:
+            # Loaded here, not at import: the SDK is only needed to check a key
+            import google.generativeai as genai
+
             original_key = os.environ.get('GOOGLE_API_KEY')
             os.environ['GOOGLE_API_KEY'] = self.gemini_api_key
             
@@ -0,0 +1,32 @@
+// invoice_extraction_app/supplier_invoice_template/supplier_invoice_template.js
+frappe.ui.form.on('Supplier Invoice Template', {
+    refresh: function (frm) {
+        if (frm.is_new()) {
+            return;
+        }
+
+        // Rebuild the layout from the supplier's latest confirmed invoices
+        frm.add_custom_button(__('Relearn'), function () {
+            frappe.call({
+                method: 'invoice_extraction_app.supplier_templates.relearn_supplier_template',
+                args: {
+                    supplier: frm.doc.supplier
+                },
+                freeze: true,
+                freeze_message: __('Learning layout...'),
+                callback: function (r) {
+                    if (r.message && r.message.success) {
+                        frm.reload_doc();
+                        frappe.show_alert({ message: __('Template updated'), indicator: 'green' });
+                    } else if (r.message) {
+                        frappe.msgprint({
+                            title: __('Not Learned'),
+                            message: r.message.error,
+                            indicator: 'orange'
+                        });
+                    }
+                }
+            });
+        });
+    }
+});
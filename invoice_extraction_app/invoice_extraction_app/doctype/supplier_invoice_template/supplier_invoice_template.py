@@ -0,0 +1,25 @@
+# Copyright (c) 2026, waddah and Contributors
+# See license.txt
+
+import json
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+
+from invoice_extraction_app.supplier_templates import clear_template_cache
+
+
+class SupplierInvoiceTemplate(Document):
+    def validate(self):
+        for field in ("anchors", "table_layout"):
+            try:
+                json.loads(self.get(field) or "{}")
+            except ValueError:
+                frappe.throw(_("{0} must be valid JSON").format(self.meta.get_label(field)))
+
+    def on_update(self):
+        clear_template_cache()
+
+    def on_trash(self):
+        clear_template_cache()
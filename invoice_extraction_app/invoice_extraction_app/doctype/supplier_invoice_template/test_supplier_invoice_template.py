@@ -0,0 +1,68 @@
+# Copyright (c) 2026, waddah and Contributors
+# See license.txt
+
+from datetime import date
+
+from frappe.tests.utils import FrappeTestCase
+
+from invoice_extraction_app.supplier_templates import _lines, apply_template, build_template
+
+
+def make_sample(number, invoice_date, items):
+	subtotal = sum(qty * rate for _, qty, rate in items)
+	tax = round(subtotal * 0.15, 2)
+	rows = "\n".join(f"{desc:<24}  {qty}    {rate:,.2f}    {qty * rate:,.2f}" for desc, qty, rate in items)
+	text = f"""ACME TRADING CO. LTD
+VAT No: 300123456700003
+TAX INVOICE
+Invoice No: {number}        Date: {invoice_date:%d/%m/%Y}
+Description               Qty    Price    Amount
+{rows}
+Subtotal:   {subtotal:,.2f}
+VAT 15%:   {tax:,.2f}
+Total:   SAR {subtotal + tax:,.2f}
+Thank you for your business"""
+	return {
+		"name": number,
+		"text": text,
+		"lines": _lines(text),
+		"header": {
+			"invoice_number": number,
+			"invoice_date": invoice_date,
+			"due_date": None,
+			"subtotal": subtotal,
+			"tax_amount": tax,
+			"total_amount": subtotal + tax,
+		},
+		"items": [
+			{"quantity": qty, "unit_price": rate, "item_total": qty * rate, "tax_amount": 0}
+			for _, qty, rate in items
+		],
+	}
+
+
+class TestSupplierInvoiceTemplate(FrappeTestCase):
+	def setUp(self):
+		samples = [
+			make_sample("INV-1001", date(2026, 1, 5), [("Widget A", 2, 10.0), ("Gadget Big", 3, 1250.5)]),
+			make_sample("INV-1002", date(2026, 2, 7), [("Widget A", 5, 10.0), ("Cable 2m", 1, 15.0)]),
+		]
+		self.template = build_template(samples)
+		self.template.update(name="_Test Supplier", supplier_name="Acme", currency="SAR", min_confidence=100)
+
+	def test_reads_new_invoice_with_learned_layout(self):
+		new = make_sample("INV-1010", date(2026, 3, 9), [("Thing", 7, 3.0)])
+		data = apply_template(self.template, new["text"])
+
+		self.assertTrue(data)
+		self.assertEqual(data["invoice_number"], "INV-1010")
+		self.assertEqual(data["date"], "2026-03-09")
+		self.assertAlmostEqual(data["total_amount"], 24.15)
+		self.assertEqual(len(data["items"]), 1)
+		self.assertEqual(data["items"][0]["description"], "Thing")
+
+	def test_falls_back_when_totals_do_not_add_up(self):
+		new = make_sample("INV-1011", date(2026, 3, 9), [("Thing", 7, 3.0)])
+		broken = new["text"].replace("Total:   SAR 24.15", "Total:   SAR 99.00")
+
+		self.assertIsNone(apply_template(self.template, broken))
@@ -0,0 +1,72 @@
+// Copyright (c) 2026, waddah and Contributors
+// For license information, please see license.txt
+
+frappe.query_reports["Extracted Invoice Tax Audit"] = {
+    filters: [
+        {
+            fieldname: "status",
+            label: __("Status"),
+            fieldtype: "Select",
+            options: "\nDraft\nProcessing\nReady\nMapped\nConverted\nCancelled"
+        },
+        {
+            fieldname: "supplier",
+            label: __("Supplier"),
+            fieldtype: "Link",
+            options: "Supplier"
+        },
+        {
+            fieldname: "from_date",
+            label: __("From Date"),
+            fieldtype: "Date"
+        },
+        {
+            fieldname: "to_date",
+            label: __("To Date"),
+            fieldtype: "Date"
+        },
+        {
+            fieldname: "only_mismatched",
+            label: __("Only Mismatched"),
+            fieldtype: "Check",
+            default: 1
+        }
+    ],
+
+    onload: function (report) {
+        report.page.add_inner_button(__('🔧 Fix Mismatched Headers'), function () {
+            frappe.confirm(
+                __('Recompute subtotal, tax and total from the items for every mismatched invoice matching the current filters?'),
+                function () {
+                    frappe.call({
+                        method: 'invoice_extraction_app.tax_audit.bulk_fix_tax_calculations',
+                        args: { filters: report.get_values() },
+                        callback: function (r) {
+                            if (r.message && r.message.success) {
+                                frappe.show_alert({
+                                    message: __('Bulk tax fix queued. Refresh the report once it finishes.'),
+                                    indicator: 'green'
+                                }, 5);
+                            } else {
+                                frappe.msgprint({
+                                    title: __('Bulk Fix Failed'),
+                                    message: (r.message && r.message.error) || __('Unknown error'),
+                                    indicator: 'red'
+                                });
+                            }
+                        }
+                    });
+                }
+            );
+        });
+    },
+
+    formatter: function (value, row, column, data, default_formatter) {
+        value = default_formatter(value, row, column, data);
+        if (data && ["subtotal_diff", "tax_diff", "total_diff"].includes(column.fieldname)
+            && Math.abs(data[column.fieldname] || 0) >= 0.01) {
+            value = `<span style="color: var(--red-500)">${value}</span>`;
+        }
+        return value;
+    }
+};
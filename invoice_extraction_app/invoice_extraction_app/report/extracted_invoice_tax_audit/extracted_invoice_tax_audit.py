@@ -0,0 +1,54 @@
+# Copyright (c) 2026, waddah and Contributors
+# See license.txt
+
+import frappe
+from frappe import _
+from frappe.utils import cint
+
+from invoice_extraction_app.tax_audit import get_tax_audit_rows, get_tax_audit_summary
+
+
+def execute(filters=None):
+    filters = frappe._dict(filters or {})
+    only_mismatched = bool(cint(filters.get("only_mismatched")))
+
+    rows = get_tax_audit_rows(filters, only_mismatched=only_mismatched, limit=None)
+    summary = get_tax_audit_summary(filters)
+
+    return get_columns(), rows, None, None, get_report_summary(summary)
+
+
+def get_columns():
+    return [
+        {"fieldname": "name", "label": _("Extracted Invoice"), "fieldtype": "Link", "options": "Extracted Invoice", "width": 160},
+        {"fieldname": "status", "label": _("Status"), "fieldtype": "Data", "width": 90},
+        {"fieldname": "supplier_link", "label": _("Supplier"), "fieldtype": "Link", "options": "Supplier", "width": 160},
+        {"fieldname": "invoice_number", "label": _("Invoice Number"), "fieldtype": "Data", "width": 120},
+        {"fieldname": "invoice_date", "label": _("Invoice Date"), "fieldtype": "Date", "width": 100},
+        {"fieldname": "item_count", "label": _("Items"), "fieldtype": "Int", "width": 70},
+        {"fieldname": "items_subtotal", "label": _("Items Subtotal"), "fieldtype": "Currency", "width": 120},
+        {"fieldname": "extracted_subtotal", "label": _("Header Subtotal"), "fieldtype": "Currency", "width": 120},
+        {"fieldname": "subtotal_diff", "label": _("Subtotal Diff"), "fieldtype": "Currency", "width": 110},
+        {"fieldname": "items_tax", "label": _("Items Tax"), "fieldtype": "Currency", "width": 110},
+        {"fieldname": "extracted_tax", "label": _("Header Tax"), "fieldtype": "Currency", "width": 110},
+        {"fieldname": "tax_diff", "label": _("Tax Diff"), "fieldtype": "Currency", "width": 100},
+        {"fieldname": "items_total", "label": _("Items Total"), "fieldtype": "Currency", "width": 120},
+        {"fieldname": "extracted_total", "label": _("Header Total"), "fieldtype": "Currency", "width": 120},
+        {"fieldname": "total_diff", "label": _("Total Diff"), "fieldtype": "Currency", "width": 100},
+        {"fieldname": "tax_rate_percentage", "label": _("Tax Rate %"), "fieldtype": "Percent", "width": 90},
+    ]
+
+
+def get_report_summary(summary):
+    return [
+        {"value": summary.get("invoices", 0), "label": _("Invoices Audited"), "datatype": "Int", "indicator": "Blue"},
+        {
+            "value": summary.get("mismatched_invoices", 0),
+            "label": _("Mismatched Invoices"),
+            "datatype": "Int",
+            "indicator": "Red" if summary.get("mismatched_invoices") else "Green",
+        },
+        {"value": summary.get("subtotal_mismatches", 0), "label": _("Subtotal Mismatches"), "datatype": "Int"},
+        {"value": summary.get("tax_mismatches", 0), "label": _("Tax Mismatches"), "datatype": "Int"},
+        {"value": summary.get("total_mismatches", 0), "label": _("Total Mismatches"), "datatype": "Int"},
+    ]
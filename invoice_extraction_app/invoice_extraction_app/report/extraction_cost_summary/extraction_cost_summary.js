@@ -0,0 +1,40 @@
+// Copyright (c) 2026, waddah and Contributors
+// For license information, please see license.txt
+
+frappe.query_reports["Extraction Cost Summary"] = {
+    filters: [
+        {
+            fieldname: "group_by",
+            label: __("Group By"),
+            fieldtype: "Select",
+            options: "Day\nUser\nTelegram Chat\nSupplier\nProvider / Model",
+            default: "Day",
+            reqd: 1
+        },
+        {
+            fieldname: "from_date",
+            label: __("From Date"),
+            fieldtype: "Date",
+            default: frappe.datetime.add_days(frappe.datetime.get_today(), -30),
+            reqd: 1
+        },
+        {
+            fieldname: "to_date",
+            label: __("To Date"),
+            fieldtype: "Date",
+            default: frappe.datetime.get_today()
+        },
+        {
+            fieldname: "provider",
+            label: __("Provider"),
+            fieldtype: "Select",
+            options: "\nGemini\nMistral"
+        },
+        {
+            fieldname: "outcome",
+            label: __("Outcome"),
+            fieldtype: "Select",
+            options: "\nSuccess\nFailed"
+        }
+    ]
+};
@@ -0,0 +1,97 @@
+# Copyright (c) 2026, waddah and Contributors
+# See license.txt
+
+import frappe
+from frappe import _
+from frappe.utils import add_to_date, flt, get_datetime, getdate, nowdate
+
+from invoice_extraction_app.costing import spent_on
+
+GROUP_BY = {
+    "Day": ("DATE(started_at)", "Date"),
+    "User": ("user", "Link/User"),
+    "Telegram Chat": ("telegram_chat_id", "Data"),
+    "Supplier": ("supplier", "Link/Supplier"),
+    "Provider / Model": ("CONCAT(provider, ': ', COALESCE(model, ''))", "Data"),
+}
+
+
+def execute(filters=None):
+    filters = frappe._dict(filters or {})
+    group_by = filters.get("group_by") or "Day"
+    rows = get_rows(filters, group_by)
+    return get_columns(group_by), rows, None, None, get_report_summary(rows)
+
+
+def get_rows(filters, group_by):
+    expr = GROUP_BY[group_by][0]
+    conditions = ["started_at >= %(from_date)s"]
+    values = {"from_date": get_datetime(filters.get("from_date") or add_to_date(nowdate(), days=-30))}
+
+    if filters.get("to_date"):
+        conditions.append("started_at < %(to_date)s")
+        values["to_date"] = get_datetime(add_to_date(getdate(filters.to_date), days=1))
+    for key in ("provider", "outcome"):
+        if filters.get(key):
+            conditions.append(f"{key} = %({key})s")
+            values[key] = filters.get(key)
+
+    rows = frappe.db.sql(
+        f"""
+        SELECT
+            {expr} AS group_value,
+            COUNT(*) AS extractions,
+            SUM(outcome = 'Failed') AS failed,
+            COALESCE(SUM(page_count), 0) AS pages,
+            COALESCE(SUM(tokens_in), 0) AS tokens_in,
+            COALESCE(SUM(tokens_out), 0) AS tokens_out,
+            COALESCE(SUM(estimated_cost), 0) AS cost,
+            AVG(total_ms) AS avg_ms
+        FROM `tabExtraction Log`
+        WHERE {" AND ".join(conditions)}
+        GROUP BY group_value
+        ORDER BY {"group_value" if group_by == "Day" else "cost DESC"}
+        """,
+        values,
+        as_dict=True,
+    )
+
+    for row in rows:
+        ok = row.extractions - (row.failed or 0)
+        row.cost_per_extraction = row.cost / row.extractions if row.extractions else 0
+        row.cost_per_page = row.cost / row.pages if row.pages else 0
+        # Successful extractions per USD: the number to push up
+        row.per_dollar = ok / row.cost if row.cost else 0
+    return rows
+
+
+def get_columns(group_by):
+    fieldtype, _sep, options = GROUP_BY[group_by][1].partition("/")
+    return [
+        {"fieldname": "group_value", "label": _(group_by), "fieldtype": fieldtype, "options": options, "width": 180},
+        {"fieldname": "extractions", "label": _("Extractions"), "fieldtype": "Int", "width": 100},
+        {"fieldname": "failed", "label": _("Failed"), "fieldtype": "Int", "width": 80},
+        {"fieldname": "pages", "label": _("OCR Pages"), "fieldtype": "Int", "width": 90},
+        {"fieldname": "tokens_in", "label": _("Tokens In"), "fieldtype": "Int", "width": 110},
+        {"fieldname": "tokens_out", "label": _("Tokens Out"), "fieldtype": "Int", "width": 110},
+        {"fieldname": "cost", "label": _("Est. Cost (USD)"), "fieldtype": "Float", "precision": 4, "width": 120},
+        {"fieldname": "cost_per_extraction", "label": _("Cost / Extraction"), "fieldtype": "Float", "precision": 6, "width": 120},
+        {"fieldname": "cost_per_page", "label": _("Cost / Page"), "fieldtype": "Float", "precision": 6, "width": 110},
+        {"fieldname": "per_dollar", "label": _("Extractions / USD"), "fieldtype": "Float", "precision": 1, "width": 120},
+        {"fieldname": "avg_ms", "label": _("Avg Total (ms)"), "fieldtype": "Float", "precision": 0, "width": 110},
+    ]
+
+
+def get_report_summary(rows):
+    budget = flt(frappe.db.get_single_value("Extraction Settings", "daily_budget"))
+    today = spent_on()
+    return [
+        {"value": sum(r.cost for r in rows), "label": _("Est. Cost (USD)"), "datatype": "Float", "indicator": "Blue"},
+        {"value": sum(r.extractions for r in rows), "label": _("Extractions"), "datatype": "Int"},
+        {
+            "value": today,
+            "label": _("Spent Today (USD)") + (f" / {budget:g}" if budget else ""),
+            "datatype": "Float",
+            "indicator": "Red" if budget and today >= budget else "Green",
+        },
+    ]
@@ -0,0 +1,45 @@
+// Copyright (c) 2026, waddah and Contributors
+// For license information, please see license.txt
+
+frappe.query_reports["Extraction Stage Timings"] = {
+    filters: [
+        {
+            fieldname: "from_date",
+            label: __("From Date"),
+            fieldtype: "Date",
+            default: frappe.datetime.add_days(frappe.datetime.get_today(), -7),
+            reqd: 1
+        },
+        {
+            fieldname: "to_date",
+            label: __("To Date"),
+            fieldtype: "Date",
+            default: frappe.datetime.get_today()
+        },
+        {
+            fieldname: "provider",
+            label: __("Provider"),
+            fieldtype: "Select",
+            options: "\nGemini\nMistral"
+        },
+        {
+            fieldname: "model",
+            label: __("Model"),
+            fieldtype: "Data"
+        },
+        {
+            fieldname: "outcome",
+            label: __("Outcome"),
+            fieldtype: "Select",
+            options: "\nSuccess\nFailed"
+        }
+    ],
+
+    formatter: function (value, row, column, data, default_formatter) {
+        value = default_formatter(value, row, column, data);
+        if (data && data.stage === "total") {
+            value = `<b>${value}</b>`;
+        }
+        return value;
+    }
+};
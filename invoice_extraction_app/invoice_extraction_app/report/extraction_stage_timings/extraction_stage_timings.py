@@ -0,0 +1,89 @@
+# Copyright (c) 2026, waddah and Contributors
+# See license.txt
+
+from collections import defaultdict
+
+import frappe
+from frappe import _
+from frappe.utils import add_to_date, get_datetime, getdate, nowdate
+
+from invoice_extraction_app.instrumentation import STAGES, percentile
+
+
+def execute(filters=None):
+    filters = frappe._dict(filters or {})
+    logs = get_logs(filters)
+    return get_columns(), get_rows(logs), None, None, get_report_summary(logs)
+
+
+def get_logs(filters):
+    conditions = [["started_at", ">=", get_datetime(filters.get("from_date") or add_to_date(nowdate(), days=-7))]]
+    if filters.get("to_date"):
+        conditions.append(["started_at", "<", get_datetime(add_to_date(getdate(filters.to_date), days=1))])
+    for key in ("provider", "model", "outcome"):
+        if filters.get(key):
+            conditions.append([key, "=", filters.get(key)])
+
+    fields = ["provider", "model", "outcome", "total_ms", "retry_count"] + [f"{s}_ms" for s in STAGES]
+    return frappe.get_all("Extraction Log", filters=conditions, fields=fields, limit_page_length=0)
+
+
+def get_rows(logs):
+    groups = defaultdict(lambda: defaultdict(list))
+    for log in logs:
+        key = (log.provider or "", log.model or "")
+        for stage in STAGES + ("total",):
+            value = log.get(f"{stage}_ms")
+            # Stages a pipeline never ran (e.g. upload for images) stay out of the distribution
+            if value:
+                groups[key][stage].append(value)
+
+    rows = []
+    for (provider, model), stages in sorted(groups.items()):
+        grand_total = sum(stages.get("total") or [])
+        for stage in STAGES + ("total",):
+            values = stages.get(stage)
+            if not values:
+                continue
+            rows.append({
+                "provider": provider,
+                "model": model,
+                "stage": stage,
+                "count": len(values),
+                "mean": sum(values) / len(values),
+                "p50": percentile(values, 50),
+                "p90": percentile(values, 90),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "max": max(values),
+                "share": sum(values) / grand_total * 100 if grand_total else 0.0,
+            })
+    return rows
+
+
+def get_columns():
+    return [
+        {"fieldname": "provider", "label": _("Provider"), "fieldtype": "Data", "width": 100},
+        {"fieldname": "model", "label": _("Model"), "fieldtype": "Data", "width": 220},
+        {"fieldname": "stage", "label": _("Stage"), "fieldtype": "Data", "width": 110},
+        {"fieldname": "count", "label": _("Samples"), "fieldtype": "Int", "width": 80},
+        {"fieldname": "mean", "label": _("Mean (ms)"), "fieldtype": "Float", "precision": 1, "width": 100},
+        {"fieldname": "p50", "label": _("p50 (ms)"), "fieldtype": "Float", "precision": 1, "width": 100},
+        {"fieldname": "p90", "label": _("p90 (ms)"), "fieldtype": "Float", "precision": 1, "width": 100},
+        {"fieldname": "p95", "label": _("p95 (ms)"), "fieldtype": "Float", "precision": 1, "width": 100},
+        {"fieldname": "p99", "label": _("p99 (ms)"), "fieldtype": "Float", "precision": 1, "width": 100},
+        {"fieldname": "max", "label": _("Max (ms)"), "fieldtype": "Float", "precision": 1, "width": 100},
+        {"fieldname": "share", "label": _("Share of Total"), "fieldtype": "Percent", "width": 110},
+    ]
+
+
+def get_report_summary(logs):
+    failed = sum(1 for log in logs if log.outcome == "Failed")
+    totals = [log.total_ms for log in logs if log.total_ms]
+    return [
+        {"value": len(logs), "label": _("Extractions"), "datatype": "Int", "indicator": "Blue"},
+        {"value": failed, "label": _("Failed"), "datatype": "Int", "indicator": "Red" if failed else "Green"},
+        {"value": percentile(totals, 50), "label": _("p50 Total (ms)"), "datatype": "Float"},
+        {"value": percentile(totals, 95), "label": _("p95 Total (ms)"), "datatype": "Float"},
+        {"value": sum(log.retry_count or 0 for log in logs), "label": _("Retries"), "datatype": "Int"},
+    ]
@@ -3,16 +3,29 @@ import frappe
 import json
 import os
 import base64
+import hashlib
+import time
 import traceback
-from frappe.utils import now, get_site_path
-
-# ✅ Mistral SDK
-try:
-    from mistralai import Mistral
-    MISTRAL_AVAILABLE = True
-except Exception as e:
-    MISTRAL_AVAILABLE = False
-    frappe.log_error(f"Mistral import error: {str(e)}", "Mistral Import Error")
+from frappe.utils import cint, now, get_site_path
+from invoice_extraction_app import sdk
+from invoice_extraction_app.bulk_items import set_extracted_items
+from invoice_extraction_app.chunking import (
+    extract_complete,
+    extract_in_chunks,
+    is_truncated,
+    output_budget,
+    split_for_budget,
+)
+from invoice_extraction_app.utils import is_retryable_error
+from invoice_extraction_app.instrumentation import count, note, record_stage, stage, traced
+from invoice_extraction_app.pdf_text import usable_text_layer
+from invoice_extraction_app.raw_archive import archive, record, record_answer, record_pages, recorded
+from invoice_extraction_app.settings_cache import get_settings
+from invoice_extraction_app.supplier_templates import (
+    extract_with_template,
+    remember_document_text,
+    remembered_document_text,
+)
 
 
 # ---------------- Helpers ----------------
@@ -24,9 +37,23 @@ def _log(title: str, msg: str):
 
 
 def _get_settings():
-    if not frappe.db.exists("Mistral Settings", "Mistral Settings"):
-        return None
-    return frappe.get_single("Mistral Settings")
+    return get_settings("Mistral Settings")
+
+
+def mistral_available() -> bool:
+    """mistralai is imported on first use (sdk.py); this triggers the import."""
+    return sdk.available("mistralai")
+
+
+def _get_client(api_key: str, timeout: float = None):
+    """Mistral client; `mistral_server_url` in site_config points it at another endpoint (proxy, benchmarks)."""
+    kwargs = {"api_key": api_key}
+    server_url = frappe.conf.get("mistral_server_url")
+    if server_url:
+        kwargs["server_url"] = server_url
+    if timeout:
+        kwargs["timeout_ms"] = int(float(timeout) * 1000)
+    return sdk.mistral_client(**kwargs)
 
 
 def _read_file(file_url: str):
@@ -68,6 +95,14 @@ def _json_extract(text: str):
         return None
 
 
+def _parse_json(text: str):
+    t0 = time.perf_counter()
+    try:
+        return _json_extract(text)
+    finally:
+        record_stage("parse", t0)
+
+
 def _to_float(v):
     try:
         s = str(v).strip().replace(",", "")
@@ -84,13 +119,19 @@ def _post_process(data: dict) -> dict:
         items = data.get("items", []) or []
         subtotal = 0.0
         tax_total = 0.0
+        # What the document itself says, before it is replaced by the item sums
+        stated = {k: round(_to_float(data.get(k, 0)), 2) for k in ("subtotal", "tax_amount", "total_amount")}
+        row_mismatches = []
 
-        for it in items:
+        for i, it in enumerate(items):
             qty = _to_float(it.get("quantity", 0))
             price = _to_float(it.get("unit_price", 0))
             tax = _to_float(it.get("tax_amount", 0))
 
             item_total = qty * price
+            stated_total = _to_float(it.get("item_total", 0))
+            if stated_total and abs(stated_total - item_total) > 0.01:
+                row_mismatches.append(i)
             it["quantity"] = qty
             it["unit_price"] = price
             it["tax_amount"] = round(tax, 2)
@@ -120,6 +161,8 @@ def _post_process(data: dict) -> dict:
             "subtotal_calculated": subtotal,
             "tax_calculated": tax_total,
             "total_calculated": total,
+            "stated": stated,
+            "row_mismatches": row_mismatches,
         }
         return data
     except Exception:
@@ -132,7 +175,7 @@ def get_mistral_settings():
     try:
         s = _get_settings()
         if not s:
-            return {"success": False, "error": "Mistral Settings not found", "mistral_available": MISTRAL_AVAILABLE}
+            return {"success": False, "error": "Mistral Settings not found", "mistral_available": mistral_available()}
 
         api_key = s.get_password("mistral_api_key") if getattr(s, "mistral_api_key", None) else None
         return {
@@ -142,21 +185,22 @@ def get_mistral_settings():
             "ocr_model": getattr(s, "ocr_model", None) or "mistral-ocr-2512",
             "has_api_key": bool(api_key),
             "debug_enabled": int(getattr(s, "enable_debug_log", 0) or 0),
-            "mistral_available": MISTRAL_AVAILABLE,
+            "mistral_available": mistral_available(),
         }
     except Exception as e:
-        return {"success": False, "error": str(e), "mistral_available": MISTRAL_AVAILABLE}
+        return {"success": False, "error": str(e), "mistral_available": mistral_available()}
 
 
 @frappe.whitelist()
-def extract_invoice_data_only(file_url: str, model_name: str = None, temperature: float = None):
+@traced("Mistral")
+def extract_invoice_data_only(file_url: str, model_name: str = None, temperature: float = None, timeout: float = None):
     """
     ✅ مطابق للدوكس:
     PDF: upload -> signed_url -> ocr.process(document_url)
     ثم Chat لاستخراج JSON من نص OCR.
     """
     try:
-        if not MISTRAL_AVAILABLE:
+        if not mistral_available():
             return {"success": False, "error": "mistralai not installed"}
 
         s = _get_settings()
@@ -172,9 +216,11 @@ def extract_invoice_data_only(file_url: str, model_name: str = None, temperature
         ocr_model = getattr(s, "ocr_model", None) or "mistral-ocr-2512"
         debug = int(getattr(s, "enable_debug_log", 0) or 0)
 
-        file_bytes, ext, fname = _read_file(file_url)
+        with stage("file_read"):
+            file_bytes, ext, fname = _read_file(file_url)
+        note(payload_bytes=len(file_bytes), model=f"{ocr_model}+{chat_model}")
 
-        client = Mistral(api_key=api_key)
+        client = _get_client(api_key, timeout=timeout)
 
         # ---------------- PDF path (exact docs) ----------------
         if ext == ".pdf":
@@ -188,7 +234,7 @@ def extract_invoice_data_only(file_url: str, model_name: str = None, temperature
                 settings=s,
                 debug=debug,
             )
-            return {"success": True, "data": data, "model_used": f"{ocr_model}+{chat_model}", "temperature": temp, "extraction_time": now()}
+            return {"success": True, "data": data, "model_used": _model_used(data, ocr_model, chat_model), "temperature": temp, "extraction_time": now()}
 
         # ---------------- Image path (basic_ocr supports image_url too) ----------------
         if ext in [".jpg", ".jpeg", ".png"]:
@@ -202,13 +248,13 @@ def extract_invoice_data_only(file_url: str, model_name: str = None, temperature
                 settings=s,
                 debug=debug,
             )
-            return {"success": True, "data": data, "model_used": f"{ocr_model}+{chat_model}", "temperature": temp, "extraction_time": now()}
+            return {"success": True, "data": data, "model_used": _model_used(data, ocr_model, chat_model), "temperature": temp, "extraction_time": now()}
 
         return {"success": False, "error": f"Unsupported file type: {ext}"}
 
     except Exception as e:
         _log("Mistral Extraction Error", traceback.format_exc())
-        return {"success": False, "error": str(e)}
+        return {"success": False, "error": str(e), "retryable": is_retryable_error(e)}
 
 
 # ---------------- Core: EXACT docs flow ----------------
@@ -216,53 +262,138 @@ def _pdf_upload_signedurl_ocr_then_extract(client, pdf_bytes: bytes, file_name:
                                           ocr_model: str, chat_model: str,
                                           temperature: float, settings, debug: int):
     """
-    1) upload file purpose="ocr"
+    Born-digital PDFs with a good text layer skip OCR entirely (see pdf_text).
+    Otherwise OCR via _pdf_ocr, then Chat to extract JSON from the text.
+    """
+    with stage("preprocess"):
+        layer = usable_text_layer(pdf_bytes)
+
+    if layer:
+        if debug:
+            frappe.logger().info(f"[Mistral] Using PDF text layer: {file_name} (quality {layer.quality})")
+        note(page_count=layer.pages, text_source="Text Layer")
+        ocr_text = layer.text
+    else:
+        # Segments of a split batch PDF were OCR'd with their parent
+        ocr_text = remembered_document_text(pdf_bytes)
+        if ocr_text:
+            note(text_source="OCR Cache")
+        else:
+            note(text_source="OCR")
+            ocr_text = _ocr_pages_to_text(_pdf_ocr(client, pdf_bytes, file_name, ocr_model, settings, debug))
+            remember_document_text(pdf_bytes, ocr_text)
+
+    if not ocr_text:
+        raise Exception("OCR returned no text")
+
+    # 4) Chat extract JSON
+    data = _extract_from_ocr_text(client, ocr_text, chat_model, temperature, settings)
+    with stage("parse"):
+        data = _post_process(data)
+    note(item_count=len(data.get("items") or []))
+    return data
+
+
+def _pdf_ocr(client, pdf_bytes: bytes, file_name: str, ocr_model: str, settings, debug: int):
+    """
+    Small PDFs (<= inline_pdf_max_kb): ocr.process(document_url=data:application/pdf;base64,...)
+    Larger PDFs:
+    1) upload file purpose="ocr" (reused per content hash, see _get_or_upload_pdf)
     2) get_signed_url(file_id)
     3) ocr.process(model=..., document={"type":"document_url","document_url": signed_url})
     """
-    # 1) Save temp + upload
-    tmp_path = f"/tmp/{file_name}"
-    with open(tmp_path, "wb") as f:
-        f.write(pdf_bytes)
+    inline_max_kb = getattr(settings, "inline_pdf_max_kb", None)
+    inline_max = cint(1024 if inline_max_kb is None else inline_max_kb) * 1024
+
+    if inline_max and len(pdf_bytes) <= inline_max:
+        with stage("preprocess"):
+            document_url = _to_data_url(pdf_bytes, "application/pdf")
+        if debug:
+            frappe.logger().info(f"[Mistral] Sending PDF inline: {file_name} ({len(pdf_bytes)} bytes)")
+    else:
+        file_id = _get_or_upload_pdf(client, pdf_bytes, file_name, settings, debug)
+
+        # 2) signed url
+        with stage("signed_url"):
+            signed = client.files.get_signed_url(file_id=file_id)
+        document_url = signed.url
+
+        if debug:
+            frappe.logger().info(f"[Mistral] Signed URL obtained")
+
+    # 3) OCR
+    with stage("ocr"):
+        return client.ocr.process(
+            model=ocr_model,
+            document={"type": "document_url", "document_url": document_url}
+        )
+
+
+# ---------------- Uploaded file reuse / cleanup ----------------
+UPLOAD_CACHE_KEY = "invoice_extraction:mistral:upload:{}"
+UPLOAD_EXPIRY_KEY = "invoice_extraction:mistral:upload_expiry"
+
+
+def _get_or_upload_pdf(client, pdf_bytes: bytes, file_name: str, settings, debug: int) -> str:
+    """Upload once per content hash; re-extractions and failover retries reuse the file_id."""
+    ttl = max(cint(getattr(settings, "uploaded_file_ttl_minutes", None) or 60), 1) * 60
+    cache_key = UPLOAD_CACHE_KEY.format(hashlib.sha256(pdf_bytes).hexdigest())
+
+    cached = frappe.cache().get_value(cache_key)
+    if cached:
+        if debug:
+            frappe.logger().info(f"[Mistral] Reusing uploaded file_id: {cached}")
+        return cached
 
     if debug:
         frappe.logger().info(f"[Mistral] Uploading PDF: {file_name}")
 
-    with open(tmp_path, "rb") as f:
+    with stage("upload"):
         uploaded_pdf = client.files.upload(
-            file={"file_name": file_name, "content": f},
+            file={"file_name": file_name, "content": pdf_bytes},
             purpose="ocr"
         )
 
-    try:
-        os.remove(tmp_path)
-    except Exception:
-        pass
-
     file_id = uploaded_pdf.id
     if debug:
         frappe.logger().info(f"[Mistral] Uploaded file_id: {file_id}")
 
-    # 2) signed url
-    signed = client.files.get_signed_url(file_id=file_id)
-    signed_url = signed.url
-
-    if debug:
-        frappe.logger().info(f"[Mistral] Signed URL obtained")
-
-    # 3) OCR
-    ocr_resp = client.ocr.process(
-        model=ocr_model,
-        document={"type": "document_url", "document_url": signed_url}
-    )
-
-    ocr_text = _ocr_pages_to_text(ocr_resp)
-    if not ocr_text:
-        raise Exception("OCR returned no text")
-
-    # 4) Chat extract JSON
-    data = _extract_from_ocr_text(client, ocr_text, chat_model, temperature, settings)
-    return _post_process(data)
+    frappe.cache().set_value(cache_key, file_id, expires_in_sec=ttl)
+    # Deleted on the provider side by delete_expired_uploads once the cache entry has lapsed
+    frappe.cache().hset(UPLOAD_EXPIRY_KEY, file_id, time.time() + ttl)
+    return file_id
+
+
+def delete_expired_uploads():
+    """Hourly: delete uploaded OCR files from Mistral once no cache entry can hand them out."""
+    if not mistral_available():
+        return
+
+    expiries = frappe.cache().hgetall(UPLOAD_EXPIRY_KEY) or {}
+    now_ts = time.time()
+    expired = [
+        (k.decode() if isinstance(k, bytes) else k)
+        for k, v in expiries.items()
+        if float(v) <= now_ts
+    ]
+    if not expired:
+        return
+
+    s = _get_settings()
+    api_key = s.get_password("mistral_api_key") if s else None
+    if not api_key:
+        return
+
+    client = _get_client(api_key, timeout=30)
+    for file_id in expired:
+        try:
+            client.files.delete(file_id=file_id)
+        except Exception as e:
+            # Already gone on the provider side is fine; anything else is retried next hour
+            if getattr(e, "status_code", None) != 404:
+                _log("Mistral File Cleanup Error", f"{file_id}: {e}")
+                continue
+        frappe.cache().hdel(UPLOAD_EXPIRY_KEY, file_id)
 
 
 def _image_ocr_then_extract(client, img_bytes: bytes, ext: str,
@@ -276,29 +407,103 @@ def _image_ocr_then_extract(client, img_bytes: bytes, ext: str,
     else:
         mime = "image/png"
 
-    doc = {"type": "image_url", "image_url": _to_data_url(img_bytes, mime)}
+    with stage("preprocess"):
+        doc = {"type": "image_url", "image_url": _to_data_url(img_bytes, mime)}
+    note(text_source="OCR")
 
-    ocr_resp = client.ocr.process(model=ocr_model, document=doc)
+    with stage("ocr"):
+        ocr_resp = client.ocr.process(model=ocr_model, document=doc)
     ocr_text = _ocr_pages_to_text(ocr_resp)
     if not ocr_text:
         raise Exception("OCR returned no text")
+    remember_document_text(img_bytes, ocr_text)
 
     data = _extract_from_ocr_text(client, ocr_text, chat_model, temperature, settings)
-    return _post_process(data)
+    with stage("parse"):
+        data = _post_process(data)
+    note(item_count=len(data.get("items") or []))
+    return data
 
 
-def _ocr_pages_to_text(ocr_resp) -> str:
+def _ocr_pages(ocr_resp) -> list:
+    """Markdown of every OCR page, in order (empty pages kept so indexes match the PDF)."""
     pages = getattr(ocr_resp, "pages", None) or []
-    out = []
-    for p in pages:
-        md = getattr(p, "markdown", "") or ""
-        if md.strip():
-            out.append(md.strip())
-    return "\n\n".join(out).strip()
+    note(page_count=len(pages))
+    texts = [(getattr(p, "markdown", "") or "").strip() for p in pages]
+    record_pages(texts)
+    return texts
 
 
-def _extract_from_ocr_text(client, ocr_text: str, chat_model: str, temperature: float, settings):
-    json_format = getattr(settings, "json_format", None) or """{
+def _ocr_pages_to_text(ocr_resp) -> str:
+    return "\n\n".join(md for md in _ocr_pages(ocr_resp) if md).strip()
+
+
+def ocr_page_texts(pdf_bytes: bytes, file_name: str):
+    """Per-page OCR markdown of a PDF, or None when Mistral is not set up (used by segmentation)."""
+    if not mistral_available():
+        return None
+    s = _get_settings()
+    api_key = s.get_password("mistral_api_key") if s else None
+    if not api_key:
+        return None
+
+    ocr_model = getattr(s, "ocr_model", None) or "mistral-ocr-2512"
+    debug = int(getattr(s, "enable_debug_log", 0) or 0)
+    resp = _pdf_ocr(_get_client(api_key), pdf_bytes, file_name, ocr_model, s, debug)
+    pages = [(getattr(p, "markdown", "") or "").strip() for p in (getattr(resp, "pages", None) or [])]
+    # Its own counter: the extraction that follows reads this text as "OCR Cache" and sets page_count itself
+    count(split_ocr_pages=len(pages))
+    return pages
+
+
+def read_document_text(file_bytes: bytes, ext: str, file_name: str):
+    """
+    (text, how it was read) without the structuring call, for the batch lane:
+    the PDF text layer, the remembered OCR text, or OCR now. The text is None
+    when OCR is needed and Mistral is not set up.
+    """
+    if ext == ".pdf":
+        with stage("preprocess"):
+            layer = usable_text_layer(file_bytes)
+        if layer:
+            return layer.text, {"text_source": "Text Layer", "page_count": layer.pages}
+
+    text = remembered_document_text(file_bytes)
+    if text:
+        return text, {"text_source": "OCR Cache"}
+
+    s = _get_settings()
+    api_key = s.get_password("mistral_api_key") if (s and mistral_available()) else None
+    if not api_key:
+        return None, {}
+
+    ocr_model = getattr(s, "ocr_model", None) or "mistral-ocr-2512"
+    debug = int(getattr(s, "enable_debug_log", 0) or 0)
+    client = _get_client(api_key)
+    if ext == ".pdf":
+        pages = _ocr_pages(_pdf_ocr(client, file_bytes, file_name, ocr_model, s, debug))
+    else:
+        mime = "image/jpeg" if ext in [".jpg", ".jpeg"] else "image/png"
+        with stage("ocr"):
+            resp = client.ocr.process(
+                model=ocr_model,
+                document={"type": "image_url", "image_url": _to_data_url(file_bytes, mime)},
+            )
+        pages = _ocr_pages(resp)
+
+    text = "\n\n".join(md for md in pages if md).strip()
+    if text:
+        remember_document_text(file_bytes, text)
+    return text or None, {"text_source": "OCR", "page_count": len(pages)}
+
+
+def _model_used(data: dict, ocr_model: str, chat_model: str) -> str:
+    if data.get("extraction_template"):
+        return f"Template: {data['extraction_template']}"
+    return f"{ocr_model}+{chat_model}"
+
+
+DEFAULT_JSON_FORMAT = """{
   "supplier": "اسم المورد",
   "supplier_ar": "اسم المورد بالعربية",
   "invoice_number": "رقم الفاتورة",
@@ -321,6 +526,10 @@ def _extract_from_ocr_text(client, ocr_text: str, chat_model: str, temperature:
   ]
 }"""
 
+
+def _chat_messages(settings, source_text: str, instruction: str = "") -> list:
+    """System + user messages of the structuring call (also the body of batch requests)."""
+    json_format = getattr(settings, "json_format", None) or DEFAULT_JSON_FORMAT
     system_instruction = getattr(settings, "system_instruction", None) or "أنت متخصص في استخراج بيانات الفواتير بدقة."
     prompt_instructions = getattr(settings, "prompt_instructions", None) or ""
 
@@ -333,28 +542,87 @@ def _extract_from_ocr_text(client, ocr_text: str, chat_model: str, temperature:
 {json_format}
 
 {prompt_instructions}
-
+{instruction}
 نص OCR:
-{ocr_text}
+{source_text}
 """
+    return [
+        {"role": "system", "content": system_instruction},
+        {"role": "user", "content": prompt},
+    ]
 
-    resp = client.chat.complete(
-        model=chat_model,
-        messages=[
-            {"role": "system", "content": system_instruction},
-            {"role": "user", "content": prompt},
-        ],
-        temperature=temperature,
-        max_tokens=4000,
-        response_format={"type": "json_object"},
-    )
 
-    text = resp.choices[0].message.content
-    data = _json_extract(text)
+def _extract_from_ocr_text(client, ocr_text: str, chat_model: str, temperature: float, settings):
+    budget = output_budget()
+    record(text=ocr_text, budget=budget)
+
+    def generate(source_text: str, instruction: str):
+        with stage("generation"):
+            resp = client.chat.complete(
+                model=chat_model,
+                messages=_chat_messages(settings, source_text, instruction),
+                temperature=temperature,
+                max_tokens=budget,
+                response_format={"type": "json_object"},
+            )
+        usage = getattr(resp, "usage", None)
+        count(
+            tokens_in=getattr(usage, "prompt_tokens", 0) or 0,
+            tokens_out=getattr(usage, "completion_tokens", 0) or 0,
+        )
+        choice = resp.choices[0]
+        text = choice.message.content or ""
+        truncated = is_truncated(getattr(choice, "finish_reason", None))
+        record_answer(text, truncated)
+        return text, truncated
+
+    return _structure(ocr_text, generate, budget)
+
+
+def _structure(ocr_text: str, generate, budget: int) -> dict:
+    """
+    Template or chat answers (from `generate`: a live call, or the archive on
+    replay) parsed into one invoice, continued or chunked like a live call.
+    """
+    # Known supplier layout: read it deterministically, no chat call
+    data = extract_with_template(ocr_text)
+    if data:
+        return data
+
+    # Too many rows for one answer: header once, items fragment by fragment
+    chunks = split_for_budget(ocr_text, budget) if ocr_text else []
+    if len(chunks) > 1:
+        data = extract_in_chunks(generate, ocr_text, chunks, _parse_json)
+    else:
+        data = extract_complete(generate, ocr_text, _parse_json)
+
     if not data:
         raise Exception("Failed to parse JSON from chat response")
     return data
 
+
+def answer_json(prompt: str, max_tokens: int):
+    """One short text-only chat call (targeted corrections); the parsed JSON answer or None."""
+    s = _get_settings()
+    chat_model = s.selected_model or "mistral-large-latest"
+    note(model=chat_model)
+    client = _get_client(s.get_password("mistral_api_key"))
+
+    with stage("generation"):
+        resp = client.chat.complete(
+            model=chat_model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=s.temperature or 0.1,
+            max_tokens=max_tokens,
+            response_format={"type": "json_object"},
+        )
+    usage = getattr(resp, "usage", None)
+    count(
+        tokens_in=getattr(usage, "prompt_tokens", 0) or 0,
+        tokens_out=getattr(usage, "completion_tokens", 0) or 0,
+    )
+    return _parse_json(resp.choices[0].message.content or "")
+
 @frappe.whitelist()
 def create_purchase_invoice_draft(invoice_name: str) -> dict:
     """
@@ -706,7 +974,8 @@ def _apply_extracted_data_to_invoice(inv, data: dict) -> None:
     supplier_name = (data.get("supplier_ar") or data.get("supplier") or "").strip()
 
     inv.supplier_name = supplier_name
-    inv.supplier_link = _match_supplier_link(supplier_name)
+    with stage("matching"):
+        inv.supplier_link = _match_supplier_link(supplier_name)
     inv.invoice_number = (data.get("invoice_number") or "").strip()
 
     inv.invoice_date = data.get("date") or None
@@ -723,10 +992,11 @@ def _apply_extracted_data_to_invoice(inv, data: dict) -> None:
     else:
         inv.currency = ""
 
-    inv.extracted_data = json.dumps(data, ensure_ascii=False, indent=2)
+    # Virtual field: stored compressed by the controller (payloads.py)
+    inv.extracted_data = json.dumps(data, ensure_ascii=False)
 
-    # Items
-    inv.set("items", [])
+    # Items: existing rows are reused so unchanged lines are not rewritten (bulk_items.py)
+    rows, links = [], {}
     for it in (data.get("items") or []):
         desc = (it.get("description_ar") or it.get("description") or "").strip()
         if not desc:
@@ -738,23 +1008,29 @@ def _apply_extracted_data_to_invoice(inv, data: dict) -> None:
         tax_amount = _safe_float(it.get("tax_amount"), 0.0)
         total_with_tax = _safe_float(it.get("total_with_tax"), amount + tax_amount)
 
-        item_link = _match_item_link(desc)
-
-        row = inv.append("items", {})
-        row.extracted_text = desc
-        row.item_link = item_link
-        row.quantity = qty
-        row.rate = rate
-        row.amount = amount
-        row.tax_amount = tax_amount
-        row.total_with_tax = total_with_tax
-        row.language = "ar" if it.get("description_ar") else "en"
-        row.taxable = 1 if tax_amount > 0 else 0
+        if desc not in links:
+            with stage("matching"):
+                links[desc] = _match_item_link(desc)
+
+        rows.append({
+            "extracted_text": desc,
+            "item_link": links[desc],
+            "quantity": qty,
+            "rate": rate,
+            "amount": amount,
+            "tax_amount": tax_amount,
+            "total_with_tax": total_with_tax,
+            "language": "ar" if it.get("description_ar") else "en",
+            "taxable": 1 if tax_amount > 0 else 0,
+        })
+    set_extracted_items(inv, rows)
 
     inv.status = "Ready"
 
 
 @frappe.whitelist()
+@traced("Mistral")
+@recorded
 def extract_and_update_extracted_invoice(invoice_name: str) -> dict:
     """Server-side extraction + write results into Extracted Invoice."""
     try:
@@ -773,8 +1049,10 @@ def extract_and_update_extracted_invoice(invoice_name: str) -> dict:
         inv.extraction_model = res.get("model_used") or ""
         _apply_extracted_data_to_invoice(inv, data)
 
-        inv.save(ignore_permissions=True, ignore_version=True)
-        frappe.db.commit()
+        with stage("save"):
+            inv.save(ignore_permissions=True, ignore_version=True)
+            archive(inv.name, "Mistral", inv.extraction_model)
+            frappe.db.commit()
 
         return {"success": True, "invoice": inv.name, "updated": True, "extraction_time": res.get("extraction_time")}
 
@@ -0,0 +1,34 @@
+"""Move extracted_data out of `tabExtracted Invoice` into compressed Extraction Payload rows."""
+import frappe
+
+from invoice_extraction_app.payloads import save_payload
+
+BATCH_SIZE = 500
+
+
+def execute():
+    if not frappe.db.has_column("Extracted Invoice", "extracted_data"):
+        return
+
+    frappe.reload_doc("invoice_extraction_app", "doctype", "extraction_payload")
+
+    while True:
+        rows = frappe.db.sql(
+            """select name, extracted_data from `tabExtracted Invoice`
+            where extracted_data is not null and extracted_data != ''
+            limit %s""",
+            (BATCH_SIZE,),
+            as_dict=True,
+        )
+        if not rows:
+            break
+
+        for row in rows:
+            save_payload(row.name, row.extracted_data)
+            frappe.db.sql(
+                "update `tabExtracted Invoice` set extracted_data = null where name = %s", (row.name,)
+            )
+        frappe.db.commit()
+
+    # The field is virtual now; the leftover column only made every row load heavier
+    frappe.db.sql_ddl("alter table `tabExtracted Invoice` drop column `extracted_data`")
@@ -0,0 +1,106 @@
+# invoice_extraction_app/payloads.py
+"""
+Compressed side storage for the raw model output of an Extracted Invoice.
+
+`extracted_data` is a virtual field: the JSON lives in an Extraction Payload
+row (one per invoice, compact JSON compressed with zstd when `zstandard` is
+installed, gzip otherwise, base64 in a Long Text column). Loading or saving
+an invoice no longer reads or writes the blob; the form fetches it with
+`get_extracted_data` when the "Extracted text" section is opened.
+"""
+from __future__ import annotations
+
+import base64
+import gzip
+import hashlib
+import json
+from typing import Any, Optional, Tuple, Union
+
+import frappe
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except Exception:
+    ZSTD_AVAILABLE = False
+
+PAYLOAD_DOCTYPE = "Extraction Payload"
+
+
+def _compact(data: Union[str, dict, list]) -> str:
+    """Compact JSON; text that is not JSON (hand edits) is stored as is."""
+    if isinstance(data, str):
+        try:
+            data = json.loads(data)
+        except ValueError:
+            return data
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def pack(data: Union[str, dict, list]) -> Tuple[str, str, int, str]:
+    """(encoding, base64 blob, original size, content hash) of a payload."""
+    raw = _compact(data).encode("utf-8")
+    if ZSTD_AVAILABLE:
+        encoding, blob = "zstd", zstandard.ZstdCompressor(level=9).compress(raw)
+    else:
+        encoding, blob = "gzip", gzip.compress(raw, compresslevel=9, mtime=0)
+    return encoding, base64.b64encode(blob).decode("ascii"), len(raw), hashlib.sha1(raw).hexdigest()
+
+
+def unpack(encoding: str, payload: str) -> str:
+    blob = base64.b64decode(payload or "")
+    if encoding == "zstd":
+        if not ZSTD_AVAILABLE:
+            frappe.throw("This payload is zstd-compressed; install the zstandard package to read it")
+        raw = zstandard.ZstdDecompressor().decompress(blob)
+    else:
+        raw = gzip.decompress(blob)
+    return raw.decode("utf-8")
+
+
+def save_payload(invoice_name: str, data: Any) -> None:
+    """Store (or replace) an invoice's payload; empty data removes it."""
+    if data in (None, "", {}, []):
+        delete_payload(invoice_name)
+        return
+
+    encoding, payload, original_size, content_hash = pack(data)
+    existing = frappe.db.get_value(PAYLOAD_DOCTYPE, invoice_name, "content_hash")
+    if existing == content_hash:
+        return
+
+    values = {
+        "encoding": encoding,
+        "payload": payload,
+        "original_size": original_size,
+        "stored_size": len(payload),
+        "content_hash": content_hash,
+    }
+    if existing is None:
+        frappe.get_doc({"doctype": PAYLOAD_DOCTYPE, "invoice": invoice_name, **values}).insert(
+            ignore_permissions=True
+        )
+    else:
+        frappe.db.set_value(PAYLOAD_DOCTYPE, invoice_name, values)
+
+
+def load_payload(invoice_name: str) -> Optional[str]:
+    """The stored payload as pretty-printed JSON, or None when there is none."""
+    row = frappe.db.get_value(PAYLOAD_DOCTYPE, invoice_name, ["encoding", "payload"], as_dict=True)
+    if not row or not row.payload:
+        return None
+    text = unpack(row.encoding, row.payload)
+    try:
+        return json.dumps(json.loads(text), ensure_ascii=False, indent=2)
+    except ValueError:
+        return text
+
+
+def delete_payload(invoice_name: str) -> None:
+    frappe.db.delete(PAYLOAD_DOCTYPE, {"name": invoice_name})
+
+
+@frappe.whitelist()
+def get_extracted_data(invoice_name: str) -> Optional[str]:
+    frappe.has_permission("Extracted Invoice", "read", invoice_name, throw=True)
+    return load_payload(invoice_name)
@@ -0,0 +1,117 @@
+# invoice_extraction_app/pdf_text.py
+"""
+Text-layer pre-pass for born-digital PDFs.
+
+Most supplier PDFs already carry a text layer. When it reads well, the
+pipelines hand that text straight to the structuring step instead of
+sending the document through OCR / vision. Scanned pages, broken font
+encodings (`(cid:NN)` / U+FFFD) and near-empty pages drop the score below
+the threshold, and those documents keep the OCR path.
+"""
+from __future__ import annotations
+
+import io
+import re
+import unicodedata
+from dataclasses import dataclass
+from typing import List, Optional
+
+from frappe.utils import cint, flt
+
+from invoice_extraction_app.settings_cache import get_settings
+
+try:
+    from pypdf import PdfReader
+    PYPDF_AVAILABLE = True
+except Exception:
+    PYPDF_AVAILABLE = False
+
+MAX_PAGES = 30
+MIN_CHARS_PER_PAGE = 40
+GOOD_CHARS_PER_PAGE = 400
+CID_RE = re.compile(r"\(cid:\d+\)")
+WS_RE = re.compile(r"[ \t]+\n")
+
+
+@dataclass
+class TextLayer:
+    page_texts: List[str]
+    quality: float
+
+    @property
+    def pages(self) -> int:
+        return len(self.page_texts)
+
+    @property
+    def text(self) -> str:
+        return "\n\n".join(t for t in self.page_texts if t.strip())
+
+
+def _page_text(page) -> str:
+    # Layout mode keeps columns aligned (reading order of tables); older pypdf lacks it
+    try:
+        text = page.extract_text(extraction_mode="layout")
+    except TypeError:
+        text = page.extract_text()
+    text = unicodedata.normalize("NFKC", text or "")
+    return WS_RE.sub("\n", text).strip("\n")
+
+
+def score(page_texts: List[str]) -> float:
+    """0..1: coverage on every page, share of readable characters, presence of figures."""
+    if not page_texts:
+        return 0.0
+
+    joined = "".join(page_texts)
+    visible = [ch for ch in joined if not ch.isspace()]
+    if not visible:
+        return 0.0
+
+    # A page with (almost) no text is a scan: OCR must see it
+    if min(len(t.strip()) for t in page_texts) < MIN_CHARS_PER_PAGE:
+        return 0.0
+
+    # Unmapped glyphs ((cid:NN), U+FFFD) count against the text, not towards it
+    cleaned = CID_RE.sub("", joined).replace("\ufffd", "")
+    readable = sum(1 for ch in cleaned if ch.isalnum() or ch in ".,:;-/%()#")
+    readable_ratio = readable / len(visible)
+
+    per_page = len(visible) / len(page_texts)
+    coverage = min(per_page / GOOD_CHARS_PER_PAGE, 1.0)
+    has_figures = any(ch.isdigit() for ch in cleaned)
+
+    return round(0.5 * readable_ratio + 0.3 * coverage + (0.2 if has_figures else 0.0), 3)
+
+
+def extract(pdf_bytes: bytes) -> Optional[TextLayer]:
+    if not PYPDF_AVAILABLE:
+        return None
+    try:
+        reader = PdfReader(io.BytesIO(pdf_bytes))
+        if reader.is_encrypted or len(reader.pages) > MAX_PAGES:
+            return None
+        texts = [_page_text(p) for p in reader.pages]
+    except Exception:
+        return None
+    return TextLayer(page_texts=texts, quality=score(texts))
+
+
+def _threshold() -> Optional[float]:
+    """Minimum quality from Extraction Settings, or None when the fast path is off."""
+    s = get_settings("Extraction Settings")
+    if not s:
+        return 0.7
+    if not cint(getattr(s, "use_pdf_text_layer", 1)):
+        return None
+    return flt(getattr(s, "min_text_quality", 70) or 70) / 100.0
+
+
+def usable_text_layer(pdf_bytes: bytes) -> Optional[TextLayer]:
+    """The PDF's own text when it is good enough to skip OCR, else None."""
+    threshold = _threshold()
+    if threshold is None:
+        return None
+    layer = extract(pdf_bytes)
+    if not layer or layer.quality < threshold:
+        return None
+    return layer
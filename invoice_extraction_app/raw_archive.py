@@ -0,0 +1,278 @@
+# invoice_extraction_app/raw_archive.py
+"""
+Raw provider responses, archived per extraction, and offline replay.
+
+Only the post-processed JSON of an extraction used to survive: the Gemini
+answer text, the Mistral OCR pages and the chat answers were thrown away,
+so a parser, post-processing or matching fix could reach old invoices only
+through a new, paid extraction. Extractions that write into an Extracted
+Invoice now run inside a recording on `frappe.local` (`@recorded` /
+`recording()`); the pipelines add what the provider returned with `record`,
+`record_pages` and `record_answer` (no-ops outside a recording), and
+`archive` stores it next to the invoice as an Extraction Archive row,
+compressed like Extraction Payload (payloads.py). A re-extraction replaces
+the row; "Archive Raw Responses" in Extraction Settings turns it off.
+
+`replay_invoices` re-runs everything after the network from the archive,
+fanned out over background jobs: the archived answers are served back in
+order to the pipeline's own continuation / chunking and parsing
+(`api._structure`, `mistral._structure`), then `_post_process`,
+`_apply_extracted_data_to_invoice` (supplier and item matching) and the
+save. Nothing is sent to a provider. When the replayed flow asks for an
+answer the archive does not have (a template that no longer matches, more
+continuations after a parser change), the invoice is left as it was and
+reported. `correct_after_extraction` asks the provider again, so replay
+skips it.
+"""
+from __future__ import annotations
+
+import functools
+import json
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+import frappe
+from frappe.utils import cint, now
+
+from invoice_extraction_app.chunking import output_budget
+from invoice_extraction_app.payloads import pack, unpack
+from invoice_extraction_app.settings_cache import get_settings
+
+ARCHIVE_DOCTYPE = "Extraction Archive"
+ARCHIVE_VERSION = 1
+# Invoices whose data a replay may replace (not yet mapped or converted by a user)
+REPLAY_STATUSES = ("Processing", "Ready")
+REPLAY_CHUNK = 50
+COMMIT_EVERY = 50
+
+
+class ReplayError(Exception):
+    """The archive cannot reproduce this extraction without calling the provider."""
+
+
+class Recording:
+    def __init__(self):
+        self.fields: Dict[str, Any] = {}
+        self.pages: List[str] = []
+        self.answers: List[list] = []
+
+    def as_dict(self, provider: str, model: str) -> Dict[str, Any]:
+        return {
+            "version": ARCHIVE_VERSION,
+            "provider": provider,
+            "model": model,
+            **self.fields,
+            "ocr_pages": self.pages,
+            "answers": self.answers,
+        }
+
+
+# ---------------- Recording ----------------
+def _enabled() -> bool:
+    s = get_settings("Extraction Settings")
+    return not s or bool(cint(s.get("archive_raw_responses", 1)))
+
+
+def current_recording() -> Optional[Recording]:
+    return getattr(frappe.local, "extraction_recording", None)
+
+
+@contextmanager
+def recording():
+    """Record the provider responses of the extraction run inside the block."""
+    previous = current_recording()
+    frappe.local.extraction_recording = Recording() if _enabled() else None
+    try:
+        yield frappe.local.extraction_recording
+    finally:
+        frappe.local.extraction_recording = previous
+
+
+def recorded(fn):
+    """Run an extraction entry point inside `recording()`."""
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with recording():
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def restart_recording() -> None:
+    """Forget what a failed attempt recorded (router failover)."""
+    rec = current_recording()
+    if rec:
+        rec.__init__()
+
+
+def record(**fields) -> None:
+    """Set fields of the recording: `text` the structuring call read, output `budget`."""
+    rec = current_recording()
+    if rec:
+        rec.fields.update(fields)
+
+
+def record_pages(pages: List[str]) -> None:
+    rec = current_recording()
+    if rec:
+        rec.pages = list(pages)
+
+
+def record_answer(text: str, truncated: bool) -> None:
+    rec = current_recording()
+    if rec:
+        rec.answers.append([text or "", bool(truncated)])
+
+
+def archive(invoice_name: str, provider: str, model: str = "") -> None:
+    """Store (or replace) the invoice's archive from the active recording."""
+    rec = current_recording()
+    if not rec or not (rec.answers or rec.pages or rec.fields.get("text")):
+        return
+
+    try:
+        encoding, payload, original_size, _ = pack(rec.as_dict(provider, model))
+        values = {
+            "provider": provider,
+            "model": model,
+            "answer_count": len(rec.answers),
+            "page_count": len(rec.pages),
+            "encoding": encoding,
+            "payload": payload,
+            "original_size": original_size,
+            "stored_size": len(payload),
+            "archived_at": now(),
+        }
+        if frappe.db.exists(ARCHIVE_DOCTYPE, invoice_name):
+            frappe.db.set_value(ARCHIVE_DOCTYPE, invoice_name, values)
+        else:
+            frappe.get_doc({"doctype": ARCHIVE_DOCTYPE, "invoice": invoice_name, **values}).insert(
+                ignore_permissions=True
+            )
+    except Exception:
+        # The extraction itself succeeded; losing its archive must not undo it
+        frappe.log_error(frappe.get_traceback(), f"Raw Archive Error: {invoice_name}"[:140])
+
+
+def load_archive(invoice_name: str) -> Optional[Dict[str, Any]]:
+    row = frappe.db.get_value(ARCHIVE_DOCTYPE, invoice_name, ["encoding", "payload"], as_dict=True)
+    if not row or not row.payload:
+        return None
+    return json.loads(unpack(row.encoding, row.payload))
+
+
+def delete_archive(invoice_name: str) -> None:
+    frappe.db.delete(ARCHIVE_DOCTYPE, {"name": invoice_name})
+
+
+# ---------------- Replay ----------------
+def _archived_answers(archived: Dict[str, Any]):
+    """A `generate` that hands out the archived answers in order instead of calling the provider."""
+    answers = iter(archived.get("answers") or [])
+
+    def generate(source_text: str, instruction: str):
+        try:
+            text, truncated = next(answers)
+        except StopIteration:
+            raise ReplayError("The archive has no answer for this request; extract the invoice again") from None
+        return text, bool(truncated)
+
+    return generate
+
+
+def rebuild(archived: Dict[str, Any]) -> dict:
+    """The post-processed data of an archived extraction, parsed again with the current code."""
+    from invoice_extraction_app import api, mistral
+    from invoice_extraction_app.supplier_templates import extract_with_template
+
+    text = archived.get("text")
+    if not text and archived.get("ocr_pages"):
+        text = "\n\n".join(p for p in archived["ocr_pages"] if p).strip()
+    budget = cint(archived.get("budget")) or output_budget()
+    generate = _archived_answers(archived)
+
+    if archived.get("provider") == "Gemini":
+        # Same order as api.extract_invoice_data_only: a template reads the text layer as is
+        data = extract_with_template(text) if text else None
+        return data or api._post_process(api._structure(generate, text, budget))
+
+    return mistral._post_process(mistral._structure(text, generate, budget))
+
+
+def replay_invoice(invoice_name: str) -> dict:
+    """Re-apply one invoice's archived extraction; no provider is called."""
+    from invoice_extraction_app.api import _apply_extracted_data_to_invoice
+
+    archived = load_archive(invoice_name)
+    if not archived:
+        raise ReplayError("No archived responses")
+
+    data = rebuild(archived)
+    inv = frappe.get_doc("Extracted Invoice", invoice_name)
+    _apply_extracted_data_to_invoice(inv, data)
+    inv.save(ignore_permissions=True, ignore_version=True)
+    return {"invoice": inv.name, "items": len(data.get("items") or [])}
+
+
+def replay_batch(invoice_names: List[str]) -> dict:
+    """Background job: replay a chunk of invoices, one savepoint each."""
+    replayed, errors = 0, []
+    for i, name in enumerate(invoice_names, 1):
+        frappe.db.savepoint("raw_archive_replay")
+        try:
+            replay_invoice(name)
+            replayed += 1
+        except Exception as e:
+            frappe.db.rollback(save_point="raw_archive_replay")
+            errors.append(f"{name}: {e}")
+
+        if i % COMMIT_EVERY == 0:
+            frappe.db.commit()
+    frappe.db.commit()
+
+    if errors:
+        frappe.log_error("\n".join(errors[:200]), f"Extraction Replay: {len(errors)} not replayed")
+    return {"replayed": replayed, "failed": len(errors)}
+
+
+def _replayable(invoice_names: Optional[List[str]]) -> List[str]:
+    filters = {"status": ("in", REPLAY_STATUSES)}
+    if invoice_names:
+        filters["name"] = ("in", invoice_names)
+    names = frappe.get_all("Extracted Invoice", filters=filters, pluck="name", order_by="creation asc")
+    archived = set(frappe.get_all(ARCHIVE_DOCTYPE, filters={"name": ("in", names)}, pluck="name")) if names else set()
+    return [n for n in names if n in archived]
+
+
+@frappe.whitelist()
+def replay_invoices(invoice_names=None) -> dict:
+    """
+    List action / bench execute: re-run parsing, post-processing and matching
+    from the archive for these invoices (every archived Processing / Ready
+    invoice when empty), in parallel background jobs.
+    """
+    try:
+        frappe.has_permission("Extracted Invoice", "write", throw=True)
+        if isinstance(invoice_names, str):
+            invoice_names = json.loads(invoice_names) if invoice_names.startswith("[") else [invoice_names]
+
+        names = _replayable(invoice_names)
+        jobs = 0
+        for start in range(0, len(names), REPLAY_CHUNK):
+            chunk = names[start:start + REPLAY_CHUNK]
+            frappe.enqueue(
+                "invoice_extraction_app.raw_archive.replay_batch",
+                queue="long",
+                timeout=max(300, 10 * len(chunk)),
+                job_name=f"replay_extractions ({len(chunk)})",
+                invoice_names=chunk,
+            )
+            jobs += 1
+
+        skipped = len(invoice_names) - len(names) if invoice_names else 0
+        return {"success": True, "queued": len(names), "jobs": jobs, "skipped": skipped}
+
+    except Exception as e:
+        frappe.log_error(frappe.get_traceback(), "Extraction Replay Error")
+        return {"success": False, "error": str(e)}
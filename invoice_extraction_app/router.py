@@ -0,0 +1,365 @@
+# invoice_extraction_app/router.py
+"""
+Latency-aware routing between the extraction providers.
+
+Gemini (`api.py`) and Mistral (`mistral.py`) stay separate pipelines; this
+module wraps both behind one provider interface and keeps rolling latency /
+error-rate samples per (provider, model) in Redis, shared by all workers.
+Each extraction goes to the fastest healthy backend within the configured
+cost ceiling and fails over to the next one on timeouts, 429 and 5xx.
+
+Backends and thresholds live in "Extraction Settings".
+"""
+from __future__ import annotations
+
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import frappe
+from frappe.utils import cint, flt, now
+
+from invoice_extraction_app.costing import prefer_cheaper
+from invoice_extraction_app.instrumentation import note, stage, traced
+from invoice_extraction_app.raw_archive import archive, recorded, restart_recording
+from invoice_extraction_app.settings_cache import get_settings
+from invoice_extraction_app.utils import is_retryable_error
+
+STATS_KEY = "invoice_extraction:router:stats:{}"
+COOLDOWN_KEY = "invoice_extraction:router:cooldown:{}"
+FAILURE_STREAK = 3
+MIN_SAMPLES_FOR_HEALTH = 5
+
+
+# ---------------- Providers ----------------
+class ExtractionProvider(ABC):
+    """One extraction backend family. `extract` returns the pipelines' usual result dict."""
+
+    name = ""
+
+    @abstractmethod
+    def is_configured(self) -> bool:
+        ...
+
+    @abstractmethod
+    def default_model(self) -> str:
+        ...
+
+    @abstractmethod
+    def extract(self, file_url: str, model: Optional[str] = None, timeout: Optional[float] = None) -> dict:
+        ...
+
+    @abstractmethod
+    def ask(self, prompt: str, max_tokens: int) -> Optional[dict]:
+        """A short text-only question answered in JSON (targeted corrections)."""
+
+
+class GeminiProvider(ExtractionProvider):
+    name = "Gemini"
+
+    def is_configured(self) -> bool:
+        from invoice_extraction_app import sdk
+
+        s = get_settings("Gemini Settings")
+        return bool(s and s.gemini_api_key) and sdk.available("genai")
+
+    def default_model(self) -> str:
+        s = get_settings("Gemini Settings")
+        return (s and s.selected_model) or "gemini-2.5-flash"
+
+    def extract(self, file_url, model=None, timeout=None):
+        from invoice_extraction_app import api
+
+        return api.extract_invoice_data_only(file_url, model_name=model, timeout=timeout)
+
+    def ask(self, prompt, max_tokens):
+        from invoice_extraction_app import api
+
+        return api.answer_json(prompt, max_tokens)
+
+
+class MistralProvider(ExtractionProvider):
+    name = "Mistral"
+
+    def is_configured(self) -> bool:
+        from invoice_extraction_app import mistral
+
+        return bool(get_settings("Mistral Settings")) and mistral.mistral_available()
+
+    def default_model(self) -> str:
+        s = get_settings("Mistral Settings")
+        return (s and s.selected_model) or "mistral-large-latest"
+
+    def extract(self, file_url, model=None, timeout=None):
+        from invoice_extraction_app import mistral
+
+        return mistral.extract_invoice_data_only(file_url, model_name=model, timeout=timeout)
+
+    def ask(self, prompt, max_tokens):
+        from invoice_extraction_app import mistral
+
+        return mistral.answer_json(prompt, max_tokens)
+
+
+PROVIDERS: Dict[str, ExtractionProvider] = {
+    GeminiProvider.name: GeminiProvider(),
+    MistralProvider.name: MistralProvider(),
+}
+
+
+@dataclass
+class Backend:
+    provider: str
+    model: str
+    priority: int = 0
+    cost: float = 0.0
+
+    @property
+    def key(self) -> str:
+        return f"{self.provider}:{self.model}"
+
+
+# ---------------- Settings ----------------
+def _get_router_settings() -> frappe._dict:
+    s = get_settings("Extraction Settings")
+
+    conf = frappe._dict(
+        enabled=cint(getattr(s, "enable_router", 1)) if s else 1,
+        timeout=flt(getattr(s, "request_timeout", 0)) or 120,
+        max_cost=flt(getattr(s, "max_cost_per_extraction", 0)) if s else 0,
+        window=cint(getattr(s, "health_window", 0)) or 50,
+        max_error_rate=flt(getattr(s, "max_error_rate", 50)) if s else 50,
+        cooldown=cint(getattr(s, "cooldown_seconds", 0)) or 60,
+        backends=[],
+    )
+
+    for row in (getattr(s, "backends", None) or []) if s else []:
+        provider = PROVIDERS.get(row.provider)
+        if not row.enabled or not provider:
+            continue
+        conf.backends.append(Backend(
+            provider=row.provider,
+            model=(row.model or "").strip() or provider.default_model(),
+            priority=cint(row.priority),
+            cost=flt(row.cost_per_extraction),
+        ))
+
+    if not conf.backends:
+        conf.backends = [
+            Backend(provider=name, model=p.default_model(), priority=i)
+            for i, (name, p) in enumerate(PROVIDERS.items())
+        ]
+    return conf
+
+
+# ---------------- Health tracking ----------------
+def record(backend: Backend, latency_ms: float, ok: bool, conf: frappe._dict) -> None:
+    try:
+        cache = frappe.cache()
+        key = STATS_KEY.format(backend.key)
+        cache.lpush(key, f"{latency_ms:.0f}|{int(ok)}|{time.time():.0f}")
+        cache.ltrim(key, 0, conf.window - 1)
+
+        if not ok:
+            recent = [s.split("|") for s in _samples(backend, FAILURE_STREAK)]
+            if len(recent) >= FAILURE_STREAK and all(r[1] == "0" for r in recent):
+                cache.set_value(COOLDOWN_KEY.format(backend.key), 1, expires_in_sec=conf.cooldown)
+    except Exception:
+        # Health tracking must never break an extraction
+        pass
+
+
+def _samples(backend: Backend, limit: int) -> List[str]:
+    raw = frappe.cache().lrange(STATS_KEY.format(backend.key), 0, limit - 1) or []
+    return [r.decode() if isinstance(r, bytes) else str(r) for r in raw]
+
+
+def get_stats(backend: Backend, conf: frappe._dict) -> Dict[str, Any]:
+    try:
+        samples = [s.split("|") for s in _samples(backend, conf.window)]
+        cooling_down = bool(frappe.cache().get_value(COOLDOWN_KEY.format(backend.key)))
+    except Exception:
+        samples, cooling_down = [], False
+
+    ok_latencies = [float(s[0]) for s in samples if s[1] == "1"]
+    errors = sum(1 for s in samples if s[1] == "0")
+    error_rate = errors / len(samples) if samples else 0.0
+
+    healthy = not cooling_down and (
+        len(samples) < MIN_SAMPLES_FOR_HEALTH or error_rate * 100 <= conf.max_error_rate
+    )
+    return {
+        "backend": backend.key,
+        "samples": len(samples),
+        "latency_ms": round(sum(ok_latencies) / len(ok_latencies), 1) if ok_latencies else None,
+        "error_rate": round(error_rate, 3),
+        "cooling_down": cooling_down,
+        "healthy": healthy,
+        "cost": backend.cost,
+    }
+
+
+def rank_backends(conf: frappe._dict, preferred: Optional[str] = None, cheapest_first: bool = False) -> List[Backend]:
+    """
+    Fastest healthy first; backends without history are tried before slower known ones.
+
+    With `cheapest_first` (non-urgent work over the daily budget) cost outranks
+    both the preferred provider and latency.
+    """
+    candidates = [
+        b for b in conf.backends
+        if (not conf.max_cost or b.cost <= conf.max_cost) and PROVIDERS[b.provider].is_configured()
+    ]
+    stats = {b.key: get_stats(b, conf) for b in candidates}
+
+    def sort_key(b: Backend):
+        st = stats[b.key]
+        return (
+            0 if st["healthy"] else 1,
+            b.cost if cheapest_first else 0,
+            0 if (preferred and b.provider == preferred) else 1,
+            st["latency_ms"] if st["latency_ms"] is not None else 0,
+            b.priority,
+        )
+
+    ranked = sorted(candidates, key=sort_key)
+    if not conf.enabled:
+        # Router disabled: honour the caller's provider (or the first backend) with no failover
+        ranked = [b for b in ranked if not preferred or b.provider == preferred][:1]
+    return ranked
+
+
+# ---------------- Public API ----------------
+def route_extraction(file_url: str, preferred: Optional[str] = None, urgent: bool = True) -> dict:
+    conf = _get_router_settings()
+    ranked = rank_backends(conf, preferred, cheapest_first=prefer_cheaper(urgent))
+    if not ranked:
+        return {"success": False, "error": "No configured extraction backend within the cost ceiling"}
+
+    attempts = []
+    res: dict = {}
+    for backend in ranked:
+        provider = PROVIDERS[backend.provider]
+        t0 = time.monotonic()
+        # Only the answers of the attempt that counts are archived
+        restart_recording()
+        try:
+            res = provider.extract(file_url, model=backend.model, timeout=conf.timeout) or {}
+        except Exception as e:
+            res = {"success": False, "error": str(e), "retryable": is_retryable_error(e)}
+        latency_ms = (time.monotonic() - t0) * 1000
+
+        # Every failure counts against the backend's health; only retryable ones fail over
+        retryable = not res.get("success") and bool(res.get("retryable"))
+        record(backend, latency_ms, ok=bool(res.get("success")), conf=conf)
+        attempts.append({
+            "backend": backend.key,
+            "latency_ms": round(latency_ms, 1),
+            "success": bool(res.get("success")),
+            "error": res.get("error"),
+        })
+
+        if not retryable:
+            break
+
+    res["provider"] = attempts[-1]["backend"].split(":", 1)[0]
+    note(provider=res["provider"], retry_count=len(attempts) - 1)
+    res["attempts"] = attempts
+    return res
+
+
+@frappe.whitelist()
+@traced()
+@recorded
+def extract_invoice_data_only(file_url: str, provider: str = None, invoice_name: str = None) -> dict:
+    """
+    Extract via the router and return the data only (no record update).
+
+    With `invoice_name` (the form fills itself from the result), the raw responses are archived for it.
+    """
+    res = route_extraction(file_url, preferred=provider)
+    if invoice_name and res.get("success") and frappe.has_permission("Extracted Invoice", "write", invoice_name):
+        archive(invoice_name, res.get("provider"), res.get("model_used") or "")
+    return res
+
+
+@frappe.whitelist()
+@traced()
+@recorded
+def extract_and_update_extracted_invoice(invoice_name: str, provider: str = None, urgent: int = 1) -> dict:
+    """
+    Server-side routed extraction + write results into Extracted Invoice.
+
+    Background callers pass `urgent=0` so the daily budget can steer them to a cheaper backend.
+    """
+    from invoice_extraction_app.api import _apply_extracted_data_to_invoice
+    from invoice_extraction_app.corrections import correct_after_extraction
+    from invoice_extraction_app.segmentation import split_batch_pdf
+
+    try:
+        inv = frappe.get_doc("Extracted Invoice", invoice_name)
+
+        if not inv.original_file:
+            return {"success": False, "error": "original_file is empty"}
+
+        # A batch of invoices in one PDF: the segments are extracted on their own. Scanned
+        # PDFs are OCR'd for it only when Mistral (which reuses that OCR) extracts anyway
+        ranked = rank_backends(_get_router_settings(), provider, cheapest_first=prefer_cheaper(cint(urgent)))
+        frappe.db.savepoint("split_batch_pdf")
+        try:
+            segments = split_batch_pdf(
+                inv, provider=provider, allow_ocr=bool(ranked) and ranked[0].provider == "Mistral"
+            )
+        except Exception:
+            # A failed split (OCR outage, 429, unreadable PDF) must not fail the extraction
+            frappe.db.rollback(save_point="split_batch_pdf")
+            frappe.log_error(frappe.get_traceback(), f"Invoice Split Error: {inv.name}"[:140])
+            segments = None
+        if segments:
+            frappe.db.commit()
+            return {"success": True, "invoice": inv.name, "split_into": segments}
+
+        res = route_extraction(inv.original_file, preferred=provider, urgent=cint(urgent))
+        if not res.get("success"):
+            inv.status = "Processing"
+            inv.save(ignore_permissions=True, ignore_version=True)
+            return {"success": False, "error": res.get("error"), "attempts": res.get("attempts")}
+
+        data = res.get("data") or {}
+        inv.extraction_model = f"{res.get('provider')}: {res.get('model_used') or ''}".strip()
+        _apply_extracted_data_to_invoice(inv, data)
+        # Rows or totals that fail the arithmetic check: ask again about those only
+        correction = correct_after_extraction(inv, data, provider=res.get("provider"))
+
+        with stage("save"):
+            inv.save(ignore_permissions=True, ignore_version=True)
+            archive(inv.name, res.get("provider"), res.get("model_used") or "")
+            frappe.db.commit()
+
+        return {
+            "success": True,
+            "invoice": inv.name,
+            "updated": True,
+            "provider": res.get("provider"),
+            "attempts": res.get("attempts"),
+            "correction": correction,
+            "extraction_time": res.get("extraction_time") or now(),
+        }
+
+    except Exception as e:
+        frappe.log_error(frappe.get_traceback(), "Routed Extraction Error")
+        return {"success": False, "error": str(e)}
+
+
+@frappe.whitelist()
+def get_router_status() -> dict:
+    """Rolling health per backend, in the order the router would currently try them."""
+    conf = _get_router_settings()
+    ranked = rank_backends(conf)
+    return {
+        "success": True,
+        "enabled": conf.enabled,
+        "max_cost": conf.max_cost,
+        "backends": [get_stats(b, conf) for b in ranked],
+    }
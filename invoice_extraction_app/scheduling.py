@@ -0,0 +1,265 @@
+# invoice_extraction_app/scheduling.py
+"""
+Priority classes for background extractions.
+
+Background extractions are submitted here instead of straight to RQ. Each
+class keeps one pending list per tenant (Telegram chat, user, ingest run)
+in Redis; `dispatch()` moves jobs into RQ while the class is under its
+concurrency cap, picking tenants by stride scheduling so a chat sending a
+hundred invoices cannot starve one sending two (`extraction_tenant_weights`
+in site_config gives a tenant a larger share).
+
+  interactive  form / API calls; run in the web request, never queued.
+               While one is in flight, bulk dispatch holds off so the
+               backfill does not compete with a user who is waiting.
+  telegram     webhook uploads, `default` queue (slow lane when over budget).
+  bulk         ingest / backfills, `long` queue.
+
+Dispatch runs on submit, when a job finishes and every minute from the
+scheduler (which also reclaims slots of jobs that died). Wait time from
+submit to start goes into the Extraction Log and `get_scheduler_status()`.
+"""
+from __future__ import annotations
+
+import json
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+import frappe
+from frappe.utils import cint
+
+from invoice_extraction_app.costing import extraction_queue
+from invoice_extraction_app.instrumentation import note, percentile, traced
+from invoice_extraction_app.settings_cache import get_settings
+
+CLASSES = ("interactive", "telegram", "bulk")
+QUEUED_CLASSES = ("telegram", "bulk")
+DEFAULT_CAPS = {"telegram": 4, "bulk": 2}
+CLASS_QUEUE = {"telegram": "default", "bulk": "long"}
+
+PENDING_KEY = "invoice_extraction:sched:pending:{}:{}"
+PASS_KEY = "invoice_extraction:sched:pass:{}"
+RUNNING_KEY = "invoice_extraction:sched:running:{}"
+WAITS_KEY = "invoice_extraction:sched:waits:{}"
+DISPATCH_LOCK = "invoice_extraction:sched:lock"
+
+# A slot whose job has not reported back by then is considered lost
+STALE_AFTER = 30 * 60
+WAIT_SAMPLES = 500
+MAX_DISPATCH_PER_RUN = 200
+
+
+def _caps() -> Dict[str, int]:
+    s = get_settings("Extraction Settings")
+    caps = dict(DEFAULT_CAPS)
+    if s:
+        for cls in QUEUED_CLASSES:
+            value = s.get(f"{cls}_concurrency")
+            if value is not None:
+                caps[cls] = cint(value)
+    return caps
+
+
+def _pause_bulk_for_interactive() -> bool:
+    s = get_settings("Extraction Settings")
+    return bool(cint(s.get("pause_bulk_for_interactive", 1))) if s else True
+
+
+def _weight(cls: str, tenant: str) -> float:
+    weights = frappe.conf.get("extraction_tenant_weights") or {}
+    return max(float(weights.get(f"{cls}:{tenant}", weights.get(tenant, 1)) or 1), 0.01)
+
+
+# ---------------- Running slots ----------------
+def _running(cls: str) -> Dict[str, float]:
+    """Live slots of a class; stale ones (worker died) are dropped on read."""
+    cache = frappe.cache()
+    slots = cache.hgetall(RUNNING_KEY.format(cls)) or {}
+    now_ts = time.time()
+    live = {}
+    for slot, started in slots.items():
+        if now_ts - float(started) > STALE_AFTER:
+            cache.hdel(RUNNING_KEY.format(cls), slot)
+        else:
+            live[slot] = float(started)
+    return live
+
+
+def _take_slot(cls: str) -> str:
+    slot = uuid.uuid4().hex
+    frappe.cache().hset(RUNNING_KEY.format(cls), slot, time.time())
+    return slot
+
+
+def _release_slot(cls: str, slot: str) -> None:
+    frappe.cache().hdel(RUNNING_KEY.format(cls), slot)
+
+
+@contextmanager
+def interactive():
+    """Mark an interactive extraction as in flight for the duration of the block."""
+    try:
+        slot = _take_slot("interactive")
+    except Exception:
+        slot = None
+    try:
+        yield
+    finally:
+        if slot:
+            try:
+                _release_slot("interactive", slot)
+                # Bulk may have been held back for this request
+                dispatch()
+            except Exception:
+                pass
+
+
+# ---------------- Submit / dispatch ----------------
+def _passes(cls: str) -> Dict[str, float]:
+    """tenant -> pass of a class; Redis hands the hash keys back as bytes."""
+    passes = frappe.cache().hgetall(PASS_KEY.format(cls)) or {}
+    return {
+        (tenant.decode() if isinstance(tenant, bytes) else tenant): float(value)
+        for tenant, value in passes.items()
+    }
+
+
+def submit(invoice_name: str, cls: str, tenant: str, provider: Optional[str] = None,
+           after_commit: bool = True) -> None:
+    """Queue a background extraction of `invoice_name` under a class and tenant."""
+    if cls not in QUEUED_CLASSES:
+        raise ValueError(f"Unknown extraction class: {cls}")
+
+    job = json.dumps({
+        "invoice": invoice_name,
+        "provider": provider,
+        "tenant": tenant,
+        "submitted": time.time(),
+    })
+
+    def push():
+        cache = frappe.cache()
+        cache.rpush(PENDING_KEY.format(cls, tenant), job)
+        if cache.hget(PASS_KEY.format(cls), tenant) is None:
+            # Newcomers start level with the busiest-served tenant, not at zero
+            cache.hset(PASS_KEY.format(cls), tenant, min(_passes(cls).values(), default=0.0))
+        dispatch()
+
+    if after_commit:
+        # The worker must be able to read the invoice
+        frappe.db.after_commit.add(push)
+    else:
+        push()
+
+
+def _next_job(cls: str) -> Optional[dict]:
+    """Pop the next job of a class: the pending tenant with the lowest pass goes first."""
+    cache = frappe.cache()
+    for tenant, value in sorted(_passes(cls).items(), key=lambda kv: kv[1]):
+        raw = cache.lpop(PENDING_KEY.format(cls, tenant))
+        if raw is None:
+            # Idle tenants leave the rotation until they submit again
+            cache.hdel(PASS_KEY.format(cls), tenant)
+            continue
+        cache.hset(PASS_KEY.format(cls), tenant, value + 1.0 / _weight(cls, tenant))
+        return json.loads(raw)
+    return None
+
+
+def dispatch() -> int:
+    """Move pending jobs into RQ up to each class's free capacity; returns jobs started."""
+    cache = frappe.cache()
+    lock = cache.lock(cache.make_key(DISPATCH_LOCK), timeout=30, blocking_timeout=5)
+    if not lock.acquire():
+        return 0
+
+    started = 0
+    try:
+        caps = _caps()
+        hold_bulk = _pause_bulk_for_interactive() and bool(_running("interactive"))
+        for cls in QUEUED_CLASSES:
+            if cls == "bulk" and hold_bulk:
+                continue
+            free = caps[cls] - len(_running(cls)) if caps[cls] else MAX_DISPATCH_PER_RUN
+            while free > 0 and started < MAX_DISPATCH_PER_RUN:
+                job = _next_job(cls)
+                if not job:
+                    break
+                _enqueue(cls, job, _take_slot(cls))
+                free -= 1
+                started += 1
+    finally:
+        try:
+            lock.release()
+        except Exception:
+            pass
+    return started
+
+
+def _enqueue(cls: str, job: dict, slot: str) -> None:
+    frappe.enqueue(
+        "invoice_extraction_app.scheduling.run_job",
+        queue=extraction_queue(CLASS_QUEUE[cls]),
+        job_name=f"{cls}_extract_{job['invoice']}",
+        cls=cls,
+        slot=slot,
+        job=job,
+    )
+
+
+@traced()
+def run_job(cls: str, slot: str, job: dict) -> dict:
+    from invoice_extraction_app.router import extract_and_update_extracted_invoice
+
+    wait_ms = max(time.time() - float(job["submitted"]), 0) * 1000
+    note(priority_class=cls.title(), queue_wait_ms=round(wait_ms, 2), invoice=job["invoice"])
+    try:
+        cache = frappe.cache()
+        cache.lpush(WAITS_KEY.format(cls), f"{wait_ms:.0f}")
+        cache.ltrim(WAITS_KEY.format(cls), 0, WAIT_SAMPLES - 1)
+    except Exception:
+        pass
+
+    try:
+        return extract_and_update_extracted_invoice(job["invoice"], provider=job.get("provider"), urgent=0)
+    finally:
+        _release_slot(cls, slot)
+        dispatch()
+
+
+# ---------------- Metrics ----------------
+def _pending(cls: str) -> Dict[str, int]:
+    cache = frappe.cache()
+    return {tenant: cache.llen(PENDING_KEY.format(cls, tenant)) for tenant in _passes(cls)}
+
+
+def pending_count(cls: str) -> int:
+    return sum(_pending(cls).values())
+
+
+def _waits(cls: str) -> List[float]:
+    raw = frappe.cache().lrange(WAITS_KEY.format(cls), 0, WAIT_SAMPLES - 1) or []
+    return [float(r.decode() if isinstance(r, bytes) else r) for r in raw]
+
+
+@frappe.whitelist()
+def get_scheduler_status() -> Dict[str, Any]:
+    """Depth, running jobs, caps and recent wait times (ms) per class."""
+    frappe.only_for(("System Manager", "Accounts Manager"))
+    caps = _caps()
+    status = {}
+    for cls in CLASSES:
+        waits = _waits(cls) if cls in QUEUED_CLASSES else []
+        per_tenant = _pending(cls) if cls in QUEUED_CLASSES else {}
+        status[cls] = {
+            "running": len(_running(cls)),
+            "cap": caps.get(cls),
+            "pending": sum(per_tenant.values()),
+            "tenants": {t: n for t, n in sorted(per_tenant.items(), key=lambda kv: -kv[1]) if n},
+            "wait_p50_ms": round(percentile(waits, 50), 1),
+            "wait_p95_ms": round(percentile(waits, 95), 1),
+        }
+    status["bulk_held"] = _pause_bulk_for_interactive() and bool(status["interactive"]["running"])
+    return status
@@ -0,0 +1,101 @@
+# invoice_extraction_app/sdk.py
+"""
+Provider SDKs, imported on first use.
+
+`google.generativeai` (with grpc and protobuf) and `mistralai` (httpx and a
+large pydantic model tree) are a sizeable share of a worker's start-up time
+and resident memory. `api` and `mistral` also serve plain whitelisted calls
+(`search_items`, `validate_tax_calculations`, ...), so importing the SDKs at
+module level made every worker that resolves one of those pay for them.
+The pipelines get the SDKs through `load` / `genai()` / `mistral_client()`
+instead; a missing SDK becomes an ImportError on use (reported like any
+other extraction error) rather than at import.
+
+Extraction workers that would rather pay the import before their first job
+can set `preload_provider_sdks` in site_config: the `before_job` hook then
+imports the SDKs ahead of extraction jobs, so the cost stays out of the
+extraction's own timings. `benchmarks/imports.py` measures the cold import
+time and RSS of the app's modules.
+"""
+from __future__ import annotations
+
+import importlib
+from typing import Any, Dict, Optional
+
+import frappe
+
+SDKS = {
+    "genai": "google.generativeai",
+    "caching": "google.generativeai.caching",
+    "mistralai": "mistralai",
+}
+# Jobs that end up calling a provider
+EXTRACTION_JOB_PREFIXES = (
+    "invoice_extraction_app.scheduling.",
+    "invoice_extraction_app.auto_extract.",
+    "invoice_extraction_app.batch_lane.",
+    "invoice_extraction_app.telegram",
+)
+
+# Stand-ins registered by the benchmarks, by SDK name
+_overrides: Dict[str, Any] = {}
+# Import errors are remembered: a missing SDK is not looked for on every call
+_missing: Dict[str, str] = {}
+
+
+def load(name: str):
+    """The SDK module registered as `name`; ImportError when it is not installed."""
+    if name in _overrides:
+        return _overrides[name]
+
+    module = SDKS[name]
+    if module in _missing:
+        raise ImportError(_missing[module])
+    try:
+        return importlib.import_module(module)
+    except Exception as e:
+        _missing[module] = f"{module} is not available: {e}"
+        raise ImportError(_missing[module]) from e
+
+
+def available(name: str) -> bool:
+    try:
+        load(name)
+        return True
+    except ImportError:
+        return False
+
+
+def genai():
+    return load("genai")
+
+
+def caching():
+    return load("caching")
+
+
+def mistral_client(**kwargs):
+    return load("mistralai").Mistral(**kwargs)
+
+
+def override(name: str, module: Optional[Any] = None) -> None:
+    """Serve `name` from `module` instead of the installed SDK (benchmarks); None restores it."""
+    if module is None:
+        _overrides.pop(name, None)
+    else:
+        _overrides[name] = module
+
+
+# ---------------- Preload ----------------
+def preload() -> Dict[str, bool]:
+    """Import every SDK now; returns which ones are installed."""
+    return {name: available(name) for name in SDKS}
+
+
+def preload_for_job(method: Optional[str] = None) -> None:
+    """`before_job` hook: with `preload_provider_sdks` set, import the SDKs before extraction jobs."""
+    if not frappe.conf.get("preload_provider_sdks"):
+        return
+    if method and not str(method).startswith(EXTRACTION_JOB_PREFIXES):
+        return
+    preload()
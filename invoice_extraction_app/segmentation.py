@@ -0,0 +1,237 @@
+# invoice_extraction_app/segmentation.py
+"""
+Splitting PDFs that hold several invoices.
+
+Suppliers often send one PDF with a whole batch of invoices. Before a
+background extraction, `split_batch_pdf` reads the page texts (the PDF's
+own text layer when it is good, Mistral OCR markdown otherwise) and
+`find_segments` looks for invoice boundaries:
+
+  - the labelled invoice number changes ("Invoice No: ...", "رقم الفاتورة");
+  - a "Page 1 of N" marker ("Page 2 of N" always continues the previous page);
+  - the same letterhead and invoice title again, right after a page that
+    closed with totals.
+
+Each segment becomes its own Extracted Invoice (`source_invoice` /
+`source_pages` point back at the batch, which moves to status "Split") and
+is submitted to the scheduler under one tenant, so the segments extract in
+parallel up to the class's concurrency. OCR'd segment text is remembered
+per file hash, so the segments are not OCR'd a second time.
+
+A scanned PDF is only OCR'd for splitting when the extraction goes to
+Mistral anyway (the segments stay with Mistral and read the remembered
+text); on other routes it is not split. Those pages are counted as
+`split_ocr_pages` in the Extraction Log so they are costed.
+"""
+from __future__ import annotations
+
+import io
+import os
+import re
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import frappe
+from frappe.utils import cint
+
+from invoice_extraction_app.instrumentation import note, stage
+from invoice_extraction_app.pdf_text import PYPDF_AVAILABLE, usable_text_layer
+from invoice_extraction_app.scheduling import submit
+from invoice_extraction_app.settings_cache import get_settings
+from invoice_extraction_app.supplier_templates import remember_document_text
+
+if PYPDF_AVAILABLE:
+    from pypdf import PdfReader, PdfWriter
+
+INVOICE_NO_RE = re.compile(
+    r"(?:invoice\s*(?:no\.?|number|num|#)|inv\s*(?:no\.?|#)|رقم\s*الفاتورة)\s*[:#.]?\s*([A-Z0-9][A-Z0-9\-/]{2,})",
+    re.IGNORECASE,
+)
+PAGE_RE = re.compile(r"(?:page|صفحة)\s*(\d+)\s*(?:of|/|من)\s*(\d+)", re.IGNORECASE)
+TITLE_RE = re.compile(r"\binvoice\b|فاتورة", re.IGNORECASE)
+TOTAL_RE = re.compile(r"\b(?:grand\s+total|total\s+due|amount\s+due|total)\b|الإجمالي|المجموع", re.IGNORECASE)
+# Markdown emphasis and table pipes from OCR output
+MARKUP_RE = re.compile(r"[*_|#>`]+")
+HEADER_LINES = 3
+
+
+@dataclass
+class PageInfo:
+    invoice_number: Optional[str]
+    page_no: Optional[int]
+    header: Tuple[str, ...]
+    has_title: bool
+    has_total: bool
+
+
+def _inspect(text: str) -> PageInfo:
+    clean = MARKUP_RE.sub(" ", text or "")
+    lines = [re.sub(r"\s+", " ", ln).strip() for ln in clean.splitlines()]
+    lines = [ln for ln in lines if ln]
+
+    number = INVOICE_NO_RE.search(clean)
+    page = PAGE_RE.search(clean)
+    # Letterhead without the figures that change from invoice to invoice
+    header = tuple(re.sub(r"[\d\W]+", " ", ln).strip().lower() for ln in lines[:HEADER_LINES])
+
+    return PageInfo(
+        invoice_number=number.group(1).upper() if number else None,
+        page_no=int(page.group(1)) if page else None,
+        header=header,
+        has_title=any(TITLE_RE.search(ln) for ln in lines[:HEADER_LINES * 2]),
+        has_total=any(TOTAL_RE.search(ln) for ln in lines[-10:]),
+    )
+
+
+def _is_boundary(page: PageInfo, prev: PageInfo, current_number: Optional[str],
+                 segment_header: Tuple[str, ...]) -> bool:
+    if page.page_no and page.page_no > 1:
+        return False
+    if page.invoice_number and current_number:
+        return page.invoice_number != current_number
+    if page.page_no == 1:
+        return True
+    return bool(any(page.header)) and page.header == segment_header and page.has_title and prev.has_total
+
+
+def find_segments(page_texts: List[str]) -> List[Tuple[int, int]]:
+    """Invoice boundaries as (first page, end page) index pairs, end exclusive."""
+    if not page_texts:
+        return []
+
+    pages = [_inspect(t) for t in page_texts]
+    starts = [0]
+    current_number = pages[0].invoice_number
+    segment_header = pages[0].header
+    for i in range(1, len(pages)):
+        if _is_boundary(pages[i], pages[i - 1], current_number, segment_header):
+            starts.append(i)
+            current_number = pages[i].invoice_number
+            segment_header = pages[i].header
+        elif pages[i].invoice_number and not current_number:
+            current_number = pages[i].invoice_number
+
+    return list(zip(starts, starts[1:] + [len(pages)]))
+
+
+# ---------------- Splitting ----------------
+def _enabled() -> bool:
+    s = get_settings("Extraction Settings")
+    return bool(cint(s.get("split_multi_invoice_pdfs", 1))) if s else True
+
+
+def _page_texts(pdf_bytes: bytes, file_name: str, allow_ocr: bool) -> Tuple[Optional[List[str]], bool]:
+    """(page texts, True when they came from OCR); None without a text layer when OCR is not allowed."""
+    layer = usable_text_layer(pdf_bytes)
+    if layer:
+        note(text_source="Text Layer", page_count=layer.pages)
+        return layer.page_texts, False
+    if not allow_ocr:
+        return None, False
+
+    from invoice_extraction_app.mistral import ocr_page_texts
+
+    return ocr_page_texts(pdf_bytes, file_name), True
+
+
+def _create_segment(inv, reader, start: int, end: int, file_name: str,
+                    page_texts: List[str], ocr: bool) -> str:
+    writer = PdfWriter()
+    for i in range(start, end):
+        writer.add_page(reader.pages[i])
+    buf = io.BytesIO()
+    writer.write(buf)
+    content = buf.getvalue()
+
+    pages = f"{start + 1}" if end - start == 1 else f"{start + 1}-{end}"
+    stem = os.path.splitext(file_name)[0]
+    file_doc = frappe.get_doc({
+        "doctype": "File",
+        "file_name": f"{stem}_p{pages}.pdf",
+        "is_private": 1,
+        "content": content,
+    })
+    file_doc.insert(ignore_permissions=True)
+
+    seg = frappe.new_doc("Extracted Invoice")
+    seg.flags.skip_auto_extract = True
+    seg.status = "Draft"
+    seg.file_type = "pdf"
+    seg.original_file = file_doc.file_url
+    seg.source_invoice = inv.name
+    seg.source_pages = pages
+    seg.telegram_chat_id = inv.telegram_chat_id
+    seg.insert(ignore_permissions=True)
+    file_doc.db_set({"attached_to_doctype": "Extracted Invoice", "attached_to_name": seg.name})
+
+    if ocr:
+        remember_document_text(content, "\n\n".join(t for t in page_texts[start:end] if t))
+    return seg.name
+
+
+def split_batch_pdf(inv, provider: Optional[str] = None, force: bool = False,
+                    allow_ocr: bool = True) -> Optional[List[str]]:
+    """
+    Split a multi-invoice PDF into one Extracted Invoice per segment and queue them.
+
+    Returns the new invoice names, or None when the file is a single invoice
+    (or cannot be split); the caller then extracts it as usual. `force`
+    ignores the "Split Multi-Invoice PDFs" setting; without `allow_ocr` a PDF
+    with no usable text layer is not split.
+    """
+    if inv.source_invoice or not PYPDF_AVAILABLE or not (force or _enabled()):
+        return None
+    if not (inv.original_file or "").lower().endswith(".pdf"):
+        return None
+
+    from invoice_extraction_app.mistral import _read_file
+
+    pdf_bytes, _, file_name = _read_file(inv.original_file)
+    try:
+        reader = PdfReader(io.BytesIO(pdf_bytes))
+        if reader.is_encrypted or len(reader.pages) < 2:
+            return None
+    except Exception:
+        return None
+
+    page_texts, ocr = _page_texts(pdf_bytes, file_name, allow_ocr)
+    if not page_texts or len(page_texts) != len(reader.pages):
+        return None
+
+    with stage("preprocess"):
+        segments = find_segments(page_texts)
+    if len(segments) < 2:
+        if ocr:
+            # Single invoice after all: the extraction that follows reuses this OCR
+            remember_document_text(pdf_bytes, "\n\n".join(t for t in page_texts if t))
+        return None
+
+    names = [_create_segment(inv, reader, start, end, file_name, page_texts, ocr) for start, end in segments]
+    inv.db_set("status", "Split")
+
+    cls = "telegram" if inv.telegram_chat_id else "bulk"
+    # OCR'd segments stay with Mistral, which reads the remembered OCR text instead of OCR'ing again
+    provider = provider or ("Mistral" if ocr else None)
+    for name in names:
+        submit(name, cls, tenant=f"split:{inv.name}", provider=provider)
+    return names
+
+
+@frappe.whitelist()
+def split_invoice(invoice_name: str) -> dict:
+    """Form action: split a batch PDF now; the segments extract in the background."""
+    try:
+        inv = frappe.get_doc("Extracted Invoice", invoice_name)
+        inv.check_permission("write")
+        if inv.source_invoice:
+            return {"success": False, "error": f"{inv.name} is already a segment of {inv.source_invoice}"}
+
+        names = split_batch_pdf(inv, force=True)
+        if not names:
+            return {"success": False, "error": "No separate invoices found in this file"}
+        frappe.db.commit()
+        return {"success": True, "invoice": inv.name, "split_into": names}
+
+    except Exception as e:
+        frappe.log_error(frappe.get_traceback(), "Invoice Split Error")
+        return {"success": False, "error": str(e)}
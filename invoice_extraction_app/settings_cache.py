@@ -0,0 +1,113 @@
+# invoice_extraction_app/settings_cache.py
+"""
+Per-worker snapshots of the single settings doctypes.
+
+`get_settings(doctype)` returns a read-only snapshot (secrets already
+decrypted) built once per worker and reused until the shared version in
+Redis changes. Saving any of the settings doctypes bumps that version
+(`doc_events` in hooks), so every worker rebuilds on its next read; the hot
+path costs one Redis GET (request-cached) and no database queries.
+
+Code that edits settings (webhook setup, forms) keeps using the Document.
+Writes that bypass `on_update` (`frappe.db.set_single_value`) must call
+`bump_settings_version()` themselves.
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, Optional, Tuple
+
+import frappe
+
+SETTINGS_DOCTYPES = ("Gemini Settings", "Mistral Settings", "Telegram Settings", "Extraction Settings")
+SETTINGS_VERSION_KEY = "invoice_extraction:settings_version"
+
+# Secrets stored in Data fields; Password fields are picked up from the meta
+SECRET_FIELDS = {
+    "Gemini Settings": ("gemini_api_key",),
+    "Mistral Settings": ("mistral_api_key",),
+    "Telegram Settings": ("bot_token",),
+}
+
+# (site, doctype) -> (version, snapshot or None when the single was never saved)
+_snapshots: Dict[Tuple[str, str], Tuple[str, Optional["SettingsSnapshot"]]] = {}
+
+
+class SettingsSnapshot:
+    """Immutable attribute view of a settings doc; mirrors the Document read API we use."""
+
+    __slots__ = ("doctype", "_values", "_secrets")
+
+    def __init__(self, doctype: str, values: Dict[str, Any], secrets: Dict[str, Optional[str]]):
+        object.__setattr__(self, "doctype", doctype)
+        object.__setattr__(self, "_values", values)
+        object.__setattr__(self, "_secrets", secrets)
+
+    def __getattr__(self, name: str):
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError(f"{self.doctype} has no field {name}") from None
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{self.doctype} snapshot is read-only")
+
+    def get(self, name: str, default=None):
+        value = self._values.get(name)
+        return default if value is None else value
+
+    def get_password(self, fieldname: str, raise_exception: bool = True) -> Optional[str]:
+        return self._secrets.get(fieldname) or self._values.get(fieldname)
+
+
+def _current_version() -> str:
+    version = frappe.cache().get_value(SETTINGS_VERSION_KEY)
+    if version is None:
+        version = bump_settings_version()
+    return version
+
+
+def bump_settings_version(doc=None, method=None) -> str:
+    """doc_events hook: invalidate every worker's snapshots."""
+    if doc is not None:
+        # on_update runs before commit: bump again once the new values are visible
+        frappe.db.after_commit.add(bump_settings_version)
+    version = frappe.generate_hash(length=12)
+    frappe.cache().set_value(SETTINGS_VERSION_KEY, version)
+    return version
+
+
+def _build(doctype: str) -> Optional[SettingsSnapshot]:
+    if not frappe.db.exists(doctype, doctype):
+        return None
+
+    doc = frappe.get_single(doctype)
+    values = {}
+    for key, value in doc.as_dict(no_default_fields=True).items():
+        if isinstance(value, list):
+            # Child tables: tuples of plain dict rows (`row.provider` keeps working)
+            value = tuple(frappe._dict(row) for row in value)
+        values[key] = value
+
+    secret_fields = set(SECRET_FIELDS.get(doctype, ()))
+    secret_fields.update(df.fieldname for df in doc.meta.fields if df.fieldtype == "Password")
+    secrets = {}
+    for fieldname in secret_fields:
+        try:
+            secrets[fieldname] = doc.get_password(fieldname, raise_exception=False)
+        except Exception:
+            secrets[fieldname] = None
+
+    return SettingsSnapshot(doctype, values, secrets)
+
+
+def get_settings(doctype: str) -> Optional[SettingsSnapshot]:
+    """Snapshot of a settings single, or None when it does not exist."""
+    version = _current_version()
+    key = (frappe.local.site, doctype)
+    cached = _snapshots.get(key)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    snapshot = _build(doctype)
+    _snapshots[key] = (version, snapshot)
+    return snapshot
@@ -0,0 +1,604 @@
+# invoice_extraction_app/supplier_templates.py
+"""
+Supplier invoice templates: deterministic extraction for repeat layouts.
+
+For each supplier with confirmed Extracted Invoices (status Mapped or
+Converted) we learn, from the document text of a few samples:
+
+  - a fingerprint: lines that recur on every invoice of that supplier,
+  - header anchors: the label printed before (or above) each header value,
+  - the item table: its header line and which cell (counted from the right)
+    holds quantity, unit price, line total and tax.
+
+Incoming text (PDF text layer or OCR output) is matched against the
+fingerprints and read with the best template. The result is used only when
+every learned field was found and the totals add up; otherwise the pipeline
+falls through to the LLM as before.
+
+Scanned invoices can be learned from once Mistral has OCR'd them: the OCR
+text is kept in Redis per file hash for `TEXT_CACHE_TTL`.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import re
+import unicodedata
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import frappe
+from frappe.utils import cint, flt, getdate, now
+
+from invoice_extraction_app.instrumentation import note, stage
+from invoice_extraction_app.settings_cache import get_settings
+
+LEARN_STATUSES = ("Mapped", "Converted")
+MIN_SAMPLES = 2
+MAX_SAMPLES = 5
+FINGERPRINT_SHARE = 0.8
+FINGERPRINT_MAX_LINES = 40
+MIN_FINGERPRINT_MATCH = 0.7
+ANCHOR_SHARE = 0.6
+REPRODUCE_SHARE = 0.8
+TOLERANCE = 0.05
+
+TEXT_CACHE_KEY = "invoice_extraction:doc_text:{}"
+TEXT_CACHE_TTL = 14 * 24 * 3600
+TEMPLATES_CACHE_KEY = "invoice_extraction:supplier_templates"
+
+HEADER_FIELDS = {
+    "invoice_number": "text",
+    "invoice_date": "date",
+    "due_date": "date",
+    "subtotal": "amount",
+    "tax_amount": "amount",
+    "total_amount": "amount",
+}
+ITEM_COLUMNS = ("item_total", "unit_price", "quantity", "tax_amount")
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%m/%d/%Y", "%Y/%m/%d", "%d %b %Y", "%d %B %Y")
+
+DIGITS = str.maketrans("٠١٢٣٤٥٦٧٨٩٫٬", "0123456789.,")
+CELL_SPLIT = re.compile(r"\s{2,}|\t")
+NUMBER_RE = re.compile(r"-?\d[\d,]*(?:\.\d+)?")
+VALUE_PREFIX_RE = re.compile(r"^[\s:：#=\-|*]*(?:[A-Za-z؀-ۿ$€£]{1,4}\.?\s*)?")
+CURRENCY_SUFFIX_RE = re.compile(r"(?:\b[A-Z]{3}|[$€£])\.?\s*$")
+LABEL_STRIP = " \t:：#=-.*|"
+
+
+# ---------------- Text helpers ----------------
+def normalize_text(text: str) -> str:
+    return unicodedata.normalize("NFKC", text or "").translate(DIGITS)
+
+
+def _lines(text: str) -> List[str]:
+    return [line.rstrip() for line in normalize_text(text).splitlines() if line.strip()]
+
+
+def _key(line: str) -> str:
+    return " ".join(line.lower().split())
+
+
+def _cells(line: str) -> List[str]:
+    stripped = line.strip()
+    # Mistral OCR returns tables as markdown
+    if stripped.startswith("|"):
+        return [c.strip() for c in stripped.strip("|").split("|") if c.strip()]
+    return [c.strip() for c in CELL_SPLIT.split(stripped) if c.strip()]
+
+
+def _amount(s: str) -> Optional[float]:
+    m = NUMBER_RE.fullmatch((s or "").strip().strip("*"))
+    if not m:
+        return None
+    try:
+        return float(m.group(0).replace(",", ""))
+    except ValueError:
+        return None
+
+
+def _close(a: float, b: float) -> bool:
+    return abs(flt(a) - flt(b)) <= max(TOLERANCE, abs(flt(b)) * 0.005)
+
+
+def _label_pattern(label: str):
+    words = r"\s+".join(re.escape(w) for w in label.split())
+    return re.compile(r"(?<!\w)" + words + r"(?!\w)", re.I)
+
+
+def _clean_label(s: str) -> str:
+    label = _key(s.strip(LABEL_STRIP))
+    if not label or len(label) > 40 or not any(ch.isalpha() for ch in label):
+        return ""
+    return label
+
+
+# ---------------- Learning ----------------
+def _representations(kind: str, value) -> List[Tuple[str, Optional[str]]]:
+    if kind == "amount":
+        v = flt(value)
+        reps = [f"{v:,.2f}", f"{v:.2f}"]
+        if v == int(v):
+            reps += [f"{int(v):,}", str(int(v))]
+        return [(r, None) for r in dict.fromkeys(reps)]
+    if kind == "date":
+        d = getdate(value)
+        return [(d.strftime(fmt), fmt) for fmt in DATE_FORMATS]
+    return [(str(value).strip(), None)]
+
+
+def _find_value(lines: List[str], kind: str, value) -> List[Tuple[int, int, Optional[str]]]:
+    """(line index, start offset, date format) of every occurrence of a known value."""
+    hits = []
+    for rep, fmt in _representations(kind, value):
+        if not rep:
+            continue
+        boundary = r"(?<![\w.,])" if kind != "text" else r"(?<!\w)"
+        pat = re.compile(boundary + re.escape(rep) + r"(?![\w])", re.I)
+        for i, line in enumerate(lines):
+            for m in pat.finditer(line):
+                hits.append((i, m.start(), fmt))
+    return hits
+
+
+def _label_for(lines: List[str], idx: int, start: int) -> Tuple[str, str]:
+    # "Total: SAR 1,150.00" is labelled "total", not by its currency code
+    before = CURRENCY_SUFFIX_RE.sub("", lines[idx][:start])
+    if before.strip():
+        cells = _cells(before) or [before]
+        label = _clean_label(cells[-1])
+        return (label, "inline") if label else ("", "")
+    if idx > 0 and not NUMBER_RE.search(lines[idx - 1]):
+        label = _clean_label(lines[idx - 1])
+        if label:
+            return label, "below"
+    return "", ""
+
+
+def _learn_anchor(samples: List[dict], field: str, kind: str) -> Optional[dict]:
+    votes = Counter()
+    present = 0
+    for s in samples:
+        value = s["header"].get(field)
+        if not value:
+            continue
+        present += 1
+        seen = set()
+        for idx, start, fmt in _find_value(s["lines"], kind, value):
+            label, position = _label_for(s["lines"], idx, start)
+            if label:
+                seen.add((label, position, fmt))
+        votes.update(seen)
+
+    if not votes or present < MIN_SAMPLES:
+        return None
+    (label, position, fmt), n = votes.most_common(1)[0]
+    if n < math.ceil(present * ANCHOR_SHARE):
+        return None
+    return {"label": label, "position": position, "format": fmt, "kind": kind}
+
+
+def _map_cells(cells: List[str], item: dict) -> Optional[Dict[str, int]]:
+    """Column -> negative cell index for one item row, or None if it is not that row."""
+    if len(cells) < 3 or _amount(cells[0]) is not None:
+        return None
+
+    numeric = {j - len(cells): _amount(c) for j, c in enumerate(cells)}
+    used, mapping = set(), {}
+    for col in ITEM_COLUMNS:
+        value = item.get(col)
+        if not value:
+            continue
+        # Rightmost unused matching cell: totals sit to the right of rates and quantities
+        for j in sorted(numeric, reverse=True):
+            if j not in used and numeric[j] is not None and _close(numeric[j], value):
+                mapping[col] = j
+                used.add(j)
+                break
+
+    if "item_total" not in mapping or "quantity" not in mapping:
+        return None
+    return mapping
+
+
+def _learn_table(samples: List[dict]) -> Optional[dict]:
+    layouts, headers = Counter(), Counter()
+    for s in samples:
+        lines, first_row = s["lines"], None
+        for item in s["items"]:
+            for idx, line in enumerate(lines):
+                mapping = _map_cells(_cells(line), item)
+                if mapping:
+                    layouts[tuple(sorted(mapping.items()))] += 1
+                    first_row = idx if first_row is None else min(first_row, idx)
+                    break
+        # Header = nearest line above the first row with text (skips markdown |---| rules)
+        header_idx = (first_row or 0) - 1
+        while header_idx >= 0 and not any(ch.isalpha() for ch in lines[header_idx]):
+            header_idx -= 1
+        if header_idx >= 0:
+            headers[_key(lines[header_idx])] += 1
+
+    if not layouts or not headers:
+        return None
+    columns, _n = layouts.most_common(1)[0]
+    header, n = headers.most_common(1)[0]
+    if n < math.ceil(len(samples) * ANCHOR_SHARE):
+        return None
+    return {"header": header, "columns": dict(columns)}
+
+
+def _learn_fingerprint(samples: List[dict]) -> List[str]:
+    counts = Counter()
+    for s in samples:
+        counts.update({_key(line) for line in s["lines"]})
+    need = math.ceil(len(samples) * FINGERPRINT_SHARE)
+    lines = [k for k, n in counts.items() if n >= need and len(k) >= 4 and any(ch.isalpha() for ch in k)]
+    # Longer lines (names, addresses, registration numbers) are the most distinctive
+    return sorted(lines, key=len, reverse=True)[:FINGERPRINT_MAX_LINES]
+
+
+def build_template(samples: List[dict]) -> Optional[dict]:
+    table = _learn_table(samples)
+    if not table:
+        return None
+
+    anchors = {}
+    for field, kind in HEADER_FIELDS.items():
+        anchor = _learn_anchor(samples, field, kind)
+        if anchor:
+            anchors[field] = anchor
+    if "invoice_number" not in anchors or "total_amount" not in anchors:
+        return None
+
+    return {
+        "fingerprint": _learn_fingerprint(samples),
+        "anchors": anchors,
+        "table": table,
+    }
+
+
+# ---------------- Reading ----------------
+def _parse_value(text: str, anchor: dict):
+    kind = anchor["kind"]
+    if kind == "text":
+        token = text.strip(LABEL_STRIP).split()
+        return token[0].strip(LABEL_STRIP) if token else None
+
+    text = VALUE_PREFIX_RE.sub("", text, count=1)
+    if kind == "amount":
+        m = NUMBER_RE.match(text)
+        return _amount(m.group(0)) if m else None
+
+    tokens = text.split()
+    fmt = anchor.get("format") or "%Y-%m-%d"
+    width = len(fmt.split())
+    try:
+        return datetime.strptime(" ".join(tokens[:width]).strip(LABEL_STRIP), fmt).date()
+    except (ValueError, IndexError):
+        return None
+
+
+def _read_anchor(lines: List[str], anchor: dict):
+    pat = _label_pattern(anchor["label"])
+    for i, line in enumerate(lines):
+        m = pat.search(line)
+        if not m:
+            continue
+        if anchor["position"] == "inline":
+            value = _parse_value(line[m.end():], anchor)
+        elif i + 1 < len(lines):
+            value = next((v for v in (_parse_value(c, anchor) for c in _cells(lines[i + 1])) if v), None)
+        else:
+            value = None
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def _read_table(lines: List[str], table: dict, stop_labels: List[str]) -> List[dict]:
+    header = table["header"]
+    start = next((i for i, line in enumerate(lines) if _key(line) == header), None)
+    if start is None:
+        return []
+
+    columns = {k: int(v) for k, v in table["columns"].items()}
+    width = max(-j for j in columns.values())
+    stops = [_label_pattern(label) for label in stop_labels]
+
+    items, misses = [], 0
+    for line in lines[start + 1:]:
+        if items and any(p.search(line) for p in stops):
+            break
+        cells = _cells(line)
+        values = {col: _amount(cells[j]) if len(cells) > width else None for col, j in columns.items()}
+        description = " ".join(cells[:len(cells) - width]) if len(cells) > width else ""
+
+        if description and any(ch.isalpha() for ch in description) and all(v is not None for v in values.values()):
+            items.append({"description": description, **values})
+            misses = 0
+        elif items:
+            misses += 1
+            if misses >= 3:
+                break
+    return items
+
+
+def _totals_ok(data: dict) -> bool:
+    items = data["items"]
+    for it in items:
+        if not _close(it["quantity"] * it["unit_price"], it["item_total"]):
+            return False
+    items_total = sum(it["item_total"] for it in items)
+    if not _close(items_total, data["subtotal"]):
+        return False
+    return _close(data["subtotal"] + data["tax_amount"], data["total_amount"])
+
+
+def apply_template(tpl: dict, text: str) -> Optional[dict]:
+    lines = _lines(text)
+    anchors = tpl["anchors"]
+    header = {field: _read_anchor(lines, anchor) for field, anchor in anchors.items()}
+
+    stop_labels = [anchors[f]["label"] for f in ("subtotal", "tax_amount", "total_amount") if f in anchors]
+    items = _read_table(lines, tpl["table"], stop_labels)
+
+    found = sum(1 for v in header.values() if v not in (None, "")) + (1 if items else 0)
+    confidence = found / (len(anchors) + 1)
+    if confidence * 100 < flt(tpl.get("min_confidence") or 100):
+        return None
+
+    for it in items:
+        it.setdefault("unit_price", it["item_total"] / it["quantity"] if it["quantity"] else 0.0)
+        it["tax_amount"] = round(flt(it.get("tax_amount")), 2)
+        it["total_with_tax"] = round(it["item_total"] + it["tax_amount"], 2)
+
+    subtotal = header.get("subtotal")
+    tax = header.get("tax_amount")
+    if tax is None:
+        tax = sum(it["tax_amount"] for it in items)
+    data = {
+        "supplier": tpl.get("supplier_name") or tpl["name"],
+        "invoice_number": header.get("invoice_number") or "",
+        "date": str(header["invoice_date"]) if header.get("invoice_date") else "",
+        "due_date": str(header["due_date"]) if header.get("due_date") else "",
+        "subtotal": round(subtotal if subtotal is not None else sum(it["item_total"] for it in items), 2),
+        "tax_amount": round(tax, 2),
+        "total_amount": round(header.get("total_amount") or 0.0, 2),
+        "currency": tpl.get("currency") or "",
+        "items": items,
+        "extraction_template": tpl["name"],
+        "template_confidence": round(confidence, 3),
+    }
+    return data if _totals_ok(data) else None
+
+
+# ---------------- Matching ----------------
+def _load_templates() -> List[dict]:
+    cached = frappe.cache().get_value(TEMPLATES_CACHE_KEY)
+    if cached is not None:
+        return cached
+
+    templates = []
+    for t in frappe.get_all(
+        "Supplier Invoice Template",
+        filters={"enabled": 1},
+        fields=["name", "supplier_name", "currency", "fingerprint", "anchors", "table_layout", "min_confidence"],
+    ):
+        try:
+            templates.append({
+                "name": t.name,
+                "supplier_name": t.supplier_name,
+                "currency": t.currency,
+                "fingerprint": [line for line in (t.fingerprint or "").splitlines() if line.strip()],
+                "anchors": json.loads(t.anchors or "{}"),
+                "table": json.loads(t.table_layout or "{}"),
+                "min_confidence": t.min_confidence,
+            })
+        except ValueError:
+            continue
+    frappe.cache().set_value(TEMPLATES_CACHE_KEY, templates)
+    return templates
+
+
+def clear_template_cache() -> None:
+    frappe.cache().delete_value(TEMPLATES_CACHE_KEY)
+
+
+def match_template(text: str) -> Optional[Tuple[dict, float]]:
+    keys = {_key(line) for line in _lines(text)}
+    best = None
+    for tpl in _load_templates():
+        fp = tpl["fingerprint"]
+        if not fp or not tpl["table"]:
+            continue
+        score = sum(1 for line in fp if line in keys) / len(fp)
+        if score >= MIN_FINGERPRINT_MATCH and (not best or score > best[1]):
+            best = (tpl, score)
+    return best
+
+
+def _enabled() -> bool:
+    s = get_settings("Extraction Settings")
+    return bool(cint(getattr(s, "use_supplier_templates", 1))) if s else True
+
+
+def extract_with_template(text: str) -> Optional[dict]:
+    """Template extraction for known layouts; None means "use the LLM"."""
+    if not text or not _enabled():
+        return None
+
+    with stage("parse"):
+        matched = match_template(text)
+        if not matched:
+            return None
+        tpl, _score = matched
+        data = apply_template(tpl, text)
+
+    frappe.db.sql(
+        f"""UPDATE `tabSupplier Invoice Template`
+        SET {"hits = hits + 1" if data else "fallbacks = fallbacks + 1"}
+        WHERE name = %s""",
+        tpl["name"],
+    )
+    if data:
+        note(model=f"Template: {tpl['name']}", item_count=len(data["items"]))
+    return data
+
+
+# ---------------- Document text ----------------
+def _text_key(file_bytes: bytes) -> str:
+    return TEXT_CACHE_KEY.format(hashlib.sha256(file_bytes).hexdigest())
+
+
+def remember_document_text(file_bytes: bytes, text: str) -> None:
+    """Keep OCR output so scanned invoices can be learned from once confirmed."""
+    if text:
+        frappe.cache().set_value(_text_key(file_bytes), text, expires_in_sec=TEXT_CACHE_TTL)
+
+
+def remembered_document_text(file_bytes: bytes) -> Optional[str]:
+    return frappe.cache().get_value(_text_key(file_bytes))
+
+
+def document_text(file_url: str) -> Optional[str]:
+    from invoice_extraction_app.pdf_text import usable_text_layer
+
+    try:
+        file_doc = frappe.get_doc("File", {"file_url": file_url})
+        with open(file_doc.get_full_path(), "rb") as f:
+            content = f.read()
+    except Exception:
+        return None
+
+    if file_url.lower().endswith(".pdf"):
+        layer = usable_text_layer(content)
+        if layer:
+            return layer.text
+    return remembered_document_text(content)
+
+
+def _sample(row) -> Optional[dict]:
+    text = document_text(row.original_file)
+    if not text:
+        return None
+
+    items = frappe.get_all(
+        "Extracted Invoice Item",
+        filters={"parent": row.name, "parenttype": "Extracted Invoice"},
+        fields=["quantity", "rate", "amount", "tax_amount"],
+        order_by="idx asc",
+    )
+    return {
+        "name": row.name,
+        "text": text,
+        "lines": _lines(text),
+        "header": {field: row.get(field) for field in HEADER_FIELDS},
+        "items": [
+            {
+                "quantity": flt(it.quantity),
+                "unit_price": flt(it.rate),
+                "item_total": flt(it.amount),
+                "tax_amount": flt(it.tax_amount),
+            }
+            for it in items
+        ],
+    }
+
+
+def _reproduces(tpl: dict, sample: dict) -> bool:
+    data = apply_template(tpl, sample["text"])
+    return bool(
+        data
+        and str(data["invoice_number"]).lower() == str(sample["header"]["invoice_number"] or "").strip().lower()
+        and _close(data["total_amount"], sample["header"]["total_amount"])
+        and len(data["items"]) == len(sample["items"])
+    )
+
+
+def learn_supplier(supplier: str) -> Optional[str]:
+    """(Re)build the supplier's template from its latest confirmed invoices."""
+    rows = frappe.get_all(
+        "Extracted Invoice",
+        filters={"supplier_link": supplier, "status": ["in", LEARN_STATUSES], "original_file": ["is", "set"]},
+        fields=["name", "original_file", "currency", "supplier_name"] + list(HEADER_FIELDS),
+        order_by="modified desc",
+        limit_page_length=MAX_SAMPLES * 3,
+    )
+
+    samples = []
+    for row in rows:
+        sample = _sample(row)
+        if sample:
+            samples.append(sample)
+        if len(samples) >= MAX_SAMPLES:
+            break
+    if len(samples) < MIN_SAMPLES:
+        return None
+
+    learned = build_template(samples)
+    if not learned:
+        return None
+
+    exists = frappe.db.exists("Supplier Invoice Template", supplier)
+    doc = frappe.get_doc("Supplier Invoice Template", supplier) if exists else frappe.new_doc("Supplier Invoice Template")
+    currency = Counter(r.currency for r in rows if r.currency).most_common(1)
+    tpl = {
+        "name": supplier,
+        "supplier_name": frappe.db.get_value("Supplier", supplier, "supplier_name") or rows[0].supplier_name,
+        "currency": currency[0][0] if currency else None,
+        "min_confidence": doc.min_confidence or 100,
+        **learned,
+    }
+
+    # Only keep templates that read their own samples back correctly
+    reproduced = sum(1 for s in samples if _reproduces(tpl, s))
+    if reproduced < math.ceil(len(samples) * REPRODUCE_SHARE):
+        return None
+
+    doc.update({
+        "supplier": supplier,
+        "currency": tpl["currency"],
+        "fingerprint": "\n".join(learned["fingerprint"]),
+        "anchors": json.dumps(learned["anchors"], ensure_ascii=False, indent=1),
+        "table_layout": json.dumps(learned["table"], ensure_ascii=False, indent=1),
+        "samples": len(samples),
+        "source_invoices": "\n".join(s["name"] for s in samples),
+        "last_learned": now(),
+    })
+    doc.save(ignore_permissions=True)
+    frappe.db.commit()
+    return doc.name
+
+
+def enqueue_learning(supplier: str) -> None:
+    if not supplier or not _enabled():
+        return
+    frappe.enqueue(
+        "invoice_extraction_app.supplier_templates.learn_supplier",
+        queue="long",
+        job_id=f"learn_supplier_template::{supplier}",
+        deduplicate=True,
+        enqueue_after_commit=True,
+        supplier=supplier,
+    )
+
+
+@frappe.whitelist()
+def relearn_supplier_template(supplier: str) -> dict:
+    """Rebuild one supplier's template now (form button)."""
+    try:
+        frappe.has_permission("Supplier Invoice Template", "write", throw=True)
+        name = learn_supplier(supplier)
+        if not name:
+            return {
+                "success": False,
+                "error": f"Not enough confirmed invoices with readable text (need {MIN_SAMPLES}), "
+                         "or the learned layout did not reproduce them",
+            }
+        return {"success": True, "template": name}
+    except Exception as e:
+        frappe.log_error(frappe.get_traceback(), "Supplier Template Learning Error")
+        return {"success": False, "error": str(e)}
@@ -0,0 +1,257 @@
+# invoice_extraction_app/tax_audit.py
+"""
+Set-based tax consistency audit for Extracted Invoices.
+
+`api.validate_tax_calculations` / `api.fix_tax_calculation` load one document
+and loop over its items in Python. The helpers here compute the same sums
+(subtotal = SUM(quantity * rate), tax = SUM(tax_amount)) with one aggregated
+query over `tabExtracted Invoice Item`, so the whole backlog can be audited
+and fixed without loading a single document.
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import frappe
+from frappe.utils import cint, flt, now
+
+TOLERANCE = 0.01
+DEFAULT_PAGE_LENGTH = 500
+FIX_BATCH_SIZE = 1000
+
+
+# ---------------- Query helpers ----------------
+def _parse_filters(filters) -> frappe._dict:
+    if isinstance(filters, str):
+        filters = frappe.parse_json(filters)
+    return frappe._dict(filters or {})
+
+
+def _build_conditions(filters: frappe._dict) -> Tuple[str, Dict[str, Any]]:
+    conditions = ["1=1"]
+    values: Dict[str, Any] = {}
+
+    if filters.get("status"):
+        conditions.append("ei.status = %(status)s")
+        values["status"] = filters.status
+    if filters.get("supplier"):
+        conditions.append("ei.supplier_link = %(supplier)s")
+        values["supplier"] = filters.supplier
+    if filters.get("from_date"):
+        conditions.append("ei.invoice_date >= %(from_date)s")
+        values["from_date"] = filters.from_date
+    if filters.get("to_date"):
+        conditions.append("ei.invoice_date <= %(to_date)s")
+        values["to_date"] = filters.to_date
+    if filters.get("after_name"):
+        conditions.append("ei.name > %(after_name)s")
+        values["after_name"] = filters.after_name
+
+    return " AND ".join(conditions), values
+
+
+def _mismatch_having() -> str:
+    return f"""
+        ABS(items_subtotal - extracted_subtotal) >= {TOLERANCE}
+        OR ABS(items_tax - extracted_tax) >= {TOLERANCE}
+        OR ABS(items_subtotal + items_tax - extracted_total) >= {TOLERANCE}
+    """
+
+
+def _aggregated_query(filters: frappe._dict, only_mismatched: bool) -> Tuple[str, Dict[str, Any]]:
+    """One GROUP BY over the item table, joined to the invoice headers."""
+    conditions, values = _build_conditions(filters)
+    having = f"HAVING {_mismatch_having()}" if only_mismatched else ""
+
+    query = f"""
+        SELECT
+            ei.name,
+            ei.status,
+            ei.supplier_link,
+            ei.supplier_name,
+            ei.invoice_number,
+            ei.invoice_date,
+            COALESCE(ei.subtotal, 0) AS extracted_subtotal,
+            COALESCE(ei.tax_amount, 0) AS extracted_tax,
+            COALESCE(ei.total_amount, 0) AS extracted_total,
+            COUNT(it.name) AS item_count,
+            ROUND(COALESCE(SUM(it.quantity * it.rate), 0), 2) AS items_subtotal,
+            ROUND(COALESCE(SUM(it.tax_amount), 0), 2) AS items_tax
+        FROM `tabExtracted Invoice` ei
+        LEFT JOIN `tabExtracted Invoice Item` it
+            ON it.parent = ei.name
+            AND it.parenttype = 'Extracted Invoice'
+            AND it.parentfield = 'items'
+        WHERE {conditions}
+        GROUP BY ei.name
+        {having}
+    """
+    return query, values
+
+
+def _decorate(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Add the same match flags / differences validate_tax_calculations returns."""
+    items_subtotal = flt(row.get("items_subtotal"), 2)
+    items_tax = flt(row.get("items_tax"), 2)
+    items_total = flt(items_subtotal + items_tax, 2)
+
+    extracted_subtotal = flt(row.get("extracted_subtotal"))
+    extracted_tax = flt(row.get("extracted_tax"))
+    extracted_total = flt(row.get("extracted_total"))
+
+    row["items_total"] = items_total
+    row["subtotal_diff"] = flt(items_subtotal - extracted_subtotal, 2)
+    row["tax_diff"] = flt(items_tax - extracted_tax, 2)
+    row["total_diff"] = flt(items_total - extracted_total, 2)
+    row["subtotal_match"] = abs(row["subtotal_diff"]) < TOLERANCE
+    row["tax_match"] = abs(row["tax_diff"]) < TOLERANCE
+    row["total_match"] = abs(row["total_diff"]) < TOLERANCE
+    row["all_match"] = row["subtotal_match"] and row["tax_match"] and row["total_match"]
+    row["tax_rate_percentage"] = flt(extracted_tax / extracted_subtotal * 100, 2) if extracted_subtotal > 0 else 0
+    return row
+
+
+def get_tax_audit_rows(filters=None, only_mismatched: bool = True,
+                       limit: Optional[int] = DEFAULT_PAGE_LENGTH, start: int = 0) -> List[Dict[str, Any]]:
+    filters = _parse_filters(filters)
+    query, values = _aggregated_query(filters, only_mismatched)
+    query += " ORDER BY ei.name"
+    if limit:
+        query += f" LIMIT {cint(limit)} OFFSET {cint(start)}"
+
+    rows = frappe.db.sql(query, values, as_dict=True)
+    return [_decorate(r) for r in rows]
+
+
+def get_tax_audit_summary(filters=None) -> Dict[str, Any]:
+    filters = _parse_filters(filters)
+    query, values = _aggregated_query(filters, only_mismatched=False)
+
+    summary = frappe.db.sql(
+        f"""
+        SELECT
+            COUNT(*) AS invoices,
+            SUM(CASE WHEN ABS(items_subtotal - extracted_subtotal) >= {TOLERANCE} THEN 1 ELSE 0 END) AS subtotal_mismatches,
+            SUM(CASE WHEN ABS(items_tax - extracted_tax) >= {TOLERANCE} THEN 1 ELSE 0 END) AS tax_mismatches,
+            SUM(CASE WHEN ABS(items_subtotal + items_tax - extracted_total) >= {TOLERANCE} THEN 1 ELSE 0 END) AS total_mismatches,
+            SUM(CASE WHEN {_mismatch_having()} THEN 1 ELSE 0 END) AS mismatched_invoices
+        FROM ({query}) audit
+        """,
+        values,
+        as_dict=True,
+    )
+    out = summary[0] if summary else {}
+    return {k: cint(v) for k, v in out.items()}
+
+
+# ---------------- Public API ----------------
+@frappe.whitelist()
+def get_tax_audit(filters=None, only_mismatched: int = 1, limit: int = DEFAULT_PAGE_LENGTH, start: int = 0) -> dict:
+    """
+    Audit tax consistency across all Extracted Invoices.
+
+    filters: {"status", "supplier", "from_date", "to_date"} (all optional)
+    """
+    try:
+        frappe.has_permission("Extracted Invoice", "read", throw=True)
+        return {
+            "success": True,
+            "summary": get_tax_audit_summary(filters),
+            "rows": get_tax_audit_rows(filters, bool(cint(only_mismatched)), cint(limit), cint(start)),
+        }
+    except Exception as e:
+        frappe.log_error(f"Tax audit error: {str(e)}")
+        return {"success": False, "error": str(e)}
+
+
+@frappe.whitelist()
+def bulk_fix_tax_calculations(filters=None, batch_size: int = FIX_BATCH_SIZE) -> dict:
+    """Enqueue a background job that fixes every mismatched header matching `filters`."""
+    try:
+        frappe.has_permission("Extracted Invoice", "write", throw=True)
+        filters = _parse_filters(filters)
+        job = frappe.enqueue(
+            "invoice_extraction_app.tax_audit.run_bulk_tax_fix",
+            queue="long",
+            timeout=3600,
+            job_name="bulk_fix_tax_calculations",
+            filters=dict(filters),
+            batch_size=cint(batch_size) or FIX_BATCH_SIZE,
+            user=frappe.session.user,
+        )
+        return {"success": True, "job_id": getattr(job, "id", None)}
+    except Exception as e:
+        frappe.log_error(f"Bulk tax fix enqueue error: {str(e)}")
+        return {"success": False, "error": str(e)}
+
+
+def run_bulk_tax_fix(filters=None, batch_size: int = FIX_BATCH_SIZE, user: Optional[str] = None) -> dict:
+    """
+    Rewrite subtotal / tax_amount / total_amount / tax_rate from the item sums,
+    one UPDATE ... JOIN per batch, committing after each batch.
+
+    Converted invoices are skipped unless explicitly requested through the
+    status filter, and invoices without items are left alone (there is
+    nothing to recompute from).
+    """
+    filters = _parse_filters(filters)
+    batch_size = cint(batch_size) or FIX_BATCH_SIZE
+    fixed = 0
+    last_name = None
+
+    while True:
+        page_filters = frappe._dict(filters)
+        if last_name:
+            page_filters.after_name = last_name
+
+        rows = get_tax_audit_rows(page_filters, only_mismatched=True, limit=batch_size)
+        if not rows:
+            break
+        last_name = rows[-1]["name"]
+
+        names = [
+            r["name"]
+            for r in rows
+            if r["item_count"] and (r["status"] != "Converted" or filters.get("status") == "Converted")
+        ]
+        if names:
+            _fix_batch(names, user or frappe.session.user)
+            frappe.db.commit()
+            fixed += len(names)
+
+        if len(rows) < batch_size:
+            break
+
+    frappe.logger().info(f"[Tax Audit] bulk fix updated {fixed} invoices")
+    return {"fixed": fixed}
+
+
+def _fix_batch(names: List[str], user: str) -> None:
+    frappe.db.sql(
+        """
+        UPDATE `tabExtracted Invoice` ei
+        JOIN (
+            SELECT
+                parent,
+                ROUND(COALESCE(SUM(quantity * rate), 0), 2) AS items_subtotal,
+                ROUND(COALESCE(SUM(tax_amount), 0), 2) AS items_tax
+            FROM `tabExtracted Invoice Item`
+            WHERE parenttype = 'Extracted Invoice'
+                AND parentfield = 'items'
+                AND parent IN %(names)s
+            GROUP BY parent
+        ) agg ON agg.parent = ei.name
+        SET
+            ei.subtotal = agg.items_subtotal,
+            ei.tax_amount = agg.items_tax,
+            ei.total_amount = ROUND(agg.items_subtotal + agg.items_tax, 2),
+            ei.tax_rate = CASE
+                WHEN agg.items_subtotal > 0 THEN agg.items_tax / agg.items_subtotal * 100
+                ELSE ei.tax_rate
+            END,
+            ei.modified = %(modified)s,
+            ei.modified_by = %(user)s
+        WHERE ei.name IN %(names)s
+        """,
+        {"names": tuple(names), "modified": now(), "user": user},
+    )
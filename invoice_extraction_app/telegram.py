@@ -27,9 +27,22 @@ import mimetypes
 from typing import Any, Dict, Optional, Tuple
 
 import frappe
-import requests
 from frappe.model.naming import make_autoname
 
+from invoice_extraction_app import telegram_http
+from invoice_extraction_app.scheduling import submit
+from invoice_extraction_app.settings_cache import get_settings
+from invoice_extraction_app.utils import (
+    FileTooLarge,
+    claim_telegram_update,
+    discard_private_file,
+    release_telegram_update,
+    stream_to_private_file,
+    telegram_message_key,
+)
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
 
 def _get_telegram_settings():
     """Read Telegram settings from single DocType 'Telegram Settings'."""
@@ -48,8 +61,8 @@ def _get_chat_id(message: Dict[str, Any]) -> Optional[int]:
 
 
 def _telegram_get_file(bot_token: str, file_id: str) -> Dict[str, Any]:
-    url = f"https://api.telegram.org/bot{bot_token}/getFile"
-    resp = requests.get(url, params={"file_id": file_id}, timeout=30)
+    url = telegram_http.bot_url(bot_token, "getFile")
+    resp = telegram_http.get(url, params={"file_id": file_id}, timeout=30)
     resp.raise_for_status()
     data = resp.json()
     if not data.get("ok"):
@@ -57,11 +70,17 @@ def _telegram_get_file(bot_token: str, file_id: str) -> Dict[str, Any]:
     return data["result"]
 
 
-def _telegram_download_file(bot_token: str, file_path: str) -> bytes:
-    url = f"https://api.telegram.org/file/bot{bot_token}/{file_path}"
-    resp = requests.get(url, timeout=120)
-    resp.raise_for_status()
-    return resp.content
+def _max_file_bytes(settings) -> int:
+    mb = getattr(settings, "max_file_size_mb", None)
+    return int(20 if mb is None else mb) * 1024 * 1024
+
+
+def _telegram_download_file(bot_token: str, file_path: str, file_name: str, max_bytes: int = 0) -> Dict[str, Any]:
+    """Stream the file into private/files; returns file_url / file_size / content_hash."""
+    url = telegram_http.file_url(bot_token, file_path)
+    with telegram_http.get(url, timeout=120, stream=True) as resp:
+        resp.raise_for_status()
+        return stream_to_private_file(resp.iter_content(DOWNLOAD_CHUNK_SIZE), file_name, max_bytes)
 
 
 def _pick_file_from_message(message: Dict[str, Any]) -> Optional[Tuple[str, str, str]]:
@@ -92,6 +111,17 @@ def _pick_file_from_message(message: Dict[str, Any]) -> Optional[Tuple[str, str,
     return None
 
 
+def _declared_size(message: Dict[str, Any]) -> int:
+    """The size Telegram states for the file `_pick_file_from_message` takes (document, or the largest photo)."""
+    document = message.get("document")
+    if document:
+        return document.get("file_size") or 0
+    photos = message.get("photo")
+    if photos and isinstance(photos, list):
+        return max((p.get("file_size") or 0 for p in photos), default=0)
+    return 0
+
+
 def _infer_extension(filename: str, kind: str, mime_type: Optional[str] = None) -> str:
     ext = os.path.splitext(filename)[1].lower()
     if ext:
@@ -104,19 +134,21 @@ def _infer_extension(filename: str, kind: str, mime_type: Optional[str] = None)
             return guess
     return ".jpg" if kind == "image" else ""
 
-def _create_extracted_invoice_with_attachment(*, file_name: str, content: bytes, kind: str) -> str:
+def _create_extracted_invoice_with_attachment(*, stored: Dict[str, Any], kind: str, chat_id=None, message_key=None) -> str:
     # Pre-generate a Telegram-specific name
     inv_name = make_autoname("TG-EXT-INV-.#####")
 
-    # Create File first (we already know attached_to_name)
+    # Create File first (we already know attached_to_name); the bytes are already on disk
     file_doc = frappe.get_doc(
         {
             "doctype": "File",
-            "file_name": file_name,
+            "file_name": stored["file_name"],
+            "file_url": stored["file_url"],
+            "file_size": stored["file_size"],
+            "content_hash": stored["content_hash"],
             "attached_to_doctype": "Extracted Invoice",
             "attached_to_name": inv_name,
             "is_private": 1,
-            "content": content,
         }
     )
     file_doc.insert(ignore_permissions=True)
@@ -125,27 +157,27 @@ def _create_extracted_invoice_with_attachment(*, file_name: str, content: bytes,
     inv = frappe.new_doc("Extracted Invoice")
     inv.name = inv_name
     inv.flags.name_set = True  # prevent DocType autoname from overriding
+    inv.flags.skip_auto_extract = True  # queued per chat below
 
     if hasattr(inv, "status"):
         inv.status = "Draft"
     if hasattr(inv, "file_type"):
         inv.file_type = kind
+    if chat_id:
+        inv.telegram_chat_id = str(chat_id)
+    if message_key:
+        inv.telegram_message_key = message_key
 
     inv.original_file = file_doc.file_url
     inv.insert(ignore_permissions=True)
     
-    frappe.enqueue(
-        "invoice_extraction_app.api.extract_and_update_extracted_invoice",
-        queue="default",
-        job_name=f"auto_extract_{inv.name}",
-        invoice_name=inv.name,
-        enqueue_after_commit=True,
-    )
+    # Queued per chat so one busy chat cannot hold up the others
+    submit(inv.name, "telegram", tenant=f"chat:{chat_id or 'unknown'}", provider="Gemini")
 
     frappe.db.commit()
     return inv.name
 
-def _create_extracted_invoice_with_attachment1(*, file_name: str, content: bytes, kind: str) -> str:
+def _create_extracted_invoice_with_attachment1(*, file_name: str, content: bytes, kind: str, chat_id=None) -> str:
     """Create Extracted Invoice, attach file into original_file, return docname."""
     # Telegram naming series (independent)
     inv_name = make_autoname("TG-EXT-INV-.#####")
@@ -154,6 +186,8 @@ def _create_extracted_invoice_with_attachment1(*, file_name: str, content: bytes
     inv.name = inv_name  # enforce independent name
     inv.status = "Draft"
     inv.file_type = kind
+    if chat_id:
+        inv.telegram_chat_id = str(chat_id)
     inv.insert(ignore_permissions=True)
 
     file_doc = frappe.get_doc(
@@ -172,13 +206,8 @@ def _create_extracted_invoice_with_attachment1(*, file_name: str, content: bytes
     inv.save(ignore_permissions=True)
 
     # Enqueue auto-extraction after commit to avoid race issues
-    frappe.enqueue(
-        "invoice_extraction_app.api.extract_and_update_extracted_invoice",
-        queue="default",
-        job_name=f"tg_extract_{inv.name}",
-        invoice_name=inv.name,
-        enqueue_after_commit=True,
-    )
+    # Queued per chat so one busy chat cannot hold up the others
+    submit(inv.name, "telegram", tenant=f"chat:{chat_id or 'unknown'}", provider="Gemini")
 
     frappe.db.commit()
     return inv.name
@@ -187,18 +216,8 @@ def _create_extracted_invoice_with_attachment1(*, file_name: str, content: bytes
 @frappe.whitelist(allow_guest=True)
 def webhook() -> Dict[str, Any]:
     """Telegram webhook endpoint. Telegram will POST updates here."""
+    update, message = {}, None
     try:
-        settings = _get_telegram_settings()
-        if not settings:
-            return {"ok": False, "error": "Telegram Settings not found"}
-
-        if not getattr(settings, "t_enabled", 0):
-            return {"ok": True, "ignored": "Telegram integration disabled"}
-
-        bot_token = getattr(settings, "bot_token", None)
-        if not bot_token:
-            return {"ok": False, "error": "bot_token is not set in Telegram Settings"}
-
         update = frappe.local.form_dict or {}
         if not update and frappe.request:
             try:
@@ -210,6 +229,21 @@ def webhook() -> Dict[str, Any]:
         if not message:
             return {"ok": True, "ignored": "No message in update"}
 
+        # Redeliveries stop here, before any DB or network work
+        if not claim_telegram_update(update, message):
+            return {"ok": True, "ignored": "Duplicate update"}
+
+        settings = get_settings("Telegram Settings")
+        if not settings:
+            return {"ok": False, "error": "Telegram Settings not found"}
+
+        if not getattr(settings, "t_enabled", 0):
+            return {"ok": True, "ignored": "Telegram integration disabled"}
+
+        bot_token = getattr(settings, "bot_token", None)
+        if not bot_token:
+            return {"ok": False, "error": "bot_token is not set in Telegram Settings"}
+
         chat_id = _get_chat_id(message)
         admin_chat_id = getattr(settings, "admin_chat_id", None)
         if admin_chat_id not in (None, "", 0):
@@ -225,22 +259,43 @@ def webhook() -> Dict[str, Any]:
 
         file_id, file_name, kind = picked
 
+        message_key = telegram_message_key(message)
+        if message_key and frappe.db.exists("Extracted Invoice", {"telegram_message_key": message_key}):
+            return {"ok": True, "ignored": "Duplicate message"}
+
+        max_bytes = _max_file_bytes(settings)
+        declared = _declared_size(message)
+        if max_bytes and declared > max_bytes:
+            return {"ok": True, "ignored": f"File too large ({declared} bytes)"}
+
         file_meta = _telegram_get_file(bot_token, file_id)
         file_path = file_meta.get("file_path")
         if not file_path:
             return {"ok": False, "error": "Telegram did not return file_path"}
-
-        content = _telegram_download_file(bot_token, file_path)
+        if max_bytes and (file_meta.get("file_size") or 0) > max_bytes:
+            return {"ok": True, "ignored": f"File too large ({file_meta['file_size']} bytes)"}
 
         ext = _infer_extension(file_name, kind, file_meta.get("mime_type"))
         if ext and not file_name.lower().endswith(ext):
             file_name = f"{file_name}{ext}" if not file_name.endswith(".") else f"{file_name}{ext.lstrip('.')}"
 
-        inv_name = _create_extracted_invoice_with_attachment(
-            file_name=file_name,
-            content=content,
-            kind=kind,
-        )
+        try:
+            stored = _telegram_download_file(bot_token, file_path, file_name, max_bytes)
+        except FileTooLarge:
+            return {"ok": True, "ignored": f"File too large (over {max_bytes} bytes)"}
+
+        try:
+            inv_name = _create_extracted_invoice_with_attachment(
+                stored=stored,
+                kind=kind,
+                chat_id=chat_id,
+                message_key=message_key,
+            )
+        except frappe.UniqueValidationError:
+            # A concurrent delivery of the same message won the insert
+            frappe.db.rollback()
+            discard_private_file(stored)
+            return {"ok": True, "ignored": "Duplicate message"}
 
         return {
             "ok": True,
@@ -249,6 +304,7 @@ def webhook() -> Dict[str, Any]:
         }
 
     except Exception as e:
+        release_telegram_update(update, message)
         frappe.log_error(frappe.get_traceback(), "Telegram Webhook Error")
         return {"ok": False, "error": str(e)}
 
@@ -282,8 +338,8 @@ def setup_webhook1(webhook_base_url: Optional[str] = None) -> Dict[str, Any]:
     if not webhook_url.lower().startswith("https://"):
         return {"ok": False, "error": "webhook_requires_https", "computed_webhook_url": webhook_url}
 
-    url = f"https://api.telegram.org/bot{bot_token}/setWebhook"
-    resp = requests.post(url, data={"url": webhook_url}, timeout=30)
+    url = telegram_http.bot_url(bot_token, "setWebhook")
+    resp = telegram_http.post(url, data={"url": webhook_url}, timeout=30)
 
     try:
         payload = resp.json()
@@ -330,8 +386,8 @@ def setup_webhook() -> Dict[str, Any]:
     if not webhook_url.lower().startswith("https://"):
         return {"ok": False, "error": "webhook_requires_https", "computed_webhook_url": webhook_url}
 
-    api_url = f"https://api.telegram.org/bot{bot_token}/setWebhook"
-    resp = requests.post(api_url, data={"url": webhook_url}, timeout=30)
+    api_url = telegram_http.bot_url(bot_token, "setWebhook")
+    resp = telegram_http.post(api_url, data={"url": webhook_url}, timeout=30)
     data = resp.json()
 
     # Save display fields
@@ -368,8 +424,8 @@ def webhook_info() -> Dict[str, Any]:
     if not bot_token:
         return {"ok": False, "error": "bot_token is not set in Telegram Settings"}
 
-    url = f"https://api.telegram.org/bot{bot_token}/getWebhookInfo"
-    resp = requests.get(url, timeout=30)
+    url = telegram_http.bot_url(bot_token, "getWebhookInfo")
+    resp = telegram_http.get(url, timeout=30)
     try:
         return resp.json()
     except Exception:
@@ -387,8 +443,8 @@ def disable_webhook(drop_pending_updates: int = 0) -> Dict[str, Any]:
     if not bot_token:
         return {"ok": False, "error": "bot_token is not set in Telegram Settings"}
 
-    url = f"https://api.telegram.org/bot{bot_token}/setWebhook"
-    resp = requests.post(
+    url = telegram_http.bot_url(bot_token, "setWebhook")
+    resp = telegram_http.post(
         url,
         data={"url": "", "drop_pending_updates": bool(int(drop_pending_updates or 0))},
         timeout=30,
@@ -0,0 +1,125 @@
+# invoice_extraction_app/telegram_http.py
+"""
+One pooled, retrying HTTP session for the Telegram Bot API.
+
+The webhook modules (`telegram`, `telegram_mistral`) used to call bare
+`requests.get` / `requests.post`: a new TCP + TLS handshake for every
+getFile, download and setWebhook, and a burst of uploads that hit a 429 or
+a 5xx simply failed. All Bot API calls now go through `request`:
+
+  - one `requests.Session` per worker process (re-created after a fork),
+    with keep-alive and a connection pool sized for concurrent webhooks;
+  - connection errors retried by urllib3; 429 and 5xx answers retried here
+    with exponential backoff and jitter, waiting the `retry_after` Telegram
+    sends in the error body (or the Retry-After header) when there is one,
+    capped so a webhook never sleeps for minutes.
+
+The base URL is `telegram_api_base_url` in site_config (benchmarks, ops
+overrides), else "Bot API Base URL" in Telegram Settings (a local Bot API
+server), else api.telegram.org.
+"""
+from __future__ import annotations
+
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+import frappe
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from invoice_extraction_app.settings_cache import get_settings
+
+TELEGRAM_API_BASE = "https://api.telegram.org"
+RETRY_STATUS = {429, 500, 502, 503, 504}
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+# Longest wait honoured for a single retry_after; beyond it the call fails fast
+MAX_RETRY_AFTER = 30
+POOL_SIZE = 20
+CONNECT_RETRIES = 2
+
+_session: Optional[requests.Session] = None
+_session_pid: Optional[int] = None
+_lock = threading.Lock()
+
+
+def api_base() -> str:
+    base = frappe.conf.get("telegram_api_base_url")
+    if not base:
+        s = get_settings("Telegram Settings")
+        base = (s and s.get("api_base_url")) or TELEGRAM_API_BASE
+    return base.strip().rstrip("/")
+
+
+def bot_url(bot_token: str, method: str) -> str:
+    return f"{api_base()}/bot{bot_token}/{method}"
+
+
+def file_url(bot_token: str, file_path: str) -> str:
+    return f"{api_base()}/file/bot{bot_token}/{file_path}"
+
+
+def session() -> requests.Session:
+    """The worker's shared session; a forked worker gets its own connections."""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _lock:
+            if _session is None or _session_pid != pid:
+                s = requests.Session()
+                # Only connection failures here; status retries need the response body (retry_after)
+                adapter = HTTPAdapter(
+                    pool_connections=POOL_SIZE,
+                    pool_maxsize=POOL_SIZE,
+                    max_retries=Retry(total=CONNECT_RETRIES, connect=CONNECT_RETRIES, read=0, status=0,
+                                      backoff_factor=BACKOFF_BASE),
+                )
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                _session, _session_pid = s, pid
+    return _session
+
+
+def _retry_after(resp: requests.Response) -> Optional[float]:
+    """Seconds Telegram asks us to wait: `parameters.retry_after` in the body, else Retry-After."""
+    try:
+        value = ((resp.json() or {}).get("parameters") or {}).get("retry_after")
+    except Exception:
+        value = None
+    if value is None:
+        value = resp.headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt: int) -> float:
+    return BACKOFF_BASE * (2 ** attempt) * (0.5 + random.random())
+
+
+def request(method: str, url: str, max_retries: int = MAX_RETRIES, **kwargs) -> requests.Response:
+    """A Bot API call on the pooled session, retried on 429 / 5xx; the last response is returned as is."""
+    for attempt in range(max_retries + 1):
+        resp = session().request(method, url, **kwargs)
+        if resp.status_code not in RETRY_STATUS or attempt == max_retries:
+            return resp
+
+        wait = _retry_after(resp)
+        if wait is not None and wait > MAX_RETRY_AFTER:
+            return resp
+        resp.close()
+        time.sleep(wait if wait is not None else _backoff(attempt))
+    return resp
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
@@ -0,0 +1,202 @@
+# invoice_extraction_app/utils.py
+"""Small helpers shared by the Gemini, Mistral and Telegram modules."""
+from __future__ import annotations
+
+import hashlib
+import os
+import uuid
+from typing import Any, Dict, Iterable, List, Optional
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+RETRYABLE_NAMES = (
+    "Timeout",
+    "TimedOut",
+    "DeadlineExceeded",
+    "ServiceUnavailable",
+    "InternalServerError",
+    "ResourceExhausted",
+    "TooManyRequests",
+    "ConnectionError",
+    "ConnectError",
+    "RemoteProtocolError",
+    "HTTPError",
+)
+
+
+def _status_code(exc) -> int | None:
+    for attr in ("status_code", "code", "status"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+        # google.api_core exceptions expose `code` as an HTTP status enum / int
+        value = getattr(value, "value", None)
+        if isinstance(value, int) and value >= 100:
+            return value
+
+    # Not `or`: an error requests.Response is falsy (`Response.__bool__` is `ok`)
+    for attr in ("response", "raw_response"):
+        response = getattr(exc, attr, None)
+        if response is not None:
+            value = getattr(response, "status_code", None)
+            if isinstance(value, int):
+                return value
+    return None
+
+
+def is_retryable_error(exc: BaseException) -> bool:
+    """True for timeouts, connection failures, 429 and 5xx from any provider SDK or requests."""
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+
+    status = _status_code(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+
+    for cls in type(exc).__mro__:
+        if any(name in cls.__name__ for name in RETRYABLE_NAMES):
+            return True
+    return False
+
+
+class FileTooLarge(Exception):
+    pass
+
+
+def stream_to_private_file(chunks: Iterable[bytes], file_name: str, max_bytes: Optional[int] = None) -> dict:
+    """
+    Write a download to private/files chunk by chunk and hash it on the way.
+
+    Returns the values a File record needs (file_url, file_name, file_size,
+    content_hash). When identical content is already stored, the partial
+    download is discarded and the existing file_url is returned instead,
+    with `deduplicated` set.
+    """
+    import frappe
+
+    # Telegram / archive names are user input: never let them leave the folder
+    file_name = os.path.basename(file_name.replace("\\", "/")).lstrip(".") or "attachment"
+    folder = frappe.get_site_path("private", "files")
+    part = os.path.join(folder, f".{uuid.uuid4().hex}.part")
+    md5 = hashlib.md5()
+    size = 0
+    try:
+        with open(part, "wb") as f:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise FileTooLarge(f"{file_name} exceeds {max_bytes} bytes")
+                md5.update(chunk)
+                f.write(chunk)
+
+        # Same hash File uses for `content_hash` / duplicate detection
+        content_hash = md5.hexdigest()
+        existing = frappe.db.get_value("File", {"content_hash": content_hash, "is_private": 1}, "file_url")
+        if existing and os.path.exists(frappe.get_site_path(existing.lstrip("/"))):
+            os.remove(part)
+            return {
+                "file_url": existing,
+                "file_name": file_name,
+                "file_size": size,
+                "content_hash": content_hash,
+                "deduplicated": True,
+            }
+
+        # Claim the name with a hard link, which fails instead of overwriting: a check
+        # followed by a rename would let two concurrent downloads take the same name
+        stem, ext = os.path.splitext(file_name)
+        final_name = file_name
+        candidates = iter([f"{stem}{content_hash[-6:]}{ext}"])
+        while True:
+            try:
+                os.link(part, os.path.join(folder, final_name))
+                break
+            except FileExistsError:
+                final_name = next(candidates, None) or f"{stem}{uuid.uuid4().hex[:10]}{ext}"
+        os.remove(part)
+    except BaseException:
+        if os.path.exists(part):
+            os.remove(part)
+        raise
+
+    return {
+        "file_url": f"/private/files/{final_name}",
+        "file_name": final_name,
+        "file_size": size,
+        "content_hash": content_hash,
+    }
+
+
+def discard_private_file(stored: dict) -> None:
+    """Delete a file `stream_to_private_file` wrote when no File record will point at it."""
+    import frappe
+
+    if stored.get("deduplicated"):
+        # Another File owns it
+        return
+    path = frappe.get_site_path("private", "files", stored["file_name"])
+    if os.path.exists(path):
+        os.remove(path)
+
+
+# ---------------- Telegram redelivery ----------------
+TELEGRAM_SEEN_KEY = "invoice_extraction:tg_seen:{}"
+# Telegram gives up on undelivered updates after 24h
+TELEGRAM_SEEN_TTL = 24 * 3600
+
+
+def telegram_message_key(message: Dict[str, Any]) -> Optional[str]:
+    chat_id = (message.get("chat") or {}).get("id")
+    message_id = message.get("message_id")
+    if chat_id is None or message_id is None:
+        return None
+    return f"{chat_id}:{message_id}"
+
+
+def _seen_keys(update: Dict[str, Any], message: Optional[Dict[str, Any]]) -> List[str]:
+    keys = []
+    if update.get("update_id") is not None:
+        keys.append(TELEGRAM_SEEN_KEY.format(f"update:{update['update_id']}"))
+    message_key = telegram_message_key(message or {})
+    if message_key:
+        keys.append(TELEGRAM_SEEN_KEY.format(f"message:{message_key}"))
+    return keys
+
+
+def claim_telegram_update(update: Dict[str, Any], message: Optional[Dict[str, Any]]) -> bool:
+    """
+    False when this update (or the message it carries) was already taken.
+
+    One SET NX per key in Redis, before any DB or network work. The unique
+    `telegram_message_key` on Extracted Invoice still catches a duplicate if
+    Redis is unavailable or was flushed.
+    """
+    import frappe
+
+    cache = frappe.cache()
+    claimed = []
+    try:
+        for key in _seen_keys(update, message):
+            if not cache.set(cache.make_key(key), 1, ex=TELEGRAM_SEEN_TTL, nx=True):
+                # Give back what this call took so the first owner stays the only one
+                for k in claimed:
+                    cache.delete(cache.make_key(k))
+                return False
+            claimed.append(key)
+    except Exception:
+        # Redis down: let the DB unique key decide
+        return True
+    return True
+
+
+def release_telegram_update(update: Dict[str, Any], message: Optional[Dict[str, Any]]) -> None:
+    """Forget a claim whose processing failed so a redelivery can retry it."""
+    import frappe
+
+    try:
+        cache = frappe.cache()
+        for key in _seen_keys(update, message):
+            cache.delete(cache.make_key(key))
+    except Exception:
+        pass